@@ -0,0 +1,1179 @@
+""" Performance benchmarks for the makemore library.
+
+Each benchmark is a function that accepts the remaining command line args and
+prints its results. Benchmarks are registered in BENCHMARKS, and can be invoked
+through main.py:
+
+    python main.py benchmarks <benchmark_name> [benchmark_args]
+"""
+
+import sys
+import time
+import resource
+import subprocess
+import multiprocessing
+
+
+def _time_call(func, repeat: int = 1):
+    """ Calls a function repeatedly, returning the last result and the best
+    observed wall clock time in seconds.
+    """
+
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def bench_counts(args):
+    """ Compares batched bigram counting against the per-pair reference loop.
+    """
+
+    from lib import WordList, BigramEncoder, SimpleBigram
+    import torch
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    words = WordList(file_name)
+    encoder = BigramEncoder(words.vocabulary)
+    corpus = words.corpus
+    len(words[:])
+
+    loop_counts, loop_time = _time_call(
+        lambda: SimpleBigram._count_bigrams_loop(words, encoder))
+    batch_counts, batch_time = _time_call(
+        lambda: SimpleBigram._count_bigrams(corpus), repeat=5)
+
+    print(f'=== Bigram counting ({file_name}, {len(words)} words) ===')
+    print(f'loop   : {loop_time * 1000:>10.2f} ms')
+    print(f'batched: {batch_time * 1000:>10.2f} ms')
+    print(f'speedup: {loop_time / batch_time:>10.1f}x')
+    batch_counts = batch_counts.to(torch.float)
+    print(f'equal  : {torch.equal(loop_counts, batch_counts)}')
+
+
+def bench_parallel_counts(args):
+    """ Measures the scaling of sharded bigram counting with the number of
+    worker processes, on a synthetic corpus made of repeated copies of a word
+    list.
+    """
+
+    import os
+    import tempfile
+    from lib import WordList
+    from lib.parallel_count import count_bigrams_parallel
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    copies = int(args[1]) if len(args) > 1 else 200
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    if not data.endswith(b'\n'):
+        data += b'\n'
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_file = os.path.join(directory, 'corpus.txt')
+        with open(corpus_file, 'wb') as file:
+            for _ in range(copies):
+                file.write(data)
+        with WordList(corpus_file, streaming=True) as words:
+            vocabulary = words.vocabulary
+
+        print(f'=== Sharded counting ({file_name} x {copies}, '
+              f'{len(data) * copies / 2**20:.1f} MiB, '
+              f'{os.cpu_count()} CPUs) ===')
+        baseline, base_time = None, None
+        for workers in [1, 2, 4, 8]:
+            counts, elapsed = _time_call(lambda: count_bigrams_parallel(
+                corpus_file, vocabulary, workers))
+            if baseline is None:
+                baseline, base_time = counts, elapsed
+            print(f'workers={workers}: {elapsed * 1000:>10.2f} ms '
+                  f'speedup={base_time / elapsed:>5.2f}x '
+                  f'equal={bool((counts == baseline).all())}')
+
+
+def _measure_peak_memory(loader, file_name, queue):
+    """ Runs a loader in the current process and reports the growth in peak
+    resident memory, in bytes, through the queue.
+    """
+
+    from lib import WordList
+
+    # Warm up allocators and lazily imported modules on a tiny corpus.
+    loader(WordList('data/names-small.txt'))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = loader(WordList(file_name))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(((after - before) * 1024, len(result)))
+
+
+def _load_word_pairs(words):
+    """ Loads a corpus as Word objects with cached per-word pair lists. """
+
+    word_list = words[:]
+    for word in word_list:
+        word.get_pairs(1)
+    return word_list
+
+
+def _load_encoded_corpus(words):
+    """ Loads a corpus as an encoded token buffer. """
+
+    return words.corpus
+
+
+def bench_memory(args):
+    """ Compares peak memory used to load a corpus as Word objects against an
+    encoded corpus. Each loader runs in a fresh process.
+    """
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    with open(file_name) as file:
+        char_count = len(file.read())
+
+    context = multiprocessing.get_context('spawn')
+    print(f'=== Peak memory ({file_name}, {char_count} chars) ===')
+    for name, loader in [('words', _load_word_pairs),
+                         ('corpus', _load_encoded_corpus)]:
+        queue = context.Queue()
+        process = context.Process(target=_measure_peak_memory,
+                                  args=(loader, file_name, queue))
+        process.start()
+        peak, count = queue.get()
+        process.join()
+        print(f'{name:<7}: {peak / 2**20:>8.2f} MiB '
+              f'({peak / char_count:>7.1f} bytes/char, {count} words)')
+
+    from lib import EncodedCorpus
+    nbytes = EncodedCorpus.from_file(file_name).nbytes
+    print(f'buffers: {nbytes / 2**20:>8.2f} MiB '
+          f'({nbytes / char_count:>7.1f} bytes/char, retained by corpus)')
+
+
+def bench_encoder(args):
+    """ Compares bulk encoding and decoding through byte lookup tables against
+    per-character encoder calls.
+    """
+
+    from lib import WordList, BigramEncoder
+    import torch
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    words = WordList(file_name)
+    encoder = BigramEncoder(words.vocabulary)
+    text = '.' + '.'.join([word.text for word in words[:]]) + '.'
+
+    loop_indices, loop_encode = _time_call(lambda: torch.tensor(
+        [encoder.get_index(char) for char in text]))
+    bulk_indices, bulk_encode = _time_call(lambda: encoder.encode(text),
+                                           repeat=5)
+    loop_text, loop_decode = _time_call(lambda: ''.join(
+        [encoder.get_char(index) for index in bulk_indices.tolist()]))
+    bulk_text, bulk_decode = _time_call(lambda: encoder.decode(bulk_indices),
+                                        repeat=5)
+
+    print(f'=== Encoder ({file_name}, {len(text)} chars) ===')
+    for name, loop_time, bulk_time in [('encode', loop_encode, bulk_encode),
+                                       ('decode', loop_decode, bulk_decode)]:
+        print(f'{name}: per-char={loop_time * 1000:>10.2f} ms '
+              f'bulk={bulk_time * 1000:>8.2f} ms '
+              f'speedup={loop_time / bulk_time:>8.1f}x '
+              f'({len(text) / bulk_time / 1e6:.0f}M chars/sec)')
+    print(f'equal : encode={torch.equal(loop_indices, bulk_indices)} '
+          f'decode={loop_text == bulk_text}')
+
+
+def bench_score(args):
+    """ Compares whole word scoring with padded sequence batches against
+    scoring one word at a time, and reports the padding saved by bucketing.
+    """
+
+    from lib import WordList, BigramEncoder, SimpleBigram, batch_sequences
+    import torch
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    batch_size = int(args[1]) if len(args) > 1 else 1024
+    words = WordList(file_name)
+    encoder = BigramEncoder(words.vocabulary)
+    model = SimpleBigram(words, encoder)
+    texts = [word.text for word in words[:]]
+
+    loop_scores, loop_time = _time_call(lambda: torch.stack(
+        [model.score_words([text], encoder)[0] for text in texts]))
+    batch_scores, batch_time = _time_call(
+        lambda: model.score_words(words, encoder, batch_size), repeat=5)
+
+    print(f'=== Word scoring ({file_name}, {len(texts)} words) ===')
+    print(f'per-word: {loop_time * 1000:>10.2f} ms '
+          f'({len(texts) / loop_time:>10.0f} words/sec)')
+    print(f'batched : {batch_time * 1000:>10.2f} ms '
+          f'({len(texts) / batch_time:>10.0f} words/sec)')
+    print(f'equal   : {torch.allclose(loop_scores, batch_scores)}')
+    for bucket in [False, True]:
+        padded, total = 0, 0
+        for batch in batch_sequences(words, words.vocabulary, batch_size,
+                                     bucket):
+            padded += batch.indices.nelement()
+            total += batch.lengths.sum().item()
+        print(f'padding (bucket={bucket}): {1 - total / padded:.1%}')
+
+
+async def _run_load_test(host: str, port: int, kind: str, concurrency: int,
+                         requests: int) -> list[float]:
+    """ Sends requests to a name server over keep-alive connections, and
+    returns the latency of every request in seconds.
+    """
+
+    import asyncio
+    import json
+
+    if kind == 'generate':
+        request = (f'GET /generate?count=1 HTTP/1.1\r\nHost: {host}\r\n'
+                   '\r\n').encode('latin-1')
+    else:
+        body = json.dumps({'words': ['emma', 'olivia', 'ava']})
+        request = (f'POST /score HTTP/1.1\r\nHost: {host}\r\n'
+                   f'Content-Length: {len(body)}\r\n\r\n{body}').encode(
+                       'latin-1')
+
+    async def client(count: int) -> list[float]:
+        reader, writer = await asyncio.open_connection(host, port)
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            headers = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in headers.decode('latin-1').split('\r\n'):
+                if line.lower().startswith('content-length:'):
+                    length = int(line.split(':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+        return latencies
+
+    counts = [requests // concurrency + (index < requests % concurrency)
+              for index in range(concurrency)]
+    results = await asyncio.gather(*[client(count) for count in counts])
+    return [latency for latencies in results for latency in latencies]
+
+
+def bench_server(args):
+    """ Load tests a running name server (python main.py serve), reporting
+    p50/p99 latency and requests per second.
+
+    Args: [host:port] [generate|score] [concurrency] [requests]
+    """
+
+    import asyncio
+    import statistics
+
+    address = args[0] if len(args) > 0 else '127.0.0.1:8000'
+    kind = args[1] if len(args) > 1 else 'generate'
+    concurrency = int(args[2]) if len(args) > 2 else 32
+    requests = int(args[3]) if len(args) > 3 else 2000
+    host, _, port = address.partition(':')
+
+    start = time.perf_counter()
+    latencies = asyncio.run(
+        _run_load_test(host, int(port), kind, concurrency, requests))
+    elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'=== Server load test ({address}, {kind}, '
+          f'concurrency={concurrency}) ===')
+    print(f'requests: {len(latencies)} in {elapsed:.2f} s '
+          f'({len(latencies) / elapsed:.0f} req/sec)')
+    print(f'latency : p50={quantiles[49] * 1000:.2f} ms '
+          f'p99={quantiles[98] * 1000:.2f} ms '
+          f'max={max(latencies) * 1000:.2f} ms')
+
+
+def bench_profiling(args):
+    """ Measures the per-call overhead of profiling instrumentation, when
+    disabled and when enabled, on a small function decorated in each state.
+    """
+
+    from lib import BigramEncoder, profiling
+
+    calls = int(args[0]) if len(args) > 0 else 100000
+    encoder = BigramEncoder(['.', 'a', 'b'])
+    raw_encode = getattr(type(encoder).encode, '__wrapped__',
+                         type(encoder).encode)
+
+    def run(func):
+        for _ in range(calls):
+            func(encoder, 'ab')
+
+    was_enabled = profiling.is_enabled()
+    _, raw_time = _time_call(lambda: run(raw_encode), repeat=3)
+    profiling.disable()
+    disabled_encode = profiling.profiled('encode')(raw_encode)
+    _, disabled_time = _time_call(lambda: run(disabled_encode), repeat=3)
+    profiling.enable()
+    enabled_encode = profiling.profiled('encode')(raw_encode)
+    _, enabled_time = _time_call(lambda: run(enabled_encode), repeat=3)
+    profiling.disable()
+    profiling.reset()
+    if was_enabled:
+        profiling.enable()
+
+    print(f'=== Profiling overhead ({calls} calls) ===')
+    for name, elapsed in [('raw', raw_time), ('disabled', disabled_time),
+                          ('enabled', enabled_time)]:
+        overhead = (elapsed - raw_time) / calls * 1e9
+        print(f'{name:<8}: {elapsed * 1e9 / calls:>8.0f} ns/call '
+              f'(overhead {overhead:>6.0f} ns/call)')
+    print(f'functions decorated while disabled are unchanged: '
+          f'{disabled_encode is raw_encode}')
+
+
+def bench_startup(args):
+    """ Measures the startup time of light commands, each in a fresh
+    interpreter, against the time taken to import torch.
+    """
+
+    repeat = int(args[0]) if len(args) > 0 else 5
+    commands = [
+        ('python', ['-c', 'pass']),
+        ('import lib', ['-c', 'import lib']),
+        ('import torch', ['-c', 'import torch']),
+        ('main.py', ['main.py']),
+        ('main.py vocabulary', ['main.py', 'vocabulary']),
+    ]
+
+    print(f'=== Startup time (best of {repeat}) ===')
+    for name, command in commands:
+
+        def run():
+            subprocess.run([sys.executable] + command,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+
+        _, elapsed = _time_call(run, repeat=repeat)
+        print(f'{name:<20}: {elapsed * 1000:>9.1f} ms')
+
+
+def bench_neuron_inputs(args):
+    """ Compares NeuronBigram training with one-hot inputs against index
+    inputs. Both start from the same weights, for which their losses are
+    identical. Gradients are accumulated in a different order, so the losses
+    after training only agree within floating point tolerance.
+    """
+
+    from lib import EncodedCorpus, BigramEncoder, NeuronBigram, init_random
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    steps = int(args[1]) if len(args) > 1 else 20
+    corpus = EncodedCorpus.from_file(file_name)
+    encoder = BigramEncoder(corpus.vocabulary)
+
+    print(f'=== NeuronBigram inputs ({file_name}, {steps} steps) ===')
+    initial_losses, losses = [], []
+    for use_indices in [False, True]:
+        init_random(2147483647)
+        model = NeuronBigram(corpus.vocabulary_size, use_indices=use_indices)
+        inputs, labels = model.prepare_data(corpus, encoder)
+        nbytes = sum(tensor.element_size() * tensor.nelement()
+                     for tensor in [inputs, labels])
+        initial_losses.append(model.get_loss(inputs, labels).item())
+
+        def train():
+            loss = None
+            for _ in range(steps):
+                _, loss = model(inputs, labels)
+                model.reset_grad()
+                loss.backward()
+                model.update(50)
+            return loss
+
+        loss, elapsed = _time_call(train)
+        losses.append(loss.item())
+        name = 'indices' if use_indices else 'one-hot'
+        print(f'{name:<7}: data={nbytes / 2**20:>8.2f} MiB '
+              f'step={elapsed * 1000 / steps:>8.2f} ms '
+              f'initial_loss={initial_losses[-1]:.8f} '
+              f'loss={loss.item():.8f}')
+    print(f'initial losses equal={initial_losses[0] == initial_losses[1]} '
+          f'trained loss difference={abs(losses[0] - losses[1]):.2e}')
+
+
+def bench_parallel_train(args):
+    """ Measures the scaling of data-parallel NeuronBigram training with the
+    number of worker processes, and compares the trained weights against
+    single process training. Throughput is averaged over the training epochs,
+    and excludes process startup.
+    """
+
+    import os
+    import torch
+    from lib import EncodedCorpus, BigramEncoder, NeuronBigram, Trainer
+    from lib import fit_parallel, init_random
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    epochs = int(args[1]) if len(args) > 1 else 5
+    batch_size = int(args[2]) if len(args) > 2 else 8192
+    threads = int(args[3]) if len(args) > 3 else 1
+    corpus = EncodedCorpus.from_file(file_name)
+    encoder = BigramEncoder(corpus.vocabulary)
+
+    def train(workers):
+        init_random(2147483647)
+        model = NeuronBigram(corpus.vocabulary_size, use_indices=True)
+        inputs, labels = model.prepare_data(corpus, encoder)
+        options = {
+            'learning_rate': 50.0,
+            'batch_size': batch_size,
+            'epochs': epochs,
+        }
+        start = time.perf_counter()
+        if workers is None:
+            torch.set_num_threads(threads)
+            history = Trainer(model, **options).fit(inputs, labels)
+        else:
+            history = fit_parallel(model,
+                                   inputs,
+                                   labels,
+                                   workers=workers,
+                                   threads=threads,
+                                   **options)
+        elapsed = time.perf_counter() - start
+        return model, history, elapsed
+
+    print(f'=== Data-parallel training ({file_name}, {epochs} epochs, '
+          f'batch_size={batch_size}, threads={threads}, '
+          f'{os.cpu_count()} CPUs) ===')
+    baseline, history, elapsed = train(None)
+    weights = baseline.parameters()[0].detach()
+    base_rate = sum(stats['tokens_per_second'] for stats in history) / epochs
+    print(f'single   : tokens/sec={base_rate:>10.0f} '
+          f'total={elapsed:>7.2f} s loss={history[-1]["loss"]:.8f}')
+    for workers in [1, 2, 4, 8]:
+        model, history, elapsed = train(workers)
+        rate = sum(stats['tokens_per_second'] for stats in history) / epochs
+        difference = (model.parameters()[0] - weights).abs().max().item()
+        print(f'workers={workers}: tokens/sec={rate:>10.0f} '
+              f'total={elapsed:>7.2f} s loss={history[-1]["loss"]:.8f} '
+              f'speedup={rate / base_rate:>5.2f}x '
+              f'max_weight_diff={difference:.2e}')
+
+
+def bench_context_mlp(args):
+    """ Measures training and inference throughput of ContextMLP for several
+    context lengths, against NeuronBigram trained for the same number of
+    epochs. Inference compares folded table row gathers with the embedding
+    matrix multiplication, and with one-hot inputs, over chunks of windows.
+    """
+
+    import torch
+    from lib import EncodedCorpus, BigramEncoder, ContextEncoder, ContextMLP
+    from lib import NeuronBigram, Trainer, init_random
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    epochs = int(args[1]) if len(args) > 1 else 1
+    batch_size = int(args[2]) if len(args) > 2 else 256
+    chunk_size = int(args[3]) if len(args) > 3 else 1024
+    corpus = EncodedCorpus.from_file(file_name)
+
+    def train(model, inputs, labels, learning_rate):
+        trainer = Trainer(model, learning_rate, None, batch_size, epochs)
+        history = trainer.fit(inputs, labels)
+        rate = sum(stats['tokens_per_second'] for stats in history) / epochs
+        return rate, history[-1]['loss'], trainer.evaluate(inputs, labels)
+
+    print(f'=== Context MLP ({file_name}, {epochs} epochs, '
+          f'batch_size={batch_size}, inference chunks of {chunk_size}) ===')
+    init_random(2147483647)
+    bigram = NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    inputs, labels = bigram.prepare_data(corpus, BigramEncoder(
+        corpus.vocabulary))
+    rate, _, loss = train(bigram, inputs, labels, 50.0)
+    print(f'NeuronBigram       : train={rate:>9.0f} tokens/sec '
+          f'loss={loss:.4f}')
+
+    for context_length in [1, 2, 3, 4, 5]:
+        init_random(2147483647)
+        encoder = ContextEncoder(corpus.vocabulary, context_length)
+        model = ContextMLP(corpus.vocabulary_size, context_length)
+        (inputs, labels), prepare_time = _time_call(
+            lambda: model.prepare_data(corpus, encoder), repeat=3)
+        rate, _, loss = train(model, inputs, labels, 0.1)
+
+        parameters = model.parameters()
+        embeddings, hidden_weights, hidden_bias = parameters[:3]
+        one_hot = torch.eye(corpus.vocabulary_size)
+        chunks = inputs.split(chunk_size)
+
+        def gather_hidden():
+            return torch.cat([model._get_hidden(chunk) for chunk in chunks])
+
+        def matmul_hidden():
+            return torch.cat([
+                torch.tanh(embeddings[chunk].reshape(chunk.shape[0], -1)
+                           @ hidden_weights + hidden_bias)
+                for chunk in chunks
+            ])
+
+        def one_hot_hidden():
+            return torch.cat([
+                torch.tanh((one_hot[chunk] @ embeddings).reshape(
+                    chunk.shape[0], -1) @ hidden_weights + hidden_bias)
+                for chunk in chunks
+            ])
+
+        with torch.no_grad():
+            gathered, gather_time = _time_call(gather_hidden, repeat=3)
+            multiplied, matmul_time = _time_call(matmul_hidden, repeat=3)
+            _, one_hot_time = _time_call(one_hot_hidden, repeat=3)
+        count = inputs.shape[0]
+        difference = (gathered - multiplied).abs().max().item()
+        print(f'ContextMLP(n={context_length})  : train={rate:>9.0f} '
+              f'tokens/sec loss={loss:.4f} '
+              f'prepare={prepare_time * 1000:.1f} ms')
+        print(f'  hidden layer: gather={count / gather_time:>10.0f} '
+              f'matmul={count / matmul_time:>10.0f} '
+              f'one-hot={count / one_hot_time:>10.0f} tokens/sec '
+              f'max_diff={difference:.1e}')
+
+
+def _legacy_neuron_loss(model, inputs, labels):
+    """ NeuronBigram loss as computed before get_loss(), by normalizing the
+    exponentiated logits and taking the log of the label probabilities. """
+
+    import torch
+
+    weights = model.parameters()[0]
+    counts = weights[inputs].exp()
+    probs = counts / counts.sum(1, keepdim=True)
+    return -probs[torch.arange(probs.shape[0]), labels].log().mean()
+
+
+def _probe_neuron_loss(variant: str, file_name: str, batch_size: int,
+                       steps: int, queue):
+    """ Trains NeuronBigram for a number of steps in a fresh process with one
+    of the loss computations, and reports the time per step, the growth of
+    peak memory over the dataset and the final loss through the queue.
+    """
+
+    from lib import EncodedCorpus, BigramEncoder, NeuronBigram, init_random
+
+    init_random(2147483647)
+    corpus = EncodedCorpus.from_file(file_name)
+    model = NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    inputs, labels = model.prepare_data(corpus, BigramEncoder(
+        corpus.vocabulary))
+    inputs, labels = inputs[:batch_size], labels[:batch_size]
+
+    def compute_loss():
+        if variant == 'legacy':
+            return _legacy_neuron_loss(model, inputs, labels)
+        if variant == 'call':
+            return model(inputs, labels)[1]
+        return model.get_loss(inputs, labels)
+
+    def read_peak():
+        with open('/proc/self/status') as file:
+            return [int(line.split()[1]) * 1024 for line in file
+                    if line.startswith('VmHWM:')][0]
+
+    before = read_peak()
+    loss = None
+    start = time.perf_counter()
+    for _ in range(steps):
+        loss = compute_loss()
+        model.reset_grad()
+        loss.backward()
+        model.update(50)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed / steps, read_peak() - before, loss.item()))
+
+
+def bench_neuron_loss(args):
+    """ Compares the NeuronBigram loss computed from normalized probabilities
+    (legacy), through __call__(), and through the fused get_loss(), for the
+    time per training step, the peak memory of a step, and the stability of
+    the loss with large logits. Also compares __call__() with the inference
+    mode predict().
+    """
+
+    import torch
+    from lib import EncodedCorpus, BigramEncoder, NeuronBigram, init_random
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    steps = int(args[1]) if len(args) > 1 else 20
+    corpus = EncodedCorpus.from_file(file_name)
+
+    print(f'=== NeuronBigram loss ({file_name}, {steps} steps) ===')
+    context = multiprocessing.get_context('spawn')
+    for batch_size in [32768, len(corpus.tokens) - 1]:
+        for variant in ['legacy', 'call', 'fused']:
+            queue = context.Queue()
+            process = context.Process(target=_probe_neuron_loss,
+                                      args=(variant, file_name, batch_size,
+                                            steps, queue))
+            process.start()
+            step_time, peak, loss = queue.get()
+            process.join()
+            print(f'batch={batch_size:>7} {variant:<6}: '
+                  f'step={step_time * 1000:>8.2f} ms '
+                  f'peak={peak / 2**20:>8.2f} MiB loss={loss:.6f}')
+
+    init_random(2147483647)
+    model = NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    inputs, labels = model.prepare_data(corpus, BigramEncoder(
+        corpus.vocabulary))
+    _, call_time = _time_call(lambda: model(inputs), repeat=5)
+    _, predict_time = _time_call(lambda: model.predict(inputs), repeat=5)
+    print(f'inference: __call__={call_time * 1000:>8.2f} ms '
+          f'predict={predict_time * 1000:>8.2f} ms')
+
+    with torch.no_grad():
+        model.parameters()[0].mul_(100)
+    legacy = _legacy_neuron_loss(model, inputs, labels).item()
+    fused = model.get_loss(inputs, labels).item()
+    print(f'large logits: legacy loss={legacy} fused loss={fused:.4f}')
+
+
+def bench_quantize(args):
+    """ Compares inference-only QuantizedBigram exports of trained
+    SimpleBigram and NeuronBigram models at every precision, with and without
+    precomputed log probabilities: memory of the tables, sampling and scoring
+    time, and the change in loss on the word list.
+    """
+
+    from lib import EncodedCorpus, BigramEncoder, SimpleBigram, NeuronBigram
+    from lib import QuantizedBigram, Trainer, init_random
+    from lib.quantized_bigram import PRECISIONS
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    count = int(args[1]) if len(args) > 1 else 10000
+    corpus = EncodedCorpus.from_file(file_name)
+    encoder = BigramEncoder(corpus.vocabulary)
+    tokens = len(corpus.tokens) - 1
+
+    init_random(2147483647)
+    neuron_model = NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    Trainer(neuron_model, 50.0,
+            epochs=200).fit(*neuron_model.prepare_data(corpus, encoder))
+
+    print(f'=== Quantized bigrams ({file_name}, {count} words) ===')
+    for model in [SimpleBigram(corpus, encoder), neuron_model]:
+        reference = model.score_words(corpus, encoder).sum().item() / tokens
+        print(f'{model}: loss={reference:.6f}')
+        for log_probs in [True, False]:
+            base_bytes = None
+            for precision in PRECISIONS:
+                quantized = QuantizedBigram.export(model, precision, log_probs)
+                if base_bytes is None:
+                    base_bytes = quantized.nbytes
+                init_random(2147483647)
+                _, generate_time = _time_call(
+                    lambda: quantized.generate_words(encoder, count),
+                    repeat=3)
+                scores, score_time = _time_call(
+                    lambda: quantized.score_words(corpus, encoder), repeat=3)
+                loss = scores.sum().item() / tokens
+                print(f'  {precision:<8} log_probs={log_probs!s:<5}: '
+                      f'size={quantized.nbytes:>6} bytes '
+                      f'({quantized.nbytes / base_bytes:>4.2f}x) '
+                      f'generate={generate_time * 1000:>7.2f} ms '
+                      f'score={score_time * 1000:>7.2f} ms '
+                      f'loss_delta={loss - reference:+.2e}')
+
+
+def bench_top_words(args):
+    """ Compares the exact top-K search of SimpleBigram.top_words() with
+    brute-force sampling, which generates words, removes duplicates and keeps
+    the K most likely ones. Reports the time of each approach, and the
+    fraction of the exact top K words that sampling recovers.
+    """
+
+    from lib import WordList, BigramEncoder, SimpleBigram, init_random
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    sample_counts = [100000, 1000000]
+    words = WordList(file_name)
+    encoder = BigramEncoder(words.vocabulary)
+    model = SimpleBigram(words, encoder)
+
+    print(f'=== Top words ({file_name}) ===')
+    for prefix in ['', 'em']:
+        for count in [100, 1000, 5000]:
+            results, search_time = _time_call(
+                lambda: model.top_words(encoder, count, prefix=prefix))
+            expected = set(word for word, _ in results)
+            print(f'prefix={prefix!r:<5} K={count:>5}: '
+                  f'search={search_time * 1000:>8.2f} ms')
+            for sample_count in sample_counts:
+                init_random(2147483647)
+                start = time.perf_counter()
+                sampled = set(
+                    word
+                    for word in model.generate_words(encoder, sample_count)
+                    if word.startswith(prefix) and len(word) > 0)
+                scores = model.score_words(list(sampled), encoder)
+                ranked = sorted(zip(scores.tolist(), sampled))[:count]
+                sample_time = time.perf_counter() - start
+                recall = len(expected & set(word for _, word in ranked)) / \
+                    len(expected)
+                print(f'  sampling {sample_count:>8} words: '
+                      f'{sample_time * 1000:>8.2f} ms '
+                      f'({sample_time / search_time:>7.1f}x) '
+                      f'recall={recall:.3f}')
+
+
+def bench_prefix_index(args):
+    """ Builds, saves and loads a PrefixIndex, and compares its prefix
+    queries with scanning every word of the WordList.
+    """
+
+    import collections
+    import os
+    import tempfile
+    from lib import WordList, PrefixIndex
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    words = WordList(file_name)
+
+    index, build_time = _time_call(lambda: PrefixIndex(words))
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index')
+        index.save(index_file)
+        index, load_time = _time_call(lambda: PrefixIndex.load(index_file),
+                                      repeat=5)
+        print(f'=== Prefix index ({file_name}) ===')
+        print(f'{index}: size={index.nbytes} bytes '
+              f'build={build_time * 1000:.2f} ms '
+              f'load={load_time * 1000:.2f} ms')
+
+        def scan(prefix):
+            return [
+                words[position].text for position in range(len(words))
+                if words[position].text.startswith(prefix)
+            ]
+
+        def scan_top(prefix, count):
+            return collections.Counter(scan(prefix)).most_common(count)
+
+        for prefix in ['', 'a', 'em', 'emm', 'emmal']:
+            matches, index_time = _time_call(
+                lambda: index.get_words(prefix), repeat=5)
+            _, scan_time = _time_call(lambda: scan(prefix))
+            _, top_time = _time_call(lambda: index.top_words(prefix, 10),
+                                     repeat=5)
+            _, scan_top_time = _time_call(lambda: scan_top(prefix, 10))
+            print(f'prefix={prefix!r:<8} matches={len(matches):>6}: '
+                  f'all index={index_time * 1000:>8.3f} ms '
+                  f'scan={scan_time * 1000:>8.2f} ms | '
+                  f'top-10 index={top_time * 1000:>8.3f} ms '
+                  f'scan={scan_top_time * 1000:>8.2f} ms')
+
+
+def bench_generate(args):
+    """ Compares generating words one at a time against batched generation.
+    """
+
+    from lib import EncodedCorpus, BigramEncoder, SimpleBigram, NeuronBigram
+    from lib import init_random
+
+    count = int(args[0]) if len(args) > 0 else 10000
+    corpus = EncodedCorpus.from_file('data/names.txt')
+    encoder = BigramEncoder(corpus.vocabulary)
+    init_random(2147483647)
+    models = [
+        SimpleBigram(corpus, encoder),
+        NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    ]
+
+    print(f'=== Word generation ({count} words) ===')
+    for model in models:
+        init_random(2147483647)
+        _, loop_time = _time_call(
+            lambda: [model.generate_word(encoder) for _ in range(count)])
+        init_random(2147483647)
+        _, batch_time = _time_call(
+            lambda: model.generate_words(encoder, count))
+        print(f'{model}')
+        print(f'  loop   : {loop_time * 1000:>10.2f} ms '
+              f'({count / loop_time:>10.0f} words/sec)')
+        print(f'  batched: {batch_time * 1000:>10.2f} ms '
+              f'({count / batch_time:>10.0f} words/sec)')
+
+
+def bench_sampler(args):
+    """ Compares the frozen alias sampler against torch.multinomial sampling,
+    checking that both produce the same next character distributions.
+    """
+
+    from lib import EncodedCorpus, BigramEncoder, SimpleBigram, NeuronBigram
+    from lib import AliasSampler, init_random
+    import numpy as np
+    import torch
+
+    samples = int(args[0]) if len(args) > 0 else 200000
+    corpus = EncodedCorpus.from_file('data/names.txt')
+    encoder = BigramEncoder(corpus.vocabulary)
+    init_random(2147483647)
+    models = [
+        SimpleBigram(corpus, encoder),
+        SimpleBigram(EncodedCorpus.from_file('data/names.txt', 'numpy'),
+                     encoder,
+                     backend='numpy'),
+        NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    ]
+
+    print(f'=== Alias sampler ({samples} samples per row) ===')
+    for model in models:
+        transitions = torch.as_tensor(model.get_transitions())
+        sampler, build_time = _time_call(
+            lambda: AliasSampler.from_model(model, encoder))
+        size = transitions.shape[0]
+        rows = np.repeat(np.arange(size), samples)
+        rng = np.random.default_rng(2147483647)
+
+        alias_samples, alias_time = _time_call(
+            lambda: sampler.sample(rows, rng))
+        row_tensor = torch.from_numpy(rows)
+        torch_samples, torch_time = _time_call(lambda: torch.multinomial(
+            transitions[row_tensor], 1, replacement=True).squeeze(1))
+
+        # Total variation distance between the empirical distributions of the
+        # two samplers, and between each sampler and the model.
+        expected = transitions.numpy()
+        alias_freq = np.bincount(rows * size + alias_samples,
+                                 minlength=size * size).reshape(
+                                     size, size) / samples
+        torch_freq = np.bincount(rows * size + torch_samples.numpy(),
+                                 minlength=size * size).reshape(
+                                     size, size) / samples
+        print(f'{model}')
+        print(f'  build      : {build_time * 1000:>10.2f} ms')
+        print(f'  alias      : {alias_time * 1000:>10.2f} ms '
+              f'({rows.shape[0] / alias_time:>12.0f} samples/sec)')
+        print(f'  multinomial: {torch_time * 1000:>10.2f} ms '
+              f'({rows.shape[0] / torch_time:>12.0f} samples/sec)')
+        print('  max row TVD: alias/model='
+              f'{0.5 * np.abs(alias_freq - expected).sum(1).max():.4f} '
+              'multinomial/model='
+              f'{0.5 * np.abs(torch_freq - expected).sum(1).max():.4f} '
+              'alias/multinomial='
+              f'{0.5 * np.abs(alias_freq - torch_freq).sum(1).max():.4f}')
+
+
+def bench_ngram(args):
+    """ Reports build time, memory and loss of sparse n-gram models, compared
+    against the size of an equivalent dense count tensor.
+    """
+
+    from lib import EncodedCorpus, BigramEncoder, SimpleNgram
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    corpus = EncodedCorpus.from_file(file_name)
+    encoder = BigramEncoder(corpus.vocabulary)
+    size = corpus.vocabulary_size
+
+    print(f'=== Sparse n-gram models ({file_name}) ===')
+    for n in range(2, 8):
+        model, build_time = _time_call(
+            lambda: SimpleNgram(corpus, encoder, n=n, k=0.01))
+        inputs, labels = model.prepare_data(corpus, encoder)
+        _, loss = model(inputs, labels)
+        dense_bytes = 4 * size**n
+        print(f'n={n}: build={build_time * 1000:>8.2f} ms '
+              f'sparse={model.nbytes / 2**20:>8.2f} MiB '
+              f'dense={dense_bytes / 2**20:>12.2f} MiB '
+              f'loss={loss.item():.4f}')
+
+
+def _peak_memory() -> int:
+    """ Returns the peak resident memory of the current process in bytes. """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _probe_backend(backend: str, file_name: str, count: int, queue):
+    """ Loads a SimpleBigram checkpoint with a backend in a fresh process,
+    including the import of the library, and generates words from it.
+    Reports the timings, the peak memory and whether torch was imported
+    through the queue.
+    """
+
+    import sys
+
+    start = time.perf_counter()
+    from lib import SimpleBigram, init_random
+    model, encoder = SimpleBigram.load(file_name, backend)
+    load_time = time.perf_counter() - start
+
+    init_random(2147483647)
+    _, generate_time = _time_call(lambda: model.generate_words(encoder, count),
+                                  repeat=3)
+
+    # The peak resident memory reported by getrusage() survives exec(), so the
+    # high water mark of the process image is read instead.
+    with open('/proc/self/status') as file:
+        peak = [int(line.split()[1]) * 1024 for line in file
+                if line.startswith('VmHWM:')][0]
+    queue.put((load_time, generate_time, peak, 'torch' in sys.modules))
+
+
+def bench_backends(args):
+    """ Compares the torch and NumPy backends of SimpleBigram: counts and
+    log-likelihoods, in process build and scoring times, and the load time,
+    sampling time and memory of a checkpoint loaded in a fresh process.
+    """
+
+    import os
+    import tempfile
+    from lib import WordList, BigramEncoder, SimpleBigram
+
+    file_name = args[0] if len(args) > 0 else 'data/names.txt'
+    count = int(args[1]) if len(args) > 1 else 10000
+    words = WordList(file_name)
+    encoder = BigramEncoder(words.vocabulary)
+
+    print(f'=== Array backends ({file_name}, {count} words) ===')
+    models, scores = {}, {}
+    for backend in ['torch', 'numpy']:
+        models[backend], build_time = _time_call(
+            lambda: SimpleBigram(WordList(file_name), encoder,
+                                 backend=backend),
+            repeat=3)
+        scores[backend], score_time = _time_call(
+            lambda: models[backend].score_words(words, encoder), repeat=3)
+        print(f'{backend:<6}: build={build_time * 1000:>8.2f} ms '
+              f'score={score_time * 1000:>8.2f} ms')
+
+    import numpy
+    probs = [
+        numpy.asarray(model.get_transitions()) for model in models.values()
+    ]
+    log_likelihoods = [numpy.asarray(score) for score in scores.values()]
+    print(f'equal probabilities  : {numpy.array_equal(*probs)}')
+    print(f'equal log-likelihoods: {numpy.array_equal(*log_likelihoods)}')
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_file = os.path.join(directory, 'model.ckpt')
+        models['torch'].save(checkpoint_file, encoder)
+        for backend in ['torch', 'numpy']:
+            queue = context.Queue()
+            process = context.Process(target=_probe_backend,
+                                      args=(backend, checkpoint_file, count,
+                                            queue))
+            process.start()
+            load_time, generate_time, peak, uses_torch = queue.get()
+            process.join()
+            print(f'{backend:<6}: load={load_time * 1000:>8.2f} ms '
+                  f'generate={generate_time * 1000:>8.2f} ms '
+                  f'peak={peak / 2**20:>7.1f} MiB torch={uses_torch}')
+
+
+def _run_suite_stages(file_name: str, repeat: int, generate_count: int,
+                      queue):
+    """ Times each stage of the pipeline on a single corpus, in the current
+    process, and reports a list of results through the queue.
+    """
+
+    from lib import WordList, EncodedCorpus, BigramEncoder
+    from lib import SimpleBigram, NeuronBigram, init_random
+
+    results = []
+
+    def measure(stage, func, items, stage_repeat=repeat):
+        before = _peak_memory()
+        result, elapsed = _time_call(func, stage_repeat)
+        results.append({
+            'stage': stage,
+            'seconds': elapsed,
+            'items': items,
+            'throughput': items / elapsed if elapsed > 0 else None,
+            'peak_mib': (_peak_memory() - before) / 2**20,
+        })
+        return result
+
+    # Warm up lazily initialized torch kernels so that they are not
+    # attributed to the first stage.
+    SimpleBigram(EncodedCorpus.from_file('data/names-small.txt'),
+                 BigramEncoder(['.']))
+
+    with open(file_name) as file:
+        text = file.read()
+    corpus = measure('load', lambda: WordList(file_name).corpus,
+                     len(text.splitlines()))
+    word_count = len(corpus)
+    measure('vocabulary', lambda: EncodedCorpus.build_vocabulary(text),
+            len(text))
+    encoder = BigramEncoder(corpus.vocabulary)
+
+    init_random(2147483647)
+    neuron_model = NeuronBigram(corpus.vocabulary_size, use_indices=True)
+    inputs, labels = measure(
+        'prepare', lambda: neuron_model.prepare_data(corpus, encoder),
+        corpus.tokens.shape[0] - 1)
+    simple_model = measure('counts', lambda: SimpleBigram(corpus, encoder),
+                           corpus.tokens.shape[0] - 1)
+
+    def train_step():
+        _, loss = neuron_model(inputs, labels)
+        neuron_model.reset_grad()
+        loss.backward()
+        neuron_model.update(50)
+
+    measure('train_step', train_step, labels.shape[0])
+    init_random(2147483647)
+    measure('generate',
+            lambda: simple_model.generate_words(encoder, generate_count),
+            generate_count)
+    measure('score', lambda: simple_model.score_words(corpus, encoder, 1024),
+            word_count)
+    queue.put(results)
+
+
+def bench_suite(args):
+    """ Times every stage of the pipeline (load, vocabulary build, data
+    preparation, count build, one training step, generation and batch scoring)
+    on names-small.txt, names.txt and synthetic corpora made of repeated copies
+    of names.txt. Each corpus runs in a fresh process, so that peak memory
+    growth can be attributed to individual stages.
+
+    Options:
+        --scales=4,16     Sizes of the synthetic corpora, in copies of
+                          names.txt.
+        --repeat=N        Number of timed runs per stage; the best is kept.
+        --count=N         Number of words generated in the generate stage.
+        --output=FILE     Writes the results as JSON.
+        --baseline=FILE   Compares against results from an earlier run, and
+                          exits with status 1 if any stage regressed.
+        --threshold=X     Relative slowdown or memory growth treated as a
+                          regression (default 0.25).
+    """
+
+    import json
+    import os
+    import platform
+    import sys
+    import tempfile
+    import torch
+    from main import get_option
+
+    scales = [int(scale) for scale in
+              get_option(args, 'scales', '4,16').split(',') if scale]
+    repeat = get_option(args, 'repeat', 3, int)
+    generate_count = get_option(args, 'count', 10000, int)
+    output_file = get_option(args, 'output')
+    baseline_file = get_option(args, 'baseline')
+    threshold = get_option(args, 'threshold', 0.25, float)
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        corpora = [('names-small', 'data/names-small.txt'),
+                   ('names', 'data/names.txt')]
+        with open('data/names.txt') as file:
+            names = file.read()
+        for scale in scales:
+            file_name = os.path.join(directory, f'names-x{scale}.txt')
+            with open(file_name, 'w') as file:
+                file.write(names * scale)
+            corpora.append((f'names-x{scale}', file_name))
+
+        print(f'{"corpus":<12} {"stage":<11} {"time (ms)":>11} '
+              f'{"items/sec":>13} {"peak (MiB)":>11}')
+        for corpus_name, file_name in corpora:
+            queue = context.Queue()
+            process = context.Process(target=_run_suite_stages,
+                                      args=(file_name, repeat,
+                                            generate_count, queue))
+            process.start()
+            for result in queue.get():
+                result = {'corpus': corpus_name, **result}
+                results.append(result)
+                print(f'{corpus_name:<12} {result["stage"]:<11} '
+                      f'{result["seconds"] * 1000:>11.3f} '
+                      f'{result["throughput"] or 0:>13.0f} '
+                      f'{result["peak_mib"]:>11.2f}')
+            process.join()
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+    if output_file is not None:
+        with open(output_file, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Results written to {output_file}')
+
+    if baseline_file is not None:
+        with open(baseline_file) as file:
+            baseline = {(entry['corpus'], entry['stage']): entry
+                        for entry in json.load(file)['results']}
+        regressions = []
+        for result in results:
+            previous = baseline.get((result['corpus'], result['stage']))
+            if previous is None:
+                continue
+            if result['seconds'] > previous['seconds'] * (1 + threshold):
+                regressions.append(
+                    f'{result["corpus"]}/{result["stage"]}: time '
+                    f'{previous["seconds"] * 1000:.3f} ms -> '
+                    f'{result["seconds"] * 1000:.3f} ms')
+            # Memory growth below 1 MiB is within measurement noise.
+            if result['peak_mib'] > max(previous['peak_mib'] *
+                                        (1 + threshold),
+                                        previous['peak_mib'] + 1):
+                regressions.append(
+                    f'{result["corpus"]}/{result["stage"]}: peak memory '
+                    f'{previous["peak_mib"]:.2f} MiB -> '
+                    f'{result["peak_mib"]:.2f} MiB')
+        if len(regressions) > 0:
+            print(f'Regressions against {baseline_file} '
+                  f'(threshold {threshold:.0%}):')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print(f'No regressions against {baseline_file}')
+
+
+BENCHMARKS = {
+    'suite': (bench_suite, 'Times every pipeline stage, with JSON output'),
+    'counts': (bench_counts, 'Batched vs looped bigram counting'),
+    'parallel-counts':
+    (bench_parallel_counts, 'Sharded bigram counting with 1-8 workers'),
+    'encoder': (bench_encoder, 'Per-character vs bulk encode and decode'),
+    'score': (bench_score, 'Per-word vs batched whole word scoring'),
+    'server': (bench_server, 'Load test against a running name server'),
+    'profiling': (bench_profiling, 'Overhead of profiling instrumentation'),
+    'startup': (bench_startup, 'Startup time of light commands'),
+    'backends':
+    (bench_backends, 'SimpleBigram on the torch and NumPy backends'),
+    'memory': (bench_memory, 'Peak memory of Word lists vs encoded corpus'),
+    'generate': (bench_generate, 'Looped vs batched word generation'),
+    'sampler': (bench_sampler, 'Alias sampler vs torch.multinomial'),
+    'ngram': (bench_ngram, 'Sparse n-gram build time and memory'),
+    'neuron-inputs':
+    (bench_neuron_inputs, 'One-hot vs index inputs for NeuronBigram'),
+    'prefix-index':
+    (bench_prefix_index, 'Prefix index queries vs scanning the word list'),
+    'top-words':
+    (bench_top_words, 'Exact top-K search vs brute-force sampling'),
+    'quantize':
+    (bench_quantize, 'Memory, speed and loss of quantized bigram exports'),
+    'neuron-loss':
+    (bench_neuron_loss, 'Fused vs legacy NeuronBigram loss, time and memory'),
+    'context-mlp':
+    (bench_context_mlp, 'ContextMLP throughput and loss by context length'),
+    'parallel-train':
+    (bench_parallel_train, 'Data-parallel NeuronBigram training, 1-8 workers'),
+}
@@ -1,16 +1,54 @@
-__all__ = [
-    'Word',
-    'BigramEncoder',
-    'WordList',
-    'SimpleBigram',
-    'NeuronBigram',
-    'init_random',
-    'global_generator',
-]
+import importlib
 
-from .word import Word
-from .bigram_encoder import BigramEncoder
-from .word_list import WordList
-from .simple_bigram import SimpleBigram
-from .neuron_bigram import NeuronBigram
-from .utils import init_random, global_generator
+# Public names, mapped to the module that defines them. Modules are imported
+# on first access, so that importing lib, or using its lightweight parts, does
+# not pay for importing torch.
+_EXPORTS = {
+    'Word': 'word',
+    'BigramEncoder': 'bigram_encoder',
+    'WordList': 'word_list',
+    'EncodedCorpus': 'encoded_corpus',
+    'DatasetCache': 'dataset_cache',
+    'BigramCounts': 'bigram_counts',
+    'PrefixIndex': 'prefix_index',
+    'SequenceBatch': 'sequence_batch',
+    'batch_sequences': 'sequence_batch',
+    'SimpleBigram': 'simple_bigram',
+    'NeuronBigram': 'neuron_bigram',
+    'SimpleNgram': 'simple_ngram',
+    'QuantizedBigram': 'quantized_bigram',
+    'ContextEncoder': 'context_encoder',
+    'ContextMLP': 'context_mlp',
+    'AliasSampler': 'alias_sampler',
+    'Trainer': 'trainer',
+    'ShardTrainer': 'parallel_train',
+    'fit_parallel': 'parallel_train',
+    'Optimizer': 'optimizers',
+    'SGD': 'optimizers',
+    'Adam': 'optimizers',
+    'ConstantSchedule': 'optimizers',
+    'StepSchedule': 'optimizers',
+    'CosineSchedule': 'optimizers',
+    'init_random': 'utils',
+    'split_data': 'utils',
+    'global_generator': 'utils',
+    'get_backend': 'backends',
+    'profiling': None,
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module_name = _EXPORTS[name]
+    if module_name is None:
+        return importlib.import_module(f'.{name}', __name__)
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,162 @@
+import numpy as np
+
+
+class AliasSampler:
+    """ Frozen sampler for a trained bigram model.
+
+    Every row of the model's transition matrix is converted into an alias
+    table (Vose's method) once, when the sampler is built. Sampling the next
+    character is then a constant time operation: a single uniform random number
+    selects a column and decides between that column and its alias.
+
+    This module only depends on NumPy, so a sampler can be used in processes
+    that do not import torch.
+    """
+
+    def __init__(self, transitions: np.ndarray, vocabulary: list[str]):
+        """ Builds alias tables from a matrix of transition probabilities.
+
+        :param transitions: A square matrix in which row i holds the
+        probability distribution of the character that follows the character
+        with index i. Rows are normalized before use.
+        :param vocabulary: The list of characters corresponding to the rows
+        and columns of the matrix, including the termination character.
+        """
+
+        transitions = np.asarray(transitions, dtype=np.float64)
+        assert transitions.ndim == 2 and transitions.shape[0] == \
+            transitions.shape[1], 'Invalid transitions (arg #1)'
+        assert isinstance(vocabulary, list) and len(vocabulary) == \
+            transitions.shape[0] and '.' in vocabulary, \
+            'Invalid vocabulary (arg #2)'
+
+        size = transitions.shape[0]
+        sums = transitions.sum(1, keepdims=True)
+        assert np.all(np.isfinite(transitions)) and np.all(sums > 0), \
+            'Transitions must be finite, with a non zero sum per row (arg #1)'
+
+        self._vocabulary = vocabulary
+        self._stop_index = vocabulary.index('.')
+        self._probs = np.ones((size, size), dtype=np.float64)
+        self._aliases = np.tile(np.arange(size, dtype=np.int64), (size, 1))
+        for row, scaled in enumerate(transitions / sums * size):
+            small = [col for col in range(size) if scaled[col] < 1]
+            large = [col for col in range(size) if scaled[col] >= 1]
+            while small and large:
+                less, more = small.pop(), large.pop()
+                self._probs[row, less] = scaled[less]
+                self._aliases[row, less] = more
+                scaled[more] = scaled[more] + scaled[less] - 1
+                if scaled[more] < 1:
+                    small.append(more)
+                else:
+                    large.append(more)
+            # Columns left over due to rounding error always select
+            # themselves.
+            for col in small + large:
+                self._probs[row, col] = 1
+
+    @classmethod
+    def from_model(cls, model, encoder) -> 'AliasSampler':
+        """ Builds a sampler from a trained model.
+
+        :param model: A model that provides get_transitions(), such as
+        SimpleBigram or NeuronBigram.
+        :param encoder: The encoder used by the model.
+        """
+
+        transitions = model.get_transitions()
+        # Models on the NumPy backend return arrays, which are used as is, so
+        # that building a sampler from them never imports torch.
+        if not isinstance(transitions, np.ndarray):
+            transitions = transitions.detach().cpu().numpy()
+        return cls(transitions, list(encoder.vocabulary))
+
+    def __repr__(self) -> str:
+        """ Representation of the sampler. """
+        return f'AliasSampler({self._probs.shape})'
+
+    @property
+    def vocabulary(self) -> list[str]:
+        """ List of characters corresponding to sampled indices. """
+        return self._vocabulary
+
+    def sample(self,
+               indices: np.ndarray,
+               rng: np.random.Generator = None) -> np.ndarray:
+        """ Samples the next index for each of the given indices.
+
+        :param indices: An array of current indices.
+        :param rng: A NumPy random generator. A new, randomly seeded generator
+        is used if omitted.
+        :return: An array of sampled indices, with the same shape as indices.
+        """
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        indices = np.asarray(indices, dtype=np.int64)
+        scaled = rng.random(indices.shape) * self._probs.shape[1]
+        cols = scaled.astype(np.int64)
+        keep = (scaled - cols) < self._probs[indices, cols]
+        return np.where(keep, cols, self._aliases[indices, cols])
+
+    def generate_words(self,
+                       count: int,
+                       max_len: int = 32,
+                       rng: np.random.Generator = None) -> list[str]:
+        """ Generates a batch of words, advancing all unfinished words together.
+
+        :param count: The number of words to generate.
+        :param max_len: The maximum number of characters sampled for each word,
+        including the termination character. Longer words are truncated.
+        :param rng: A NumPy random generator. A new, randomly seeded generator
+        is used if omitted.
+        :return: A list of generated words.
+        """
+
+        assert count >= 0, 'Invalid count (arg #1)'
+        assert max_len > 0, 'Invalid max_len (arg #2)'
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        sequences = np.full((count, max_len), self._stop_index, dtype=np.int64)
+        active = np.arange(count)
+        current = np.full(count, self._stop_index, dtype=np.int64)
+        for step in range(max_len):
+            if active.shape[0] == 0:
+                break
+            current = self.sample(current, rng)
+            sequences[active, step] = current
+            running = current != self._stop_index
+            active = active[running]
+            current = current[running]
+
+        words = []
+        for row in sequences.tolist():
+            end = row.index(self._stop_index) \
+                if self._stop_index in row else len(row)
+            words.append(''.join([self._vocabulary[index]
+                                  for index in row[:end]]))
+        return words
+
+    def generate_word(self, rng: np.random.Generator = None) -> str:
+        """ Generates a single word.
+
+        :param rng: A NumPy random generator. A new, randomly seeded generator
+        is used if omitted.
+        :return: The generated word as a string.
+        """
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        chars = []
+        index = self._stop_index
+        while True:
+            index = int(self.sample(np.array(index), rng))
+            if index == self._stop_index:
+                break
+            chars.append(self._vocabulary[index])
+        return ''.join(chars)
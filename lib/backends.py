@@ -0,0 +1,498 @@
+""" Array backends for the count based parts of the library.
+
+A backend wraps the handful of array operations used by EncodedCorpus,
+SimpleBigram, sequence batching and sampling, so that they can run either on
+torch tensors or on NumPy arrays. Code that only counts, normalizes and samples
+can use the NumPy backend without importing torch at all:
+
+    from lib import WordList, BigramEncoder, SimpleBigram
+
+    words = WordList('data/names.txt')
+    encoder = BigramEncoder(words.vocabulary)
+    model = SimpleBigram(words, encoder, backend='numpy')
+
+Backends are selected by name, and each backend imports its array library
+when it is first used. Both backends produce identical counts, probabilities
+and log-likelihoods. Sampled words depend on the random number generator of
+the backend, so a fixed seed reproduces the same words within a backend, but
+not across backends.
+"""
+
+_DEFAULT_BACKEND = 'torch'
+
+_backends = {}
+_seed = None
+
+
+class Backend:
+    """ Base class of array backends. Arrays are the native array type of the
+    backend, and dtypes are available as the uint8, int32, long and float
+    attributes.
+    """
+
+    name = None
+
+    def __repr__(self) -> str:
+        """ Representation of the backend. """
+        return f'{type(self).__name__}()'
+
+    @property
+    def generator(self):
+        """ The global random number generator of the backend, which is
+        seeded by init_random(). """
+        if self._generator is None:
+            self._generator = self.create_generator(_seed)
+        return self._generator
+
+    def seed(self, seed: int):
+        """ Seeds the global random number generator of the backend, in
+        place.
+
+        :param seed: The seed value.
+        """
+        raise NotImplementedError()
+
+    def create_generator(self, seed: int = None):
+        """ Creates a new random number generator.
+
+        :param seed: An optional seed value.
+        """
+        raise NotImplementedError()
+
+    def is_array(self, value) -> bool:
+        """ Returns True if the value is an array of this backend. """
+        raise NotImplementedError()
+
+    def asarray(self, values, dtype=None):
+        """ Converts a list, or an array of any backend, into an array of this
+        backend, without copying when possible. """
+        raise NotImplementedError()
+
+    def from_buffer(self, buffer, dtype, count: int = -1, offset: int = 0):
+        """ Creates a one dimensional array over a writable buffer, without
+        copying it. """
+        raise NotImplementedError()
+
+    def get_dtype(self, name: str):
+        """ Returns the dtype with the given name, such as 'float32'. """
+        raise NotImplementedError()
+
+    def get_dtype_name(self, array) -> str:
+        """ Returns the name of the dtype of an array, such as 'float32'. """
+        raise NotImplementedError()
+
+    def to_bytes(self, array) -> bytes:
+        """ Returns the raw contents of an array. """
+        raise NotImplementedError()
+
+    def nbytes(self, array) -> int:
+        """ Returns the number of bytes used by the elements of an array. """
+        raise NotImplementedError()
+
+    def zeros(self, shape, dtype):
+        raise NotImplementedError()
+
+    def full(self, shape, value, dtype):
+        raise NotImplementedError()
+
+    def arange(self, count: int):
+        raise NotImplementedError()
+
+    def to(self, array, dtype):
+        """ Converts an array to a dtype, without copying if it already has
+        that dtype. """
+        raise NotImplementedError()
+
+    def cumsum(self, array):
+        raise NotImplementedError()
+
+    def repeat(self, array, counts):
+        """ Repeats each element of an array by the corresponding count. """
+        raise NotImplementedError()
+
+    def concatenate(self, arrays: list):
+        raise NotImplementedError()
+
+    def clamp_min(self, array, value):
+        raise NotImplementedError()
+
+    def minimum(self, first, second):
+        raise NotImplementedError()
+
+    def maximum(self, first, second):
+        raise NotImplementedError()
+
+    def max_rows(self, array):
+        """ Returns the largest element of every row of a matrix. """
+        raise NotImplementedError()
+
+    def top_k(self, array, k: int):
+        """ Returns the indices of the k largest elements of a one
+        dimensional array, from largest to smallest. """
+        raise NotImplementedError()
+
+    def where(self, condition, first, second):
+        raise NotImplementedError()
+
+    def argsort(self, array):
+        """ Returns the indices that sort an array, keeping equal elements in
+        their original order. """
+        raise NotImplementedError()
+
+    def bincount(self, array, minlength: int):
+        raise NotImplementedError()
+
+    def unique(self, array, return_counts: bool = False):
+        raise NotImplementedError()
+
+    def nonzero(self, array) -> tuple:
+        """ Returns a tuple of index arrays, one per dimension, for the
+        non-zero elements of an array. """
+        raise NotImplementedError()
+
+    def index_add(self, array, indices: tuple, values):
+        """ Adds values to the elements of an array at the given indices, in
+        place, accumulating values for repeated indices. """
+        raise NotImplementedError()
+
+    def normalize_rows(self, array):
+        """ Divides every row of a matrix by its sum. """
+        raise NotImplementedError()
+
+    def log(self, array):
+        """ Computes the natural logarithm of a floating point array.
+
+        The logarithm is computed in double precision and rounded back to the
+        dtype of the array, so that every backend returns the same values
+        regardless of the accuracy of its single precision implementation.
+        """
+        raise NotImplementedError()
+
+    def mean(self, array):
+        """ Computes the mean of a floating point array, as a zero dimensional
+        array. The sum is accumulated in double precision, for the same reason
+        as log(). """
+        raise NotImplementedError()
+
+    def sample(self, probs, generator=None):
+        """ Samples one index from every row of a matrix of (unnormalized)
+        probabilities.
+
+        :param probs: A (N, V) matrix of non-negative weights.
+        :param generator: A random number generator of this backend. The
+        global generator is used if omitted.
+        :return: A (N, ) array of sampled indices.
+        """
+        raise NotImplementedError()
+
+
+class TorchBackend(Backend):
+    """ Backend that stores arrays as torch tensors. """
+
+    name = 'torch'
+
+    def __init__(self):
+        import torch
+
+        self._torch = torch
+        self._generator = None
+        self.uint8 = torch.uint8
+        self.int32 = torch.int32
+        self.long = torch.long
+        self.float = torch.float
+
+    def seed(self, seed: int):
+        self.generator.manual_seed(seed)
+
+    def create_generator(self, seed: int = None):
+        generator = self._torch.Generator()
+        if seed is not None:
+            generator.manual_seed(seed)
+        return generator
+
+    def is_array(self, value) -> bool:
+        return isinstance(value, self._torch.Tensor)
+
+    def asarray(self, values, dtype=None):
+        return self._torch.as_tensor(values, dtype=dtype)
+
+    def from_buffer(self, buffer, dtype, count: int = -1, offset: int = 0):
+        return self._torch.frombuffer(buffer,
+                                      dtype=dtype,
+                                      count=count,
+                                      offset=offset)
+
+    def get_dtype(self, name: str):
+        return getattr(self._torch, name)
+
+    def get_dtype_name(self, array) -> str:
+        return str(array.dtype).split('.')[-1]
+
+    def to_bytes(self, array) -> bytes:
+        data = array.detach().contiguous().reshape(-1).view(self._torch.uint8)
+        return data.numpy().tobytes()
+
+    def nbytes(self, array) -> int:
+        return array.element_size() * array.nelement()
+
+    def zeros(self, shape, dtype):
+        return self._torch.zeros(shape, dtype=dtype)
+
+    def full(self, shape, value, dtype):
+        return self._torch.full(shape, value, dtype=dtype)
+
+    def arange(self, count: int):
+        return self._torch.arange(count)
+
+    def to(self, array, dtype):
+        return array.to(dtype)
+
+    def cumsum(self, array):
+        return self._torch.cumsum(array, 0)
+
+    def repeat(self, array, counts):
+        return self._torch.repeat_interleave(array, counts)
+
+    def concatenate(self, arrays: list):
+        return self._torch.cat(arrays)
+
+    def clamp_min(self, array, value):
+        return array.clamp(min=value)
+
+    def minimum(self, first, second):
+        return self._torch.minimum(first, second)
+
+    def maximum(self, first, second):
+        return self._torch.maximum(first, second)
+
+    def max_rows(self, array):
+        return array.amax(1)
+
+    def top_k(self, array, k: int):
+        return self._torch.topk(array, k).indices
+
+    def where(self, condition, first, second):
+        return self._torch.where(condition, first, second)
+
+    def argsort(self, array):
+        return self._torch.argsort(array, stable=True)
+
+    def bincount(self, array, minlength: int):
+        return self._torch.bincount(array, minlength=minlength)
+
+    def unique(self, array, return_counts: bool = False):
+        return self._torch.unique(array, return_counts=return_counts)
+
+    def nonzero(self, array) -> tuple:
+        return array.nonzero(as_tuple=True)
+
+    def index_add(self, array, indices: tuple, values):
+        array.index_put_(indices, values.to(array.dtype), accumulate=True)
+
+    def normalize_rows(self, array):
+        return array / array.sum(1, keepdim=True)
+
+    def log(self, array):
+        return self._torch.log(array.double()).to(array.dtype)
+
+    def mean(self, array):
+        return array.double().mean().to(array.dtype)
+
+    def sample(self, probs, generator=None):
+        if generator is None:
+            generator = self.generator
+        return self._torch.multinomial(probs,
+                                       1,
+                                       replacement=True,
+                                       generator=generator).squeeze(1)
+
+
+class NumpyBackend(Backend):
+    """ Backend that stores arrays as NumPy arrays. """
+
+    name = 'numpy'
+
+    def __init__(self):
+        import numpy
+
+        self._numpy = numpy
+        self._generator = None
+        self.uint8 = numpy.dtype(numpy.uint8)
+        self.int32 = numpy.dtype(numpy.int32)
+        self.long = numpy.dtype(numpy.int64)
+        self.float = numpy.dtype(numpy.float32)
+
+    def seed(self, seed: int):
+        # Generators are reseeded in place, so that references to the global
+        # generator remain valid.
+        generator = self.generator
+        generator.bit_generator.state = type(
+            generator.bit_generator)(seed).state
+
+    def create_generator(self, seed: int = None):
+        return self._numpy.random.default_rng(seed)
+
+    def is_array(self, value) -> bool:
+        return isinstance(value, self._numpy.ndarray)
+
+    def asarray(self, values, dtype=None):
+        return self._numpy.asarray(values, dtype=dtype)
+
+    def from_buffer(self, buffer, dtype, count: int = -1, offset: int = 0):
+        return self._numpy.frombuffer(buffer,
+                                      dtype=dtype,
+                                      count=count,
+                                      offset=offset)
+
+    def get_dtype(self, name: str):
+        return self._numpy.dtype(name)
+
+    def get_dtype_name(self, array) -> str:
+        return array.dtype.name
+
+    def to_bytes(self, array) -> bytes:
+        return self._numpy.ascontiguousarray(array).tobytes()
+
+    def nbytes(self, array) -> int:
+        return array.nbytes
+
+    def zeros(self, shape, dtype):
+        return self._numpy.zeros(shape, dtype=dtype)
+
+    def full(self, shape, value, dtype):
+        return self._numpy.full(shape, value, dtype=dtype)
+
+    def arange(self, count: int):
+        return self._numpy.arange(count)
+
+    def to(self, array, dtype):
+        return array.astype(dtype, copy=False)
+
+    def cumsum(self, array):
+        return self._numpy.cumsum(array)
+
+    def repeat(self, array, counts):
+        return self._numpy.repeat(array, counts)
+
+    def concatenate(self, arrays: list):
+        return self._numpy.concatenate(arrays)
+
+    def clamp_min(self, array, value):
+        return self._numpy.maximum(array, value)
+
+    def minimum(self, first, second):
+        return self._numpy.minimum(first, second)
+
+    def maximum(self, first, second):
+        return self._numpy.maximum(first, second)
+
+    def max_rows(self, array):
+        return array.max(1)
+
+    def top_k(self, array, k: int):
+        # The k largest elements are selected in linear time, and only they
+        # are sorted.
+        if k == 0:
+            return self._numpy.arange(0)
+        if k < array.shape[0]:
+            indices = self._numpy.argpartition(array, -k)[-k:]
+        else:
+            indices = self._numpy.arange(array.shape[0])
+        return indices[self._numpy.argsort(-array[indices], kind='stable')]
+
+    def where(self, condition, first, second):
+        return self._numpy.where(condition, first, second)
+
+    def argsort(self, array):
+        return self._numpy.argsort(array, kind='stable')
+
+    def bincount(self, array, minlength: int):
+        return self._numpy.bincount(array, minlength=minlength)
+
+    def unique(self, array, return_counts: bool = False):
+        return self._numpy.unique(array, return_counts=return_counts)
+
+    def nonzero(self, array) -> tuple:
+        return array.nonzero()
+
+    def index_add(self, array, indices: tuple, values):
+        self._numpy.add.at(array, indices, values.astype(array.dtype))
+
+    def normalize_rows(self, array):
+        return array / array.sum(1, keepdims=True)
+
+    def log(self, array):
+        # Zero probabilities have a log of -inf, as with torch.
+        with self._numpy.errstate(divide='ignore'):
+            return self._numpy.log(array.astype(self._numpy.float64)).astype(
+                array.dtype)
+
+    def mean(self, array):
+        return self._numpy.asarray(
+            array.mean(dtype=self._numpy.float64)).astype(array.dtype)
+
+    def sample(self, probs, generator=None):
+        # Inverse transform sampling: the sampled index is the first one whose
+        # cumulative weight exceeds a uniform draw scaled by the row total, so
+        # indices with zero weight are never selected.
+        if generator is None:
+            generator = self.generator
+        cumulative = self._numpy.cumsum(probs, axis=1)
+        thresholds = generator.random(probs.shape[0]) * cumulative[:, -1]
+        return (cumulative <= thresholds[:, None]).sum(1)
+
+
+_BACKEND_TYPES = {
+    TorchBackend.name: TorchBackend,
+    NumpyBackend.name: NumpyBackend,
+}
+
+
+def get_backend(backend: 'str | Backend' = None) -> Backend:
+    """ Returns an array backend.
+
+    :param backend: The name of the backend ('torch' or 'numpy'), or a backend
+    object, which is returned as is. Defaults to the torch backend.
+    """
+
+    if isinstance(backend, Backend):
+        return backend
+    if backend is None:
+        backend = _DEFAULT_BACKEND
+    assert backend in _BACKEND_TYPES, f'Invalid backend: {backend}'
+    if backend not in _backends:
+        _backends[backend] = _BACKEND_TYPES[backend]()
+    return _backends[backend]
+
+
+def get_default_backend_name() -> str:
+    """ Returns the name of the default backend, without creating it. """
+
+    return _DEFAULT_BACKEND
+
+
+def get_array_backend(array) -> Backend:
+    """ Returns the backend that an array belongs to.
+
+    :param array: A torch tensor or a NumPy array.
+    """
+
+    # The module of the array type identifies the backend without importing
+    # libraries that are not already in use.
+    name = type(array).__module__.split('.')[0]
+    assert name in _BACKEND_TYPES, f'Unsupported array type: {type(array)}'
+    return get_backend(name)
+
+
+def seed_backends(seed: int):
+    """ Seeds the global random number generator of every backend. Backends
+    that have not been used yet are seeded when they are first created.
+
+    :param seed: The seed value.
+    """
+
+    global _seed
+    _seed = seed
+    for backend in _backends.values():
+        if backend._generator is not None:
+            backend.seed(seed)
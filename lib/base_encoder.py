@@ -1,4 +1,9 @@
-import torch
+from typing import TYPE_CHECKING
+from .backends import Backend, get_backend
+from . import profiling
+
+if TYPE_CHECKING:
+    import torch
 
 
 class BaseEncoder:
@@ -23,11 +28,27 @@ class BaseEncoder:
         for index, char in enumerate(self._char_lookup):
             self._char_map[char] = index
 
+        # Vocabularies of up to 256 single byte characters are encoded and
+        # decoded in bulk by translating strings through byte lookup tables.
+        self._char_bytes = None
+        if len(self._char_lookup) <= 256 and all(
+                len(char) == 1 and ord(char) < 256
+                for char in self._char_lookup):
+            self._char_bytes = bytes(map(ord, self._char_lookup))
+            self._encode_table = bytearray(256)
+            for index, char in enumerate(self._char_lookup):
+                self._encode_table[ord(char)] = index
+
     def __repr__(self) -> str:
         """ Representation of the encoder. """
 
         return f'{self.__class__.__name__}({len(self._char_lookup)})'
 
+    @property
+    def vocabulary(self) -> list[str]:
+        """ List of characters in the vocabulary, in index order. """
+        return self._char_lookup
+
     def get_index(self, char: str) -> int:
         """ Gets the index of a character in the vocabulary.
 
@@ -51,3 +72,84 @@ class BaseEncoder:
 
         assert index >= 0, 'Invalid index (arg #1)'
         return self._char_lookup[index]
+
+    @profiling.profiled()
+    def encode(self,
+               text: str | list[str],
+               dtype: 'torch.dtype' = None,
+               backend: str | Backend = None) -> 'torch.Tensor':
+        """ Encodes a string, or a list of strings, into vocabulary indices in
+        a single pass, without looking up one character at a time.
+
+        :param text: A string, or a list of strings. Strings in a list are
+        padded to the length of the longest string using the termination
+        character.
+        :param dtype: The integer type of the returned tensor. Defaults to the
+        long type of the backend.
+        :param backend: The array backend of the returned tensor. Defaults to
+        torch.
+        :return: A tensor of shape (len(text), ) for a string, or of shape
+        (len(text), max_len) for a list of strings. A KeyError is raised if the
+        text contains a character that is not in the vocabulary.
+        """
+
+        if isinstance(text, list):
+            max_len = max([len(word) for word in text], default=0)
+            padded = ''.join([word.ljust(max_len, '.') for word in text])
+            return self.encode(padded, dtype,
+                               backend).reshape(len(text), max_len)
+
+        assert isinstance(text, str), 'Invalid text (arg #1)'
+
+        backend = get_backend(backend)
+        if dtype is None:
+            dtype = backend.long
+        profiling.count('chars_encoded', len(text))
+        if len(text) == 0:
+            return backend.zeros(0, dtype)
+        if self._char_bytes is None:
+            return backend.asarray([self._char_map[char] for char in text],
+                                   dtype)
+
+        try:
+            encoded = text.encode('latin-1')
+        except UnicodeEncodeError as error:
+            raise KeyError(text[error.start]) from error
+        unknown = encoded.translate(None, self._char_bytes)
+        if len(unknown) > 0:
+            raise KeyError(chr(unknown[0]))
+        indices = bytearray(encoded.translate(self._encode_table))
+        return backend.to(backend.from_buffer(indices, backend.uint8), dtype)
+
+    @profiling.profiled()
+    def decode(self, indices: 'torch.Tensor') -> str | list[str]:
+        """ Decodes vocabulary indices into text in a single pass.
+
+        :param indices: A one dimensional tensor of indices, or a two
+        dimensional tensor with one sequence per row. Tensors of any backend,
+        and lists, are accepted.
+        :return: A string for a one dimensional tensor. For a two dimensional
+        tensor, a list of strings, with each row ending before its first
+        termination character.
+        """
+
+        import numpy
+
+        # Indices are decoded through a zero-copy NumPy view, which works for
+        # the arrays of every backend.
+        indices = numpy.asarray(indices)
+        if indices.ndim == 2:
+            length = indices.shape[1]
+            text = self.decode(indices.reshape(-1))
+            return [
+                text[start:start + length].partition('.')[0]
+                for start in range(0, len(text), length)
+            ] if length > 0 else [''] * indices.shape[0]
+
+        assert indices.ndim == 1, 'Invalid indices (arg #1)'
+        if self._char_bytes is None:
+            return ''.join([self._char_lookup[index]
+                            for index in indices.tolist()])
+        table = numpy.frombuffer(self._char_bytes, dtype=numpy.uint8)
+        chars = table[indices.astype(numpy.int64, copy=False)]
+        return chars.tobytes().decode('latin-1')
@@ -0,0 +1,169 @@
+from typing import TYPE_CHECKING
+from .backends import Backend, get_backend, get_array_backend
+from .word import Word
+from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+
+if TYPE_CHECKING:
+    import torch
+
+
+class BigramCounts:
+    """ Mergeable bigram count state over a fixed vocabulary.
+
+    Counts from separate word feeds can be built independently and combined
+    with + and -, as long as they share the same vocabulary. A SimpleBigram
+    model can be built from, updated with, or reduced by a BigramCounts
+    object.
+
+    Counts are held in an array of any backend (see lib.backends), so that
+    models on the NumPy backend can produce and merge counts without
+    importing torch. Merged count states keep the backend of the left operand.
+    """
+
+    def __init__(self,
+                 vocabulary: list[str],
+                 counts: 'torch.Tensor' = None,
+                 backend: str | Backend = None):
+        """ Initializes the count state.
+
+        :param vocabulary: The list of characters used to index the counts,
+        including the termination character.
+        :param counts: A (V, V) integer array of bigram counts. If omitted,
+        all counts are zero.
+        :param backend: The array backend that holds the counts. Defaults to
+        the backend of the counts, or to torch if they are omitted. Counts of
+        other backends are converted.
+        """
+
+        assert isinstance(vocabulary, list) and '.' in vocabulary, \
+            'Invalid vocabulary (arg #1)'
+
+        if backend is None and counts is not None:
+            backend = get_array_backend(counts)
+        backend = get_backend(backend)
+        size = len(vocabulary)
+        if counts is None:
+            counts = backend.zeros((size, size), backend.long)
+        counts = backend.to(backend.asarray(counts), backend.long)
+        assert tuple(counts.shape) == (size, size), 'Invalid counts (arg #2)'
+
+        self._vocabulary = vocabulary
+        self._backend = backend
+        self._counts = counts
+
+    @staticmethod
+    def get_corpus(words: WordList | EncodedCorpus | list,
+                   vocabulary: list[str],
+                   backend: str | Backend = None) -> EncodedCorpus:
+        """ Encodes a collection of words using the given vocabulary.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param vocabulary: The list of characters used to encode the words.
+        :param backend: The array backend used to encode words that are not
+        already encoded. Defaults to torch.
+        :return: An encoded corpus. A KeyError is raised if the words contain
+        characters that are not in the vocabulary.
+        """
+
+        if isinstance(words, EncodedCorpus):
+            assert words.vocabulary == vocabulary, \
+                'Corpus vocabulary does not match (arg #1)'
+            return words
+        if isinstance(words, WordList):
+            words = words[:]
+        assert isinstance(words, list), 'Invalid words (arg #1)'
+        lines = [word.text if isinstance(word, Word) else word
+                 for word in words]
+        return EncodedCorpus.from_lines(lines, vocabulary, backend)
+
+    @staticmethod
+    def get_pair_counts(
+        corpus: EncodedCorpus
+    ) -> tuple['torch.Tensor', 'torch.Tensor', 'torch.Tensor']:
+        """ Counts the distinct bigrams in a corpus, without allocating a dense
+        count matrix. The cost is proportional to the size of the corpus.
+
+        :param corpus: The corpus to count.
+        :return: A tuple of (rows, cols, counts) arrays, of the backend of the
+        corpus, with one entry per distinct bigram.
+        """
+
+        backend = corpus.backend
+        size = corpus.vocabulary_size
+        tokens = backend.to(corpus.tokens, backend.long)
+        keys, counts = backend.unique(tokens[:-1] * size + tokens[1:],
+                                      return_counts=True)
+        return keys // size, keys % size, counts
+
+    @classmethod
+    def from_words(cls,
+                   words: WordList | EncodedCorpus | list,
+                   vocabulary: list[str],
+                   backend: str | Backend = None) -> 'BigramCounts':
+        """ Counts the bigrams in a collection of words.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param vocabulary: The list of characters used to index the counts.
+        :param backend: The array backend that holds the counts. Defaults to
+        torch. Encoded corpora are counted with their own backend, and the
+        counts are then converted.
+        """
+
+        result = cls(vocabulary, backend=backend)
+        backend = result.backend
+        rows, cols, counts = cls.get_pair_counts(
+            cls.get_corpus(words, vocabulary, backend))
+        backend.index_add(result._counts,
+                          (backend.asarray(rows), backend.asarray(cols)),
+                          backend.asarray(counts))
+        return result
+
+    def __repr__(self) -> str:
+        """ Representation of the count state. """
+        return (f'BigramCounts(vocab={len(self._vocabulary)}, '
+                f'total={self.total})')
+
+    def _check_other(self, other: 'BigramCounts'):
+        assert isinstance(other, BigramCounts), 'Invalid counts (arg #1)'
+        assert other.vocabulary == self._vocabulary, \
+            'Vocabularies do not match (arg #1)'
+
+    def __add__(self, other: 'BigramCounts') -> 'BigramCounts':
+        """ Returns the sum of two count states. """
+        self._check_other(other)
+        return BigramCounts(
+            self._vocabulary,
+            self._counts + self._backend.asarray(other.counts))
+
+    def __sub__(self, other: 'BigramCounts') -> 'BigramCounts':
+        """ Returns the difference of two count states. A ValueError is raised
+        if any count would become negative. """
+        self._check_other(other)
+        counts = self._counts - self._backend.asarray(other.counts)
+        if (counts < 0).any():
+            raise ValueError('Cannot remove bigrams that were not counted')
+        return BigramCounts(self._vocabulary, counts)
+
+    @property
+    def vocabulary(self) -> list[str]:
+        """ List of characters used to index the counts. """
+        return self._vocabulary
+
+    @property
+    def backend(self) -> Backend:
+        """ Array backend of the counts. """
+        return self._backend
+
+    @property
+    def counts(self) -> 'torch.Tensor':
+        """ The (V, V) array of bigram counts, of the backend of the count
+        state. """
+        return self._counts
+
+    @property
+    def total(self) -> int:
+        """ The total number of bigrams counted. """
+        return self._counts.sum().item()
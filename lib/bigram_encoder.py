@@ -1,6 +1,9 @@
-import torch
+from typing import TYPE_CHECKING
 from .base_encoder import BaseEncoder
 
+if TYPE_CHECKING:
+    import torch
+
 
 class BigramEncoder(BaseEncoder):
     """
@@ -16,9 +19,18 @@ class BigramEncoder(BaseEncoder):
         vocabulary that the encoder operates over.
         """
         super().__init__(vocabulary)
-        self._embeddings = torch.eye(len(vocabulary))
+        self.__embeddings = None
+
+    @property
+    def _embeddings(self) -> 'torch.Tensor':
+        # Embeddings are created on first use, so that encoders used only for
+        # index lookups do not import torch.
+        if self.__embeddings is None:
+            import torch
+            self.__embeddings = torch.eye(len(self._char_lookup))
+        return self.__embeddings
 
-    def get_embedding(self, inputs) -> torch.Tensor:
+    def get_embedding(self, inputs) -> 'torch.Tensor':
         """ Gets the embedding corresponding to the specified input.
 
         :param inputs: The input for which the embedding is retrieved. This must
@@ -29,3 +41,15 @@ class BigramEncoder(BaseEncoder):
         assert isinstance(inputs, tuple), 'Invalid inputs (arg #1)'
         first = inputs[0]
         return self._embeddings[self.get_index(first)]
+
+    def get_embeddings(self, indices: 'torch.Tensor') -> 'torch.Tensor':
+        """ Gets the embeddings corresponding to a tensor of vocabulary indices.
+
+        :param indices: A tensor of vocabulary indices. The embeddings are
+        returned with an additional trailing dimension of the vocabulary size.
+        """
+
+        import torch
+
+        assert isinstance(indices, torch.Tensor), 'Invalid indices (arg #1)'
+        return self._embeddings[indices.long()]
@@ -0,0 +1,78 @@
+from typing import TYPE_CHECKING
+from .backends import Backend
+from .bigram_encoder import BigramEncoder
+from .tensor_file import read_tensors, write_tensors
+
+if TYPE_CHECKING:
+    import torch
+
+# Incremented whenever the layout of checkpoints changes. Checkpoints written
+# with a different version are rejected on load.
+_CHECKPOINT_VERSION = 1
+_CHECKPOINT_FORMAT = 'makemore-checkpoint'
+
+
+def write_checkpoint(file_name: str, model_name: str, encoder: BigramEncoder,
+                     options: dict, tensors: dict[str, 'torch.Tensor']):
+    """ Writes a model checkpoint, consisting of the model's tensors, the
+    options needed to rebuild the model, and the vocabulary of its encoder.
+
+    :param file_name: The name of the checkpoint file.
+    :param model_name: The name of the model class.
+    :param encoder: The encoder used by the model.
+    :param options: A JSON serializable dictionary of model options.
+    :param tensors: The tensors that hold the state of the model, keyed by
+    name. Arrays of any backend are accepted.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+    assert isinstance(model_name, str), 'Invalid model_name (arg #2)'
+    assert isinstance(encoder, BigramEncoder), 'Invalid encoder (arg #3)'
+    assert isinstance(options, dict), 'Invalid options (arg #4)'
+
+    write_tensors(file_name, {
+        'format': _CHECKPOINT_FORMAT,
+        'version': _CHECKPOINT_VERSION,
+        'model': model_name,
+        'encoder': type(encoder).__name__,
+        'vocabulary': list(encoder.vocabulary),
+        'options': options,
+    }, tensors)
+
+
+def read_checkpoint(
+    file_name: str,
+    model_name: str = None,
+    backend: str | Backend = None
+) -> tuple[dict, BigramEncoder, dict[str, 'torch.Tensor']]:
+    """ Reads a model checkpoint written by write_checkpoint(). Tensors are
+    memory mapped from the file without copying, so processes that load the
+    same checkpoint share a single copy of its data in the page cache.
+
+    A ValueError is raised if the file is not a checkpoint, was written with
+    an unsupported version, or holds a different model than expected.
+
+    :param file_name: The name of the checkpoint file.
+    :param model_name: The expected name of the model class. Any model is
+    accepted if omitted.
+    :param backend: The array backend of the returned tensors. Defaults to
+    torch.
+    :return: A tuple containing the checkpoint metadata, the encoder and the
+    model tensors keyed by name.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+
+    metadata, tensors = read_tensors(file_name, backend)
+    if metadata.get('format') != _CHECKPOINT_FORMAT:
+        raise ValueError(f'Invalid checkpoint file: {file_name}')
+    if metadata.get('version') != _CHECKPOINT_VERSION:
+        raise ValueError(
+            f'Unsupported checkpoint version: {metadata.get("version")}')
+    if model_name is not None and metadata['model'] != model_name:
+        raise ValueError(f'Checkpoint contains a {metadata["model"]} model, '
+                         f'not a {model_name} model: {file_name}')
+    if metadata['encoder'] != BigramEncoder.__name__:
+        raise ValueError(f'Unsupported encoder: {metadata["encoder"]}')
+
+    return metadata, BigramEncoder(metadata['vocabulary']), tensors
@@ -0,0 +1,114 @@
+from typing import TYPE_CHECKING
+from .backends import Backend, get_backend
+from .base_encoder import BaseEncoder
+from .encoded_corpus import EncodedCorpus
+from .word_list import WordList
+from . import profiling
+
+if TYPE_CHECKING:
+    import torch
+
+
+class ContextEncoder(BaseEncoder):
+    """ Encoder for fixed length character contexts.
+
+    Every character of a word, including its final termination character, is
+    paired with a window of the context_length characters that precede it.
+    Windows that extend past the start of a word are padded with the
+    termination character, so that the word 'ab' with a context length of 3
+    yields the windows '...' -> 'a', '..a' -> 'b' and '.ab' -> '.'. With a
+    context length of 1, the windows match the pairs produced by
+    EncodedCorpus.get_pairs().
+    """
+
+    def __init__(self, vocabulary: str | list[str], context_length: int = 3):
+        """ Initializes the encoder with a given vocabulary.
+
+        :param vocabulary: A string or list of characters representing the
+        vocabulary that the encoder operates over.
+        :param context_length: The number of characters in each window.
+        """
+
+        assert isinstance(context_length, int) and context_length > 0, \
+            'Invalid context_length (arg #2)'
+
+        super().__init__(vocabulary)
+        self._context_length = context_length
+
+    def __repr__(self) -> str:
+        """ Representation of the encoder. """
+
+        return (f'ContextEncoder({len(self._char_lookup)}, '
+                f'context_length={self._context_length})')
+
+    @property
+    def context_length(self) -> int:
+        """ Number of characters in each window. """
+        return self._context_length
+
+    @profiling.profiled()
+    def get_contexts(
+        self,
+        words: WordList | EncodedCorpus | list,
+        backend: str | Backend = None
+    ) -> tuple['torch.Tensor', 'torch.Tensor']:
+        """ Builds the windows of every character in a set of words, with one
+        vectorized pass over the token buffer.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param backend: The array backend used to encode lists of words.
+        Defaults to torch. Corpora keep their own backend.
+        :return: A tuple of index tensors. The first has the shape
+        (N, context_length) and contains the windows, and the second has the
+        shape (N, ) and contains the character that follows each window.
+        """
+
+        if isinstance(words, WordList):
+            words = words.get_corpus(backend)
+        if not isinstance(words, EncodedCorpus):
+            words = EncodedCorpus.from_lines(
+                [word if isinstance(word, str) else word.text
+                 for word in words], self.vocabulary, backend)
+
+        backend = words.backend
+        starts = words.offsets[:-1]
+        # The labels of a word are every token after its leading termination
+        # character, up to and including the next termination character.
+        counts = words.offsets[1:] - starts
+        group_starts = backend.cumsum(counts) - counts
+        positions = backend.arange(counts.sum().item())
+        positions += backend.repeat(starts + 1 - group_starts, counts)
+        word_starts = backend.repeat(starts, counts)
+
+        window = backend.arange(self._context_length) - self._context_length
+        window_positions = positions[:, None] + window
+        tokens = backend.to(words.tokens, backend.long)
+        contexts = backend.where(
+            window_positions < word_starts[:, None],
+            backend.full((1, 1), self.get_index('.'), backend.long),
+            tokens[backend.clamp_min(window_positions, 0)])
+        return contexts, tokens[positions]
+
+    def encode_contexts(self,
+                        prefixes: list[str],
+                        backend: str | Backend = None) -> 'torch.Tensor':
+        """ Encodes the window that follows each of a list of word prefixes.
+
+        :param prefixes: A list of word prefixes, excluding the leading
+        termination character.
+        :param backend: The array backend of the returned tensor. Defaults to
+        torch.
+        :return: A tensor of shape (len(prefixes), context_length) containing
+        the last context_length characters of each padded prefix.
+        """
+
+        assert isinstance(prefixes, list), 'Invalid prefixes (arg #1)'
+
+        padding = '.' * self._context_length
+        windows = [(padding + prefix)[-self._context_length:]
+                   for prefix in prefixes]
+        if len(windows) == 0:
+            backend = get_backend(backend)
+            return backend.zeros((0, self._context_length), backend.long)
+        return self.encode(windows, backend=backend)
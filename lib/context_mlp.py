@@ -0,0 +1,423 @@
+import torch
+from typing import Iterator
+from .base_encoder import BaseEncoder
+from .bigram_encoder import BigramEncoder
+from .context_encoder import ContextEncoder
+from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+from .optimizers import Optimizer
+from .checkpoint import read_checkpoint, write_checkpoint
+from .utils import global_generator, decode_sequences
+from . import profiling
+
+
+class ContextMLP:
+    """ Multi-layer perceptron that predicts the next character from a window
+    of preceding characters.
+
+    Every character of the window is mapped to a learned embedding by looking
+    up a row of an embedding table. The embeddings of the window are
+    concatenated and passed through a tanh hidden layer, followed by an output
+    layer that produces the logits of the next character.
+
+    Without gradient tracking, the embedding table and the first layer are
+    folded into one table per window position, in which row i holds the
+    contribution of character i at that position to the hidden layer. The
+    hidden layer is then computed by summing context_length gathered rows,
+    instead of looking up embeddings and multiplying them by the weights.
+    """
+
+    @profiling.profiled()
+    def __init__(self,
+                 vocabulary_size: int,
+                 context_length: int = 3,
+                 embedding_size: int = 10,
+                 hidden_size: int = 200,
+                 generator: torch.Generator = None):
+        """ Initializes the model with random weights.
+        Weight generation will use the given generator if provided, or the
+        global generator if not.
+
+        :param vocabulary_size: The size of the vocabulary.
+        :param context_length: The number of characters in each window.
+        :param embedding_size: The size of the embedding of each character.
+        :param hidden_size: The number of neurons in the hidden layer.
+        :param generator: A torch generator object used to generate random
+        weights.
+        """
+
+        assert isinstance(vocabulary_size,
+                          int), 'Invalid vocabulary_size (arg #1)'
+        assert isinstance(context_length, int) and context_length > 0, \
+            'Invalid context_length (arg #2)'
+        assert isinstance(embedding_size, int) and embedding_size > 0, \
+            'Invalid embedding_size (arg #3)'
+        assert isinstance(hidden_size, int) and hidden_size > 0, \
+            'Invalid hidden_size (arg #4)'
+        if generator is None:
+            generator = global_generator
+
+        def randn(*shape):
+            return torch.randn(shape, dtype=torch.float, generator=generator)
+
+        # Hidden weights are scaled for the fan in of the tanh layer, and
+        # output weights are kept small, so that the initial predictions are
+        # close to uniform.
+        fan_in = context_length * embedding_size
+        self._embeddings = randn(vocabulary_size, embedding_size)
+        self._hidden_weights = randn(fan_in, hidden_size) * (5 / 3) / \
+            fan_in**0.5
+        self._hidden_bias = randn(hidden_size) * 0.01
+        self._output_weights = randn(hidden_size, vocabulary_size) * 0.01
+        self._output_bias = torch.zeros(vocabulary_size)
+        for parameter in self.parameters():
+            parameter.requires_grad_()
+        self._tables = None
+
+    def __repr__(self) -> str:
+        """ Representation of the model. """
+        return (f'ContextMLP(vocabulary_size={self.vocabulary_size}, '
+                f'context_length={self.context_length}, '
+                f'embedding_size={self._embeddings.shape[1]}, '
+                f'hidden_size={self._hidden_bias.shape[0]})')
+
+    @property
+    def vocabulary_size(self) -> int:
+        """ Size of the vocabulary. """
+        return self._embeddings.shape[0]
+
+    @property
+    def context_length(self) -> int:
+        """ Number of characters in each window. """
+        return self._hidden_weights.shape[0] // self._embeddings.shape[1]
+
+    def _get_tables(self) -> torch.Tensor:
+        # Folded tables are computed on first use after every update, and
+        # hold one (V, H) table per window position, stacked into a
+        # (context_length * V, H) tensor.
+        if self._tables is None:
+            with torch.no_grad():
+                weights = self._hidden_weights.reshape(
+                    self.context_length, self._embeddings.shape[1], -1)
+                self._tables = (self._embeddings @ weights).reshape(
+                    -1, weights.shape[2])
+        return self._tables
+
+    def _get_hidden(self, inputs: torch.Tensor) -> torch.Tensor:
+        if torch.is_grad_enabled():
+            embeddings = self._embeddings[inputs].reshape(inputs.shape[0], -1)
+            return torch.tanh(embeddings @ self._hidden_weights +
+                              self._hidden_bias)
+
+        # The rows of each window are gathered and summed in a single pass,
+        # without materializing an (N, context_length, H) tensor.
+        offsets = torch.arange(self.context_length) * self.vocabulary_size
+        rows = torch.nn.functional.embedding_bag(inputs + offsets,
+                                                 self._get_tables(),
+                                                 mode='sum')
+        return torch.tanh(rows + self._hidden_bias)
+
+    def _check_inputs(self, inputs: torch.Tensor,
+                      labels: torch.Tensor = None) -> torch.Tensor:
+        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
+        if inputs.dim() == 1:
+            inputs = inputs.unsqueeze(0)
+        assert not inputs.is_floating_point() and \
+            inputs.shape[1] == self.context_length, \
+            'Input has an invalid shape (arg #1)'
+        if labels is not None:
+            assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #2)'
+            assert inputs.shape[0] == labels.reshape(-1).shape[
+                0], 'Input and label shapes do not match (arg #1, #2)'
+        return inputs.long()
+
+    def _get_logits(self, inputs: torch.Tensor) -> torch.Tensor:
+        return self._get_hidden(inputs) @ self._output_weights + \
+            self._output_bias
+
+    def __call__(
+        self,
+        inputs: torch.Tensor,
+        labels: torch.Tensor = None
+    ) -> tuple[torch.Tensor, torch.Tensor | None]:
+        """ Evaluates the model on the given inputs and provides a probability
+        of the expected outcome.
+
+        If labels are provided, loss is calculated using average negative log
+        loss.
+
+        :param inputs: Inputs to the model, specified as an integer tensor of
+        shape (N, context_length), or (context_length, ) for a single window.
+        :param labels: Labels to use for loss calculation, specified as an
+        integer tensor of N vocabulary indices. If None, no loss is returned
+        """
+
+        inputs = self._check_inputs(inputs, labels)
+        log_probs = torch.log_softmax(self._get_logits(inputs), 1)
+        probs = log_probs.exp()
+        loss = None
+        if labels is not None:
+            loss = torch.nn.functional.nll_loss(log_probs,
+                                                labels.reshape(-1).long())
+        return probs, loss
+
+    def get_loss(self, inputs: torch.Tensor,
+                 labels: torch.Tensor) -> torch.Tensor:
+        """ Computes the average negative log loss of the model, without
+        computing the probabilities of every outcome.
+
+        :param inputs: Inputs to the model, specified as an integer tensor of
+        shape (N, context_length).
+        :param labels: Labels to use for loss calculation, specified as an
+        integer tensor of N vocabulary indices.
+        :return: The loss.
+        """
+
+        inputs = self._check_inputs(inputs, labels)
+        return torch.nn.functional.cross_entropy(self._get_logits(inputs),
+                                                 labels.reshape(-1).long())
+
+    @profiling.profiled()
+    def generate_word(self,
+                      encoder: BaseEncoder,
+                      generator: torch.Generator = None) -> str:
+        """ Generates a word using the model.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: The generated word as a string.
+        """
+
+        assert isinstance(encoder, BaseEncoder), 'Invalid encoder (arg #1)'
+
+        if generator is None:
+            generator = global_generator
+
+        stop_index = encoder.get_index('.')
+        context = [stop_index] * self.context_length
+        indices = []
+        with torch.no_grad():
+            while True:
+                probs, _ = self(torch.tensor(context))
+                index = torch.multinomial(probs[0],
+                                          1,
+                                          replacement=True,
+                                          generator=generator).item()
+                if index == stop_index:
+                    break
+                indices.append(index)
+                context = context[1:] + [index]
+        return encoder.decode(torch.tensor(indices, dtype=torch.long))
+
+    @profiling.profiled()
+    def generate_words(self,
+                       encoder: BaseEncoder,
+                       count: int,
+                       max_len: int = 32,
+                       generator: torch.Generator = None) -> list[str]:
+        """ Generates a batch of words using the model. All words are advanced
+        together, with a single sampling call per character position.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param count: The number of words to generate.
+        :param max_len: The maximum number of characters sampled for each word,
+        including the termination character. Longer words are truncated.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: A list of generated words.
+        """
+
+        assert isinstance(encoder, BaseEncoder), 'Invalid encoder (arg #1)'
+        assert count >= 0, 'Invalid count (arg #2)'
+        assert max_len > 0, 'Invalid max_len (arg #3)'
+
+        if generator is None:
+            generator = global_generator
+
+        stop_index = encoder.get_index('.')
+        length = self.context_length
+        history = torch.full((count, length + max_len),
+                             stop_index,
+                             dtype=torch.long)
+        active = torch.arange(count)
+        with torch.no_grad():
+            for step in range(max_len):
+                if active.shape[0] == 0:
+                    break
+                probs, _ = self(history[active, step:step + length])
+                current = torch.multinomial(probs,
+                                            1,
+                                            replacement=True,
+                                            generator=generator).squeeze(1)
+                history[active, step + length] = current
+                active = active[current != stop_index]
+        return decode_sequences(history[:, length:], encoder)
+
+    @profiling.profiled()
+    def score_words(self,
+                    words: WordList | EncodedCorpus | list,
+                    encoder: BaseEncoder,
+                    batch_size: int = None) -> torch.Tensor:
+        """ Computes the negative log-likelihood of whole words, including
+        their termination characters.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param encoder: The encoder used to convert characters to indices.
+        :param batch_size: The maximum number of windows scored at a time. If
+        omitted, all windows are scored together.
+        :return: A tensor with the negative log-likelihood of each word, in the
+        order of the input words.
+        """
+
+        assert isinstance(encoder, BaseEncoder), 'Invalid encoder (arg #2)'
+        assert batch_size is None or batch_size > 0, \
+            'Invalid batch_size (arg #3)'
+
+        if isinstance(words, WordList):
+            words = words.corpus
+        if not isinstance(words, EncodedCorpus):
+            words = EncodedCorpus.from_lines(
+                [word if isinstance(word, str) else word.text
+                 for word in words], encoder.vocabulary)
+        contexts, labels = self._get_context_encoder(encoder).get_contexts(
+            words)
+        word_ids = torch.repeat_interleave(
+            torch.arange(len(words)), words.offsets[1:] - words.offsets[:-1])
+
+        if batch_size is None:
+            batch_size = max(contexts.shape[0], 1)
+        scores = torch.zeros(len(words), dtype=torch.double)
+        with torch.no_grad():
+            for start in range(0, contexts.shape[0], batch_size):
+                end = start + batch_size
+                probs, _ = self(contexts[start:end])
+                log_probs = probs[torch.arange(probs.shape[0]),
+                                  labels[start:end]].log()
+                scores.index_add_(0, word_ids[start:end],
+                                  -log_probs.double())
+        return scores.float()
+
+    def save(self, file_name: str, encoder: BaseEncoder):
+        """ Saves the weights of the network and the vocabulary of its encoder
+        to a checkpoint file.
+
+        :param file_name: The name of the checkpoint file.
+        :param encoder: The encoder used by the model.
+        """
+
+        assert isinstance(encoder, BaseEncoder), 'Invalid encoder (arg #2)'
+        write_checkpoint(file_name, 'ContextMLP',
+                         BigramEncoder(encoder.vocabulary), {}, {
+                             'embeddings': self._embeddings,
+                             'hidden_weights': self._hidden_weights,
+                             'hidden_bias': self._hidden_bias,
+                             'output_weights': self._output_weights,
+                             'output_bias': self._output_bias,
+                         })
+
+    @classmethod
+    def load(cls, file_name: str) -> tuple['ContextMLP', ContextEncoder]:
+        """ Loads a model saved with save(). The weights are memory mapped from
+        the checkpoint, and are only copied if the model is trained further.
+
+        :param file_name: The name of the checkpoint file.
+        :return: A tuple containing the model and a context encoder for its
+        vocabulary.
+        """
+
+        _, encoder, tensors = read_checkpoint(file_name, 'ContextMLP')
+        model = cls.__new__(cls)
+        model._embeddings = tensors['embeddings']
+        model._hidden_weights = tensors['hidden_weights']
+        model._hidden_bias = tensors['hidden_bias']
+        model._output_weights = tensors['output_weights']
+        model._output_bias = tensors['output_bias']
+        for parameter in model.parameters():
+            parameter.requires_grad_()
+        model._tables = None
+        return model, ContextEncoder(encoder.vocabulary, model.context_length)
+
+    def reset_grad(self):
+        """ Resets the gradient of the network.
+        This is necessary to avoid accumulating gradients from multiple gradient
+        calculations.
+        """
+
+        for parameter in self.parameters():
+            parameter.grad = None
+
+    def parameters(self) -> list[torch.Tensor]:
+        """ Returns the list of trainable parameters of the network. """
+
+        return [
+            self._embeddings, self._hidden_weights, self._hidden_bias,
+            self._output_weights, self._output_bias
+        ]
+
+    def clear_cache(self):
+        """ Discards the tables folded from the parameters. This must be
+        called after the parameters are modified other than with update().
+        """
+
+        self._tables = None
+
+    def update(self, delta: float, optimizer: Optimizer = None):
+        """ Updates the weights of the network in the direction of the negative
+        gradient, using the specified step size
+
+        :param delta: The step size to use for the update.
+        :param optimizer: An optional optimizer used to compute the update. If
+        omitted, a plain gradient descent step is taken.
+        """
+
+        self.clear_cache()
+        if optimizer is not None:
+            optimizer.step(self.parameters(), delta)
+            return
+        for parameter in self.parameters():
+            parameter.data += -delta * parameter.grad
+
+    def _get_context_encoder(self, encoder: BaseEncoder) -> ContextEncoder:
+        if isinstance(encoder, ContextEncoder) and \
+                encoder.context_length == self.context_length:
+            return encoder
+        return ContextEncoder(encoder.vocabulary, self.context_length)
+
+    def prepare_data(
+            self, words: WordList | EncodedCorpus | list,
+            encoder: BaseEncoder) -> tuple[torch.Tensor, torch.Tensor]:
+        """ Prepares data that can be used to train this model.
+
+        :param words: A WordList, EncodedCorpus or list of Word objects
+        containing the words to be used to generate the dataset.
+        :param encoder: The encoder used to convert characters to indices.
+        :return: A tuple containing the input tensor of shape
+        (N, context_length) and the label tensor of shape (N, ).
+        """
+
+        return self._get_context_encoder(encoder).get_contexts(words)
+
+    def iter_data(
+            self,
+            words: WordList,
+            encoder: BaseEncoder,
+            chunk_size: int = None
+    ) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        """ Prepares data that can be used to train this model, one chunk of
+        words at a time.
+
+        :param words: A WordList object containing the words to be used to
+        generate the dataset.
+        :param encoder: The encoder used to convert characters to indices.
+        :param chunk_size: The number of words in each chunk. Defaults to the
+        chunking behavior of WordList.iter_corpus().
+        :return: An iterator of tuples containing the input and label tensors
+        for each chunk.
+        """
+
+        for corpus in words.iter_corpus(chunk_size):
+            yield self.prepare_data(corpus, encoder)
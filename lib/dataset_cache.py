@@ -0,0 +1,145 @@
+import hashlib
+import os
+import torch
+from .encoded_corpus import EncodedCorpus
+from .tensor_file import read_tensors, write_tensors
+from . import profiling
+
+# Incremented whenever the layout of cached datasets changes, so that caches
+# written by older versions are rebuilt.
+_CACHE_VERSION = 1
+
+
+class DatasetCache:
+    """ Persistent cache of an encoded dataset.
+
+    The vocabulary, encoded corpus and prepared input/label index tensors are
+    stored in a binary file next to the source file. The cache is keyed by a
+    hash of the source file, the input count and the encoder type, and is
+    rebuilt automatically when any of these change. Cached tensors are memory
+    mapped on load instead of being recomputed.
+    """
+
+    def __init__(self, file_name: str, encoder_type: type,
+                 input_count: int = 1):
+        """ Initializes the cache for a given source file.
+
+        :param file_name: The name of the file containing the words.
+        :param encoder_type: The type of encoder that the dataset is prepared
+        for.
+        :param input_count: The number of characters to be used as input.
+        """
+
+        assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+        assert isinstance(encoder_type, type), 'Invalid encoder_type (arg #2)'
+        assert input_count >= 0, 'Invalid input_count (arg #3)'
+
+        self._file_name = file_name
+        self._encoder_type = encoder_type
+        self._input_count = input_count
+        self._hit = None
+
+    def __repr__(self) -> str:
+        """ Representation of the cache. """
+        return f'DatasetCache({self.cache_file_name})'
+
+    @property
+    def cache_file_name(self) -> str:
+        """ Name of the file that holds the cached dataset. """
+        encoder_name = self._encoder_type.__name__.lower()
+        return f'{self._file_name}.{encoder_name}-{self._input_count}.cache'
+
+    @property
+    def hit(self) -> bool | None:
+        """ True if the last call to get() was served from the cache, False if
+        the dataset was rebuilt, and None if get() has not been called. """
+        return self._hit
+
+    def get_key(self) -> dict:
+        """ Returns the key that identifies the current contents of the source
+        file and the dataset options. """
+
+        digest = hashlib.sha256()
+        with open(self._file_name, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return {
+            'version': _CACHE_VERSION,
+            'source_hash': digest.hexdigest(),
+            'input_count': self._input_count,
+            'encoder': self._encoder_type.__name__,
+        }
+
+    def load(
+        self,
+        key: dict = None
+    ) -> tuple[EncodedCorpus, torch.Tensor, torch.Tensor] | None:
+        """ Loads the dataset from the cache file.
+
+        :param key: The expected cache key. Computed from the source file if
+        omitted.
+        :return: A tuple containing the corpus, input and label tensors, or None
+        if the cache file is missing, unreadable or stale.
+        """
+
+        if not os.path.exists(self.cache_file_name):
+            return None
+        if key is None:
+            key = self.get_key()
+        # Truncated, corrupted or outdated cache files fail in different ways
+        # while they are read, and are all rebuilt.
+        try:
+            metadata, tensors = read_tensors(self.cache_file_name)
+            if metadata.get('key') != key:
+                return None
+            corpus = EncodedCorpus(tensors['tokens'], tensors['offsets'],
+                                   metadata['vocabulary'])
+            return corpus, tensors['inputs'], tensors['labels']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, corpus: EncodedCorpus, inputs: torch.Tensor,
+             labels: torch.Tensor, key: dict = None):
+        """ Saves a dataset to the cache file.
+
+        :param corpus: The encoded corpus.
+        :param inputs: The prepared input index tensor.
+        :param labels: The prepared label index tensor.
+        :param key: The cache key. Computed from the source file if omitted.
+        """
+
+        assert isinstance(corpus, EncodedCorpus), 'Invalid corpus (arg #1)'
+        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #2)'
+        assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #3)'
+
+        if key is None:
+            key = self.get_key()
+        write_tensors(self.cache_file_name, {
+            'key': key,
+            'vocabulary': corpus.vocabulary,
+        }, {
+            'tokens': corpus.tokens,
+            'offsets': corpus.offsets,
+            'inputs': inputs,
+            'labels': labels,
+        })
+
+    @profiling.profiled()
+    def get(self) -> tuple[EncodedCorpus, torch.Tensor, torch.Tensor]:
+        """ Returns the dataset, loading it from the cache if the cache is
+        current, or building it from the source file and updating the cache
+        otherwise.
+
+        :return: A tuple containing the corpus, and the input and label index
+        tensors produced by EncodedCorpus.get_pairs().
+        """
+
+        key = self.get_key()
+        dataset = self.load(key)
+        self._hit = dataset is not None
+        if dataset is None:
+            corpus = EncodedCorpus.from_file(self._file_name)
+            inputs, labels = corpus.get_pairs(self._input_count)
+            self.save(corpus, inputs, labels, key)
+            dataset = corpus, inputs, labels
+        return dataset
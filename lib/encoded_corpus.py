@@ -0,0 +1,274 @@
+from typing import TYPE_CHECKING
+from .backends import Backend, get_backend, get_array_backend
+from .base_encoder import BaseEncoder
+from .vocabulary import LINE_BREAKS as _LINE_BREAKS, build_vocabulary
+from . import profiling
+
+if TYPE_CHECKING:
+    import torch
+
+
+class EncodedCorpus:
+    """ Compact, array backed representation of a list of words.
+
+    All words are stored in a single contiguous token buffer, with the
+    termination character separating adjacent words, so that the corpus
+    '.emma.olivia.' holds the words 'emma' and 'olivia'. A separate offsets
+    array holds the position of the leading termination character of each word,
+    followed by the position of the final termination character.
+
+    Tokens are stored using the smallest integer type that can hold the
+    vocabulary, which is a single byte per character for most corpora. The
+    buffers are torch tensors by default, or arrays of another backend (see
+    lib.backends), in which case every operation on the corpus uses that
+    backend.
+    """
+
+    def __init__(self, tokens: 'torch.Tensor', offsets: 'torch.Tensor',
+                 vocabulary: list[str]):
+        """ Initializes the corpus from pre-encoded tokens and offsets.
+
+        :param tokens: A one dimensional tensor of vocabulary indices.
+        :param offsets: A one dimensional tensor containing the position of the
+        leading termination character of every word, followed by the position
+        of the final termination character. It must belong to the same backend
+        as the tokens.
+        :param vocabulary: The list of characters used to encode the tokens.
+        """
+
+        backend = get_array_backend(tokens)
+        assert backend.is_array(offsets), 'Invalid offsets (arg #2)'
+        assert isinstance(vocabulary, list), 'Invalid vocabulary (arg #3)'
+
+        self._backend = backend
+        self._tokens = tokens
+        self._offsets = offsets
+        self._vocabulary = vocabulary
+        self._encoder = None
+
+    @staticmethod
+    def get_token_dtype(vocabulary_size: int,
+                        backend: str | Backend = None) -> 'torch.dtype':
+        """ Returns the smallest integer type that can hold every index of a
+        vocabulary of the given size.
+
+        :param vocabulary_size: The number of characters in the vocabulary.
+        :param backend: The array backend of the type. Defaults to torch.
+        """
+
+        backend = get_backend(backend)
+        return backend.uint8 if vocabulary_size <= 256 else backend.int32
+
+    @staticmethod
+    def build_vocabulary(text: str | set[str]) -> list[str]:
+        """ Builds a sorted vocabulary from the characters in the given text,
+        with the termination character at index 0.
+
+        :param text: The text, or set of characters, to build the vocabulary
+        from. Line breaks are excluded from the vocabulary.
+        """
+
+        return build_vocabulary(text)
+
+    @classmethod
+    @profiling.profiled()
+    def from_lines(cls,
+                   lines: list[str],
+                   vocabulary: list[str],
+                   backend: str | Backend = None) -> 'EncodedCorpus':
+        """ Creates an encoded corpus from a list of words.
+
+        :param lines: The text of each word, excluding termination characters.
+        :param vocabulary: The list of characters used to encode the words.
+        The termination character must be present in the vocabulary.
+        :param backend: The array backend of the corpus. Defaults to torch.
+        """
+
+        assert isinstance(lines, list), 'Invalid lines (arg #1)'
+        assert isinstance(vocabulary, list), 'Invalid vocabulary (arg #2)'
+
+        backend = get_backend(backend)
+        lengths = backend.asarray([len(line) + 1 for line in lines],
+                                  backend.long)
+        offsets = backend.zeros(len(lines) + 1, backend.long)
+        offsets[1:] = backend.cumsum(lengths)
+
+        stream = '.' + '.'.join(lines) + '.' if len(lines) > 0 else '.'
+        tokens = BaseEncoder(vocabulary).encode(
+            stream, EncodedCorpus.get_token_dtype(len(vocabulary), backend),
+            backend)
+        return cls(tokens, offsets, vocabulary)
+
+    @classmethod
+    @profiling.profiled()
+    def from_file(cls,
+                  file_name: str,
+                  backend: str | Backend = None) -> 'EncodedCorpus':
+        """ Creates an encoded corpus from a file with one word per line. The
+        vocabulary is built from the characters found in the file.
+
+        :param file_name: The name of the file containing the words.
+        :param backend: The array backend of the corpus. Defaults to torch.
+        """
+
+        assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+
+        with open(file_name) as file:
+            text = file.read()
+        chars = set(text)
+        vocabulary = EncodedCorpus.build_vocabulary(chars)
+        if len(text) == 0 or not (chars & _LINE_BREAKS) <= {'\n'}:
+            return cls.from_lines(text.splitlines(), vocabulary, backend)
+
+        # Files that only use '\n' as a line break are encoded without
+        # splitting them into per-line strings.
+        if text.endswith('\n'):
+            text = text[:-1]
+        offsets = [0]
+        position = text.find('\n')
+        while position >= 0:
+            offsets.append(position + 1)
+            position = text.find('\n', position + 1)
+        offsets.append(len(text) + 1)
+
+        backend = get_backend(backend)
+        stream = '.' + text.replace('\n', '.') + '.'
+        tokens = BaseEncoder(vocabulary).encode(
+            stream, EncodedCorpus.get_token_dtype(len(vocabulary), backend),
+            backend)
+        offsets = backend.asarray(offsets, backend.long)
+        return cls(tokens, offsets, vocabulary)
+
+    @classmethod
+    def concatenate(cls,
+                    corpora: list['EncodedCorpus'],
+                    vocabulary: list[str],
+                    backend: str | Backend = None) -> 'EncodedCorpus':
+        """ Joins several corpora, encoded with the same vocabulary, into a
+        single corpus.
+
+        :param corpora: The list of corpora to join, in order. All of them
+        must use the same backend.
+        :param vocabulary: The vocabulary shared by all of the corpora.
+        :param backend: The array backend of an empty result. Otherwise, the
+        backend of the corpora is used.
+        """
+
+        assert isinstance(corpora, list), 'Invalid corpora (arg #1)'
+        assert isinstance(vocabulary, list), 'Invalid vocabulary (arg #2)'
+
+        if len(corpora) == 0:
+            return cls.from_lines([], vocabulary, backend)
+
+        # Adjacent corpora share a termination character at the join.
+        tokens = [corpora[0].tokens]
+        offsets = [corpora[0].offsets[:-1]]
+        shift = corpora[0].tokens.shape[0] - 1
+        for corpus in corpora[1:]:
+            tokens.append(corpus.tokens[1:])
+            offsets.append(corpus.offsets[:-1] + shift)
+            shift += corpus.tokens.shape[0] - 1
+        backend = corpora[0].backend
+        offsets.append(backend.asarray([shift], backend.long))
+        return cls(backend.concatenate(tokens), backend.concatenate(offsets),
+                   vocabulary)
+
+    def __repr__(self) -> str:
+        """ Representation of the corpus. """
+        return (f'EncodedCorpus(count={len(self)}, '
+                f'tokens={self._tokens.shape[0]})')
+
+    def __len__(self) -> int:
+        """ Number of words in the corpus. """
+        return self._offsets.shape[0] - 1
+
+    def __getitem__(self, index: int | slice) -> 'str | EncodedCorpus':
+        """ Decodes the text of a single word, excluding termination
+        characters, or returns a range of words as a corpus.
+
+        :param index: The index of the word to be retrieved, or a slice. Raw
+        indices must be non-negative, and slices must be contiguous. Slices
+        share the token buffer of this corpus, and do not copy it.
+        """
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, 'Invalid index (arg #1)'
+            stop = max(start, stop)
+            first = self._offsets[start].item()
+            last = self._offsets[stop].item()
+            return EncodedCorpus(self._tokens[first:last + 1],
+                                 self._offsets[start:stop + 1] - first,
+                                 self._vocabulary)
+
+        assert index >= 0, 'Invalid index (arg #1)'
+        start = self._offsets[index].item() + 1
+        end = self._offsets[index + 1].item()
+        if self._encoder is None:
+            self._encoder = BaseEncoder(self._vocabulary)
+        return self._encoder.decode(self._tokens[start:end])
+
+    @property
+    def backend(self) -> Backend:
+        """ Array backend of the token and offset buffers. """
+        return self._backend
+
+    @property
+    def tokens(self) -> 'torch.Tensor':
+        """ Token buffer, including the termination characters between
+        words. """
+        return self._tokens
+
+    @property
+    def offsets(self) -> 'torch.Tensor':
+        """ Position of the leading termination character of every word,
+        followed by the position of the final termination character. """
+        return self._offsets
+
+    @property
+    def vocabulary(self) -> list[str]:
+        """ List of characters used to encode the tokens. """
+        return self._vocabulary
+
+    @property
+    def vocabulary_size(self) -> int:
+        """ Size of the vocabulary. """
+        return len(self._vocabulary)
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the token and offset buffers, in bytes. """
+        return (self._backend.nbytes(self._tokens) +
+                self._backend.nbytes(self._offsets))
+
+    @profiling.profiled()
+    def get_pairs(
+            self,
+            input_count: int = 1) -> tuple['torch.Tensor', 'torch.Tensor']:
+        """ Splits every word into pairs comprising inputs and labels, matching
+        the pairs produced by Word.get_pairs().
+
+        :param input_count: The number of characters to be used as input.
+
+        :returns: A tuple of index tensors, of the backend of the corpus. The
+        first has the shape (N, input_count) and contains the inputs, and the
+        second has the shape (N, 1) and contains the labels.
+        """
+
+        assert input_count >= 0, 'Invalid input_count (arg #1)'
+
+        backend = self._backend
+        starts = self._offsets[:-1]
+        # Each word spans (end - start + 1) tokens including both termination
+        # characters, and yields one pair per window of input_count tokens
+        # that is followed by a label.
+        counts = backend.clamp_min(
+            self._offsets[1:] - starts + 1 - input_count, 0)
+        group_starts = backend.cumsum(counts) - counts
+        positions = backend.arange(counts.sum().item())
+        positions += backend.repeat(starts - group_starts, counts)
+
+        tokens = backend.to(self._tokens, backend.long)
+        window = backend.arange(input_count + 1)
+        pairs = tokens[positions[:, None] + window]
+        return pairs[:, :input_count], pairs[:, input_count:]
@@ -1,7 +1,15 @@
 import torch
+from typing import Iterator
+from .sequence_batch import batch_sequences, score_sequences
 from .utils import global_generator, prepare_data
+from .utils import generate_sequences, search_sequences
+from .utils import decode_sequences
 from .bigram_encoder import BigramEncoder
 from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+from .optimizers import Optimizer
+from .checkpoint import read_checkpoint, write_checkpoint
+from . import profiling
 
 
 class NeuronBigram:
@@ -9,11 +17,19 @@ class NeuronBigram:
 
     This model is a simple feedforward neural network with a single layer and no
     nonlinearites.
+
+    Inputs can be provided either as one-hot embeddings, or as vocabulary
+    indices. Multiplying a one-hot embedding by the weights selects a single
+    row of the weights, so index inputs select that row directly, which gives
+    identical results without materializing the embeddings or performing the
+    matrix multiplication.
     """
 
+    @profiling.profiled()
     def __init__(self,
                  vocabulary_size: int,
-                 generator: torch.Generator = None):
+                 generator: torch.Generator = None,
+                 use_indices: bool = False):
         """ Initializes the model with random weights.
         Weight generation will use the given generator if provided, or the
         global generator if not.
@@ -21,13 +37,18 @@ class NeuronBigram:
         :param vocabulary_size: The size of the vocabulary.
         :param generator: A torch generator object used to generate random
         weights.
+        :param use_indices: If True, data prepared for this model contains
+        vocabulary indices instead of one-hot embeddings.
         """
 
         assert isinstance(vocabulary_size,
                           int), "Invalid vocabulary_size (arg #1)"
+        assert isinstance(use_indices, bool), "Invalid use_indices (arg #3)"
         if generator is None:
             generator = global_generator
 
+        self._use_indices = use_indices
+
         self._weights = torch.randn((vocabulary_size, vocabulary_size),
                                     dtype=torch.float,
                                     requires_grad=True,
@@ -37,6 +58,29 @@ class NeuronBigram:
         """ Representation of the model. """
         return f'NeuronBigram({self._weights.shape})'
 
+    @property
+    def use_indices(self) -> bool:
+        """ True if data prepared for this model contains vocabulary indices
+        instead of one-hot embeddings. """
+        return self._use_indices
+
+    def _check_inputs(self, inputs: torch.Tensor,
+                      labels: torch.Tensor = None) -> bool:
+        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
+        index_inputs = not inputs.is_floating_point()
+        assert index_inputs or inputs.shape[-1] == self._weights.shape[
+            0], 'Input has an invalid shape (arg #1)'
+        if labels is not None:
+            assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #2)'
+            assert inputs.shape[0] == labels.shape[
+                0], 'Input and label shapes do not match (arg #1, #2)'
+        return index_inputs
+
+    def _get_logits(self, inputs: torch.Tensor) -> torch.Tensor:
+        if not inputs.is_floating_point():
+            return self._weights[inputs]
+        return inputs @ self._weights
+
     def __call__(
         self,
         inputs: torch.Tensor,
@@ -46,32 +90,70 @@ class NeuronBigram:
         of the expected outcome.
 
         If labels are provided, loss is calculated using average negative log
-        loss.
+        loss, as computed by get_loss().
 
-        :param inputs: Inputs to the model, specified as a tensor of embeddings.
-        :param labels: Labels to use for loss calculation. If None, no loss is
-        returned
+        :param inputs: Inputs to the model, specified as a tensor of embeddings,
+        or as an integer tensor of vocabulary indices.
+        :param labels: Labels to use for loss calculation, specified as a tensor
+        of embeddings or an integer tensor of vocabulary indices. If None, no
+        loss is returned
         """
 
-        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
-        assert inputs.shape[-1] == self._weights.shape[
-            0], 'Input has an invalid shape (arg #1)'
-        if labels is not None:
-            assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #2)'
-            assert inputs.shape[0] == labels.shape[
-                0], 'Input and label shapes do not match (arg #1, #2)'
-
-        # logits = self._weights[torch.argmax(inputs, len(inputs.shape) - 1)]
-        logits = inputs @ self._weights
-        sum_index = len(logits.shape) - 1
-        counts = torch.exp(logits)
-        probs = counts / counts.sum(sum_index, keepdim=True)
+        self._check_inputs(inputs, labels)
+        logits = self._get_logits(inputs)
+        probs = torch.softmax(logits, len(logits.shape) - 1)
         loss = None
         if labels is not None:
-            loss = probs[torch.arange(probs.shape[0]), labels.argmax(1)]
-            loss = -loss.log().mean()
+            loss = self.get_loss(inputs, labels)
         return probs, loss
 
+    def get_loss(self, inputs: torch.Tensor,
+                 labels: torch.Tensor) -> torch.Tensor:
+        """ Computes the average negative log loss of the model, without
+        computing the probabilities of every outcome.
+
+        The loss is computed from log-softmax values, which remain finite for
+        large logits. For index inputs, the log normalizer of every row of the
+        weights is computed once, so the loss of each example only gathers two
+        values, and no (N, V) temporaries are created. One-hot inputs select
+        the same rows with a matrix multiplication, and their loss is computed
+        in the same way, so both give identical losses for the same weights.
+        This is the path used by Trainer.
+
+        :param inputs: Inputs to the model, specified as a tensor of embeddings,
+        or as an integer tensor of vocabulary indices.
+        :param labels: Labels to use for loss calculation, specified as a tensor
+        of embeddings or an integer tensor of vocabulary indices.
+        :return: The loss.
+        """
+
+        index_inputs = self._check_inputs(inputs, labels)
+        if labels.is_floating_point():
+            labels = labels.argmax(1)
+        if index_inputs:
+            log_norms = torch.logsumexp(self._weights, 1)
+            return (log_norms[inputs] - self._weights[inputs, labels]).mean()
+        logits = self._get_logits(inputs)
+        log_norms = torch.logsumexp(logits, 1)
+        return (log_norms - logits.gather(1, labels[:, None])[:, 0]).mean()
+
+    def predict(self, inputs: torch.Tensor) -> torch.Tensor:
+        """ Computes the probability distribution of the next character for
+        the given inputs, in inference mode. Gradients are not tracked, and
+        the returned tensor cannot be used for training.
+
+        :param inputs: Inputs to the model, specified as a tensor of embeddings,
+        or as an integer tensor of vocabulary indices.
+        :return: The probabilities, with a trailing dimension of the
+        vocabulary size.
+        """
+
+        self._check_inputs(inputs)
+        with torch.inference_mode():
+            logits = self._get_logits(inputs)
+            return torch.softmax(logits, len(logits.shape) - 1)
+
+    @profiling.profiled()
     def generate_word(self,
                       encoder: BigramEncoder,
                       generator: torch.Generator = None) -> str:
@@ -89,19 +171,19 @@ class NeuronBigram:
         if generator is None:
             generator = global_generator
 
-        chars = []
-        index = encoder.get_index('.')
+        stop_index = encoder.get_index('.')
+        indices = []
+        index = stop_index
         while True:
-            embedding_input = tuple(encoder.get_char(index))
-            probs, _ = self(encoder.get_embedding(embedding_input))
+            probs = self.predict(torch.tensor(index))
             index = torch.multinomial(probs,
                                       1,
                                       replacement=True,
                                       generator=generator).item()
-            if index == encoder.get_index('.'):
+            if index == stop_index:
                 break
-            chars.append(encoder.get_char(index))
-        return ''.join(chars)
+            indices.append(index)
+        return encoder.decode(torch.tensor(indices, dtype=torch.long))
 
     def reset_grad(self):
         """ Resets the gradient of the network.
@@ -111,25 +193,206 @@ class NeuronBigram:
 
         self._weights.grad = None
 
-    def update(self, delta: float):
+    def get_transitions(self) -> torch.Tensor:
+        """ Returns the matrix of transition probabilities computed from the
+        current weights, in which row i holds the probability distribution of
+        the character that follows the character with index i.
+        """
+
+        return self.predict(torch.arange(self._weights.shape[0]))
+
+    def get_log_transitions(self) -> torch.Tensor:
+        """ Returns the matrix of log transition probabilities, computed from
+        the logits with a log-softmax, so that probabilities too small to be
+        represented by get_transitions() remain finite.
+        """
+
+        with torch.no_grad():
+            return torch.log_softmax(self._weights, 1)
+
+    @profiling.profiled()
+    def generate_words(self,
+                       encoder: BigramEncoder,
+                       count: int,
+                       max_len: int = 32,
+                       generator: torch.Generator = None) -> list[str]:
+        """ Generates a batch of words using the model. All words are advanced
+        together, with a single sampling call per character position.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param count: The number of words to generate.
+        :param max_len: The maximum number of characters sampled for each word,
+        including the termination character. Longer words are truncated.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: A list of generated words.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #1)"
+
+        sequences = generate_sequences(self.get_transitions(),
+                                       encoder.get_index('.'), count, max_len,
+                                       generator)
+        return decode_sequences(sequences, encoder)
+
+    @profiling.profiled()
+    def top_words(self,
+                  encoder: BigramEncoder,
+                  count: int,
+                  prefix: str = '',
+                  min_len: int = 1,
+                  max_len: int = 32) -> list[tuple[str, float]]:
+        """ Finds the most likely words under the model, or the most likely
+        completions of a prefix, with a batched search over the transition
+        matrix rather than by sampling.
+
+        :param encoder: The encoder used to convert between characters and
+        indices.
+        :param count: The maximum number of words to return.
+        :param prefix: An optional prefix that every word starts with.
+        :param min_len: The minimum number of characters of each word,
+        including the prefix.
+        :param max_len: The maximum number of characters of each word,
+        including the prefix.
+        :return: A list of (word, log_prob) tuples, from most to least likely,
+        where log_prob is the log probability of the whole word, including its
+        prefix and termination character.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #1)"
+        assert isinstance(prefix, str), "Invalid prefix (arg #3)"
+
+        sequences, log_probs = search_sequences(self.get_log_transitions(),
+                                                encoder.get_index('.'), count,
+                                                encoder.encode(prefix),
+                                                min_len, max_len)
+        return list(zip(decode_sequences(sequences, encoder),
+                        log_probs.tolist()))
+
+    def save(self, file_name: str, encoder: BigramEncoder):
+        """ Saves the weights of the network and the vocabulary of its encoder
+        to a checkpoint file.
+
+        :param file_name: The name of the checkpoint file.
+        :param encoder: The encoder used by the model.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #2)"
+        write_checkpoint(file_name, 'NeuronBigram', encoder,
+                         {'use_indices': self._use_indices},
+                         {'weights': self._weights})
+
+    @classmethod
+    def load(cls, file_name: str) -> tuple['NeuronBigram', BigramEncoder]:
+        """ Loads a model saved with save(). The weights are memory mapped from
+        the checkpoint, and are only copied if the model is trained further.
+
+        :param file_name: The name of the checkpoint file.
+        :return: A tuple containing the model and its encoder.
+        """
+
+        metadata, encoder, tensors = read_checkpoint(file_name,
+                                                     'NeuronBigram')
+        model = cls.__new__(cls)
+        model._use_indices = metadata['options']['use_indices']
+        model._weights = tensors['weights'].requires_grad_()
+        return model, encoder
+
+    def parameters(self) -> list[torch.Tensor]:
+        """ Returns the list of trainable parameters of the network. """
+
+        return [self._weights]
+
+    def update(self, delta: float, optimizer: Optimizer = None):
         """ Updates the weights of the network in the direction of the negative
         gradient, using the specified step size
 
         :param delta: The step size to use for the update.
+        :param optimizer: An optional optimizer used to compute the update. If
+        omitted, a plain gradient descent step is taken.
         """
 
+        if optimizer is not None:
+            optimizer.step(self.parameters(), delta)
+            return
         self._weights.data += -delta * self._weights.grad
 
-    def prepare_data(self, words: WordList,
+    @profiling.profiled()
+    def score_words(self,
+                    words: WordList | EncodedCorpus | list,
+                    encoder: BigramEncoder,
+                    batch_size: int = None) -> torch.Tensor:
+        """ Computes the negative log-likelihood of whole words, including
+        their termination characters, with one vectorized pass per batch.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param encoder: The encoder used to convert characters to indices.
+        :param batch_size: The maximum number of words scored at a time. Words
+        are bucketed by length to minimize padding. If omitted, all words are
+        scored together.
+        :return: A tensor with the negative log-likelihood of each word, in the
+        order of the input words.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #2)"
+
+        with torch.no_grad():
+            log_transitions = torch.log_softmax(self._weights, 1)
+        batches = batch_sequences(words, encoder.vocabulary, batch_size)
+        return score_sequences(log_transitions, batches, len(words))
+
+    def prepare_data(self, words: WordList | EncodedCorpus | list,
                      encoder) -> tuple[torch.Tensor, torch.Tensor]:
         """ Prepares data that can be used to train this model.
 
+        :param words: A WordList, EncodedCorpus or list of Word objects
+        containing the words to be used to generate the dataset.
+        :param encoder: The encoder used to convert characters to embeddings.
+        :return: A tuple containing the input and label tensors.
+        """
+
+        if isinstance(words, WordList):
+            words = words.corpus
+        if not isinstance(words, EncodedCorpus):
+            words = EncodedCorpus.from_lines([word.text for word in words],
+                                             encoder.vocabulary)
+        transform = lambda indices: self.prepare_indices(indices, encoder)
+        return prepare_data(words, transform)
+
+    def prepare_indices(self, indices: torch.Tensor,
+                        encoder) -> torch.Tensor:
+        """ Converts index tensors produced by EncodedCorpus.get_pairs() into
+        the format expected by this model.
+
+        :param indices: An index tensor of shape (N, input_count).
+        :param encoder: The encoder used to convert indices to embeddings.
+        :return: The transformed tensor. This is a tensor of indices if the
+        model uses index inputs, and a tensor of one-hot embeddings otherwise.
+        """
+
+        if self._use_indices:
+            return indices[:, 0].long()
+        return encoder.get_embeddings(indices[:, 0])
+
+    def iter_data(
+            self,
+            words: WordList,
+            encoder,
+            chunk_size: int = None
+    ) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        """ Prepares data that can be used to train this model, one chunk of
+        words at a time.
+
         :param words: A WordList object containing the words to be used to
         generate the dataset.
         :param encoder: The encoder used to convert characters to embeddings.
-        :return: A tuple containing the input and label tensors.
+        :param chunk_size: The number of words in each chunk. Defaults to the
+        chunking behavior of WordList.iter_corpus().
+        :return: An iterator of tuples containing the input and label tensors
+        for each chunk.
         """
 
-        transform = lambda chars: torch.stack(
-            [encoder.get_embedding(char) for char in chars])
-        return prepare_data(words[:], transform)
+        for corpus in words.iter_corpus(chunk_size):
+            yield self.prepare_data(corpus, encoder)
@@ -0,0 +1,187 @@
+import math
+import torch
+
+
+class Optimizer:
+    """ Base class for optimizers. An optimizer updates a list of parameters
+    using their gradients, and keeps any per-parameter state (momentum buffers,
+    moment estimates, etc.) that the update rule needs between steps.
+    """
+
+    def __repr__(self) -> str:
+        """ Representation of the optimizer. """
+        return f'{self.__class__.__name__}()'
+
+    def step(self, parameters: list[torch.Tensor], learning_rate: float):
+        """ Updates the parameters in place using their current gradients.
+
+        :param parameters: The list of parameters to update. The same list, in
+        the same order, must be passed on every step.
+        :param learning_rate: The step size to use for the update.
+        """
+
+        raise NotImplementedError()
+
+
+class SGD(Optimizer):
+    """ Stochastic gradient descent, with optional momentum. """
+
+    def __init__(self, momentum: float = 0.0):
+        """ Initializes the optimizer.
+
+        :param momentum: The momentum factor. A value of 0 disables momentum.
+        """
+
+        assert 0 <= momentum < 1, 'Invalid momentum (arg #1)'
+        self._momentum = momentum
+        self._velocities = None
+
+    def __repr__(self) -> str:
+        """ Representation of the optimizer. """
+        return f'SGD(momentum={self._momentum})'
+
+    def step(self, parameters: list[torch.Tensor], learning_rate: float):
+        """ Updates the parameters in place using their current gradients.
+
+        :param parameters: The list of parameters to update.
+        :param learning_rate: The step size to use for the update.
+        """
+
+        if self._momentum == 0:
+            for parameter in parameters:
+                parameter.data += -learning_rate * parameter.grad
+            return
+
+        if self._velocities is None:
+            self._velocities = [torch.zeros_like(p) for p in parameters]
+        for parameter, velocity in zip(parameters, self._velocities):
+            velocity.mul_(self._momentum).add_(parameter.grad)
+            parameter.data += -learning_rate * velocity
+
+
+class Adam(Optimizer):
+    """ Adam optimizer, using bias corrected estimates of the first and second
+    moments of the gradients.
+    """
+
+    def __init__(self,
+                 beta1: float = 0.9,
+                 beta2: float = 0.999,
+                 epsilon: float = 1e-8):
+        """ Initializes the optimizer.
+
+        :param beta1: Decay rate of the first moment estimate.
+        :param beta2: Decay rate of the second moment estimate.
+        :param epsilon: Small value added to the denominator for numerical
+        stability.
+        """
+
+        assert 0 <= beta1 < 1, 'Invalid beta1 (arg #1)'
+        assert 0 <= beta2 < 1, 'Invalid beta2 (arg #2)'
+        assert epsilon > 0, 'Invalid epsilon (arg #3)'
+        self._beta1 = beta1
+        self._beta2 = beta2
+        self._epsilon = epsilon
+        self._moments = None
+        self._step_count = 0
+
+    def __repr__(self) -> str:
+        """ Representation of the optimizer. """
+        return f'Adam(beta1={self._beta1}, beta2={self._beta2})'
+
+    def step(self, parameters: list[torch.Tensor], learning_rate: float):
+        """ Updates the parameters in place using their current gradients.
+
+        :param parameters: The list of parameters to update.
+        :param learning_rate: The step size to use for the update.
+        """
+
+        if self._moments is None:
+            self._moments = [(torch.zeros_like(p), torch.zeros_like(p))
+                             for p in parameters]
+
+        self._step_count += 1
+        correction1 = 1 - self._beta1**self._step_count
+        correction2 = 1 - self._beta2**self._step_count
+        step_size = learning_rate * math.sqrt(correction2) / correction1
+        for parameter, (first, second) in zip(parameters, self._moments):
+            grad = parameter.grad
+            first.mul_(self._beta1).add_(grad, alpha=1 - self._beta1)
+            second.mul_(self._beta2).addcmul_(grad, grad, value=1 - self._beta2)
+            denominator = second.sqrt().add_(self._epsilon)
+            parameter.data.addcdiv_(first, denominator, value=-step_size)
+
+
+class ConstantSchedule:
+    """ Learning rate schedule that always returns the same learning rate. """
+
+    def __init__(self, learning_rate: float):
+        """ Initializes the schedule.
+
+        :param learning_rate: The learning rate.
+        """
+
+        assert learning_rate > 0, 'Invalid learning_rate (arg #1)'
+        self._learning_rate = learning_rate
+
+    def __call__(self, step: int) -> float:
+        """ Returns the learning rate for the given step. """
+        return self._learning_rate
+
+
+class StepSchedule:
+    """ Learning rate schedule that decays the learning rate by a fixed factor
+    every step_size steps.
+    """
+
+    def __init__(self, learning_rate: float, step_size: int, gamma: float):
+        """ Initializes the schedule.
+
+        :param learning_rate: The initial learning rate.
+        :param step_size: The number of steps between decays.
+        :param gamma: The factor applied to the learning rate on each decay.
+        """
+
+        assert learning_rate > 0, 'Invalid learning_rate (arg #1)'
+        assert step_size > 0, 'Invalid step_size (arg #2)'
+        assert gamma > 0, 'Invalid gamma (arg #3)'
+        self._learning_rate = learning_rate
+        self._step_size = step_size
+        self._gamma = gamma
+
+    def __call__(self, step: int) -> float:
+        """ Returns the learning rate for the given step. """
+        return self._learning_rate * self._gamma**(step // self._step_size)
+
+
+class CosineSchedule:
+    """ Learning rate schedule that anneals the learning rate from an initial
+    value to a minimum value along a cosine curve.
+    """
+
+    def __init__(self,
+                 learning_rate: float,
+                 total_steps: int,
+                 min_learning_rate: float = 0.0):
+        """ Initializes the schedule.
+
+        :param learning_rate: The initial learning rate.
+        :param total_steps: The number of steps over which the learning rate
+        is annealed. The minimum learning rate is used after this.
+        :param min_learning_rate: The final learning rate.
+        """
+
+        assert learning_rate > 0, 'Invalid learning_rate (arg #1)'
+        assert total_steps > 0, 'Invalid total_steps (arg #2)'
+        assert 0 <= min_learning_rate <= learning_rate, \
+            'Invalid min_learning_rate (arg #3)'
+        self._learning_rate = learning_rate
+        self._total_steps = total_steps
+        self._min_learning_rate = min_learning_rate
+
+    def __call__(self, step: int) -> float:
+        """ Returns the learning rate for the given step. """
+        progress = min(step, self._total_steps) / self._total_steps
+        scale = 0.5 * (1 + math.cos(math.pi * progress))
+        return self._min_learning_rate + scale * (self._learning_rate -
+                                                  self._min_learning_rate)
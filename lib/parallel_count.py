@@ -0,0 +1,133 @@
+import functools
+import mmap
+import multiprocessing
+import operator
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, TYPE_CHECKING
+from .backends import Backend, get_backend
+from .encoded_corpus import EncodedCorpus
+
+if TYPE_CHECKING:
+    import torch
+
+# Number of bytes decoded and counted at a time within a shard.
+_BLOCK_SIZE = 1 << 24
+
+
+def get_shards(file_name: str, shard_count: int) -> list[tuple[int, int]]:
+    """ Splits a file into byte ranges of roughly equal size, with every range
+    starting at the beginning of a line and ending after a line break.
+
+    :param file_name: The name of the file to split.
+    :param shard_count: The maximum number of ranges to create. Fewer ranges
+    are returned if the file has fewer lines.
+    :return: A list of (start, end) byte offsets.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+    assert shard_count > 0, 'Invalid shard_count (arg #2)'
+
+    size = os.path.getsize(file_name)
+    if size == 0:
+        return []
+
+    boundaries = [0]
+    with open(file_name, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for index in range(1, shard_count):
+                position = mapped.find(b'\n',
+                                       max(index * size // shard_count - 1,
+                                           boundaries[-1]))
+                boundary = size if position < 0 else position + 1
+                if boundary > boundaries[-1] and boundary < size:
+                    boundaries.append(boundary)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _iter_lines(file_name: str, start: int,
+                end: int) -> Iterator[list[str]]:
+    """ Reads the lines in a byte range of a file, in blocks of roughly
+    _BLOCK_SIZE bytes. Blocks end after a '\\n', and are split into lines
+    like str.splitlines(), matching WordList. """
+
+    with open(file_name, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = start
+            while position < end:
+                block_end = min(position + _BLOCK_SIZE, end)
+                if block_end < end:
+                    line_end = mapped.rfind(b'\n', position, block_end)
+                    block_end = end if line_end < 0 else line_end + 1
+                text = mapped[position:block_end].decode('utf-8')
+                position = block_end
+                yield text.splitlines()
+
+
+def _count_shard(file_name: str, start: int, end: int, vocabulary: list[str],
+                 backend_name: str) -> 'torch.Tensor':
+    """ Counts the bigrams in a byte range of a file. """
+
+    backend = get_backend(backend_name)
+    size = len(vocabulary)
+    counts = backend.zeros(size * size, backend.long)
+    for lines in _iter_lines(file_name, start, end):
+        corpus = EncodedCorpus.from_lines(lines, vocabulary, backend)
+        tokens = backend.to(corpus.tokens, backend.long)
+        counts += backend.bincount(tokens[:-1] * size + tokens[1:],
+                                   size * size)
+    return counts.reshape(size, size)
+
+
+def count_bigrams_parallel(file_name: str,
+                           vocabulary: list[str],
+                           workers: int = None,
+                           backend: str | Backend = None) -> 'torch.Tensor':
+    """ Counts the bigrams in a file with one word per line, using a pool of
+    worker processes.
+
+    The file is split into byte ranges aligned to line boundaries, each range
+    is counted by a separate process, and the per-range count matrices are
+    summed. The result is identical to counting the whole file in a single
+    process.
+
+    :param file_name: The name of the file containing the words.
+    :param vocabulary: The vocabulary used to index the counts. Every
+    character in the file must be present in the vocabulary.
+    :param workers: The number of worker processes. Defaults to the number of
+    CPUs.
+    :param backend: The array backend used to count, which is also the
+    backend of the result. Defaults to torch.
+    :return: A (V, V) tensor of bigram counts.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+    assert isinstance(vocabulary, list), 'Invalid vocabulary (arg #2)'
+    assert workers is None or workers > 0, 'Invalid workers (arg #3)'
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    backend = get_backend(backend)
+    size = len(vocabulary)
+    shards = get_shards(file_name, workers)
+    if len(shards) == 0:
+        return backend.zeros((size, size), backend.long)
+    if workers == 1 or len(shards) == 1:
+        return functools.reduce(operator.add, [
+            _count_shard(file_name, start, end, vocabulary, backend.name)
+            for start, end in shards
+        ])
+
+    # Worker processes are spawned rather than forked, since forking a process
+    # that has already started torch thread pools is not safe.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(shards),
+                             mp_context=context) as executor:
+        results = executor.map(_count_shard, [file_name] * len(shards),
+                               [start for start, _ in shards],
+                               [end for _, end in shards],
+                               [vocabulary] * len(shards),
+                               [backend.name] * len(shards))
+        return functools.reduce(operator.add, results)
@@ -0,0 +1,294 @@
+import copy
+import datetime
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+import torch
+import torch.distributed as dist
+from typing import Callable
+from .optimizers import Optimizer
+from .trainer import Trainer
+from .utils import global_generator
+
+
+class ShardTrainer(Trainer):
+    """ Trains one shard of a dataset as part of a data-parallel group.
+
+    Every process in a torch.distributed process group holds a contiguous
+    range of the examples, and a copy of the model. All processes shuffle the
+    whole dataset with identically seeded generators, so they agree on every
+    mini-batch, and each one computes the gradient of the examples of the
+    batch that fall within its shard. Gradients are summed across processes
+    before every update, with each shard weighted by its share of the batch,
+    so that every update matches the update of a single process training on
+    the whole dataset, up to floating point rounding.
+    """
+
+    def __init__(self,
+                 model,
+                 learning_rate: float | Callable[[int], float],
+                 offset: int,
+                 count: int,
+                 optimizer: Optimizer = None,
+                 batch_size: int = None,
+                 epochs: int = 1,
+                 patience: int = None,
+                 generator: torch.Generator = None):
+        """ Initializes the trainer. The default process group must be
+        initialized before training.
+
+        :param model: The model to train. It must provide a parameters()
+        method that returns its trainable tensors.
+        :param learning_rate: A fixed learning rate, or a schedule that maps
+        the step number (starting at 0) to a learning rate.
+        :param offset: The position of the first example of the shard within
+        the whole dataset.
+        :param count: The number of examples in the whole dataset.
+        :param optimizer: The optimizer used to update the model.
+        :param batch_size: The number of examples in each mini-batch, across
+        all shards.
+        :param epochs: The maximum number of passes over the dataset.
+        :param patience: The number of epochs without an improvement in
+        validation loss after which training stops.
+        :param generator: A torch generator object used to shuffle the data.
+        It must be in the same state in every process.
+        """
+
+        assert offset >= 0, 'Invalid offset (arg #3)'
+        assert count > 0, 'Invalid count (arg #4)'
+
+        super().__init__(model, learning_rate, optimizer, batch_size, epochs,
+                         patience, generator)
+        self._offset = offset
+        self._count = count
+
+    def __repr__(self) -> str:
+        """ Representation of the trainer. """
+        return (f'ShardTrainer(rank={dist.get_rank()}, '
+                f'offset={self._offset}, count={self._count}, '
+                f'batch_size={self._batch_size}, epochs={self._epochs})')
+
+    def _train_shard_step(self, inputs: torch.Tensor, labels: torch.Tensor,
+                          weight: float) -> torch.Tensor:
+        parameters = self._model.parameters()
+        self._model.reset_grad()
+        if inputs.shape[0] > 0:
+            loss = self._get_loss(inputs, labels)
+            (loss * weight).backward()
+            loss = loss.detach()
+        else:
+            # Shards without examples in the batch still take part in the
+            # reduction, with a zero gradient.
+            loss = torch.zeros(())
+            for parameter in parameters:
+                parameter.grad = torch.zeros_like(parameter)
+
+        for parameter in parameters:
+            dist.all_reduce(parameter.grad, op=dist.ReduceOp.SUM)
+
+        learning_rate = self._schedule(self._step)
+        if self._optimizer is None:
+            self._model.update(learning_rate)
+        else:
+            self._model.update(learning_rate, self._optimizer)
+        self._step += 1
+        return loss
+
+    def _run_epoch(self, inputs: torch.Tensor,
+                   labels: torch.Tensor) -> tuple[float, int]:
+        size = inputs.shape[0]
+        total_loss = torch.zeros((), dtype=torch.double)
+        for batch in self._iter_batches(self._count):
+            if batch is None:
+                loss = self._train_shard_step(inputs, labels,
+                                              size / self._count)
+                total_loss += loss.item() * size
+                continue
+            rows = batch - self._offset
+            rows = rows[(rows >= 0) & (rows < size)]
+            loss = self._train_shard_step(inputs[rows], labels[rows],
+                                          rows.shape[0] / batch.shape[0])
+            total_loss += loss.item() * rows.shape[0]
+        dist.all_reduce(total_loss, op=dist.ReduceOp.SUM)
+        return total_loss.item(), self._count
+
+
+def get_shard_bounds(count: int, shard_count: int) -> list[tuple[int, int]]:
+    """ Splits a range of examples into contiguous shards of nearly equal
+    size.
+
+    :param count: The number of examples.
+    :param shard_count: The number of shards.
+    :return: A list of (start, end) positions, one per shard.
+    """
+
+    assert count >= 0, 'Invalid count (arg #1)'
+    assert shard_count > 0, 'Invalid shard_count (arg #2)'
+
+    bounds = [count * index // shard_count for index in range(shard_count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _train_worker(rank: int, workers: int, store_file: str, timeout: float,
+                  threads: int | None, model, inputs: torch.Tensor,
+                  labels: torch.Tensor, validation: tuple | None, offset: int,
+                  count: int, generator_state: torch.Tensor,
+                  options: dict) -> bytes | None:
+    """ Trains one shard in a worker process. Every worker ends with the same
+    state, which is returned by the first worker only.
+
+    The process group is not destroyed explicitly, as that occasionally blocks
+    with gloo. Each worker process exits after a single task instead, which
+    releases the group.
+    """
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    dist.init_process_group('gloo',
+                            init_method=f'file://{store_file}',
+                            rank=rank,
+                            world_size=workers,
+                            timeout=datetime.timedelta(seconds=timeout))
+    # Tensors sent to worker processes are moved to shared memory, so the
+    # model and optimizer are copied to keep every worker's updates private.
+    model = copy.deepcopy(model)
+    options = copy.deepcopy(options)
+    generator = torch.Generator()
+    generator.set_state(generator_state)
+    trainer = ShardTrainer(model,
+                           offset=offset,
+                           count=count,
+                           generator=generator,
+                           **options)
+    history = trainer.fit(inputs, labels, validation)
+    if rank != 0:
+        return None
+    # The result is pickled by value, since tensors shared with the parent
+    # process do not outlive the worker process.
+    return pickle.dumps((history, [
+        parameter.detach() for parameter in model.parameters()
+    ], options['optimizer'], generator.get_state()))
+
+
+def _terminate_workers(executor: ProcessPoolExecutor):
+    # The executor only stops its worker processes once their tasks end,
+    # which for workers blocked in a collective operation is the timeout of
+    # the process group.
+    for process in list(executor._processes.values()):
+        process.terminate()
+
+
+def fit_parallel(model,
+                 inputs: torch.Tensor,
+                 labels: torch.Tensor,
+                 learning_rate: float | Callable[[int], float],
+                 workers: int,
+                 threads: int = None,
+                 optimizer: Optimizer = None,
+                 batch_size: int = None,
+                 epochs: int = 1,
+                 patience: int = None,
+                 validation: tuple[torch.Tensor, torch.Tensor] = None,
+                 generator: torch.Generator = None,
+                 timeout: float = 60.0) -> list[dict]:
+    """ Trains a model with data parallelism across worker processes.
+
+    The dataset is split into one contiguous shard per worker. Each worker
+    trains a copy of the model on its shard with a ShardTrainer, and the
+    workers sum their gradients with an all-reduce over a gloo process group
+    before every update. The result matches Trainer.fit() on a
+    single process, with the same options and generator state, within
+    floating point tolerance.
+
+    If a worker fails, the other workers are terminated and its exception is
+    raised. Workers that stop responding make the others fail once the
+    timeout expires.
+
+    When training completes, the trained parameters and optimizer state are
+    copied back into the model and optimizer, and the generator is advanced
+    as if the data had been shuffled in this process.
+
+    :param model: The model to train. It must be picklable, and provide a
+    parameters() method that returns its trainable tensors.
+    :param inputs: The input tensor.
+    :param labels: The label tensor.
+    :param learning_rate: A fixed learning rate, or a schedule that maps the
+    step number (starting at 0) to a learning rate. Schedules must be
+    picklable.
+    :param workers: The number of worker processes.
+    :param threads: The number of intra-op threads used by each worker. The
+    torch default is used if omitted.
+    :param optimizer: The optimizer used to update the model.
+    :param batch_size: The number of examples in each mini-batch, across all
+    workers. If omitted, every step uses the full dataset.
+    :param epochs: The maximum number of passes over the dataset.
+    :param patience: The number of epochs without an improvement in validation
+    loss after which training stops.
+    :param validation: An optional tuple of validation inputs and labels,
+    which every worker evaluates after each epoch.
+    :param generator: A torch generator object used to shuffle the data. The
+    global generator is used if omitted.
+    :param timeout: The number of seconds that workers wait for each other
+    when joining the process group, and in every collective operation.
+    :return: The training history, as returned by Trainer.fit(). Throughput
+    is measured across all workers.
+    """
+
+    assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #2)'
+    assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #3)'
+    assert inputs.shape[0] == labels.shape[0], \
+        'Input and label shapes do not match (arg #2, #3)'
+    assert workers > 0, 'Invalid workers (arg #5)'
+    assert threads is None or threads > 0, 'Invalid threads (arg #6)'
+    assert timeout > 0, 'Invalid timeout (arg #13)'
+
+    if generator is None:
+        generator = global_generator
+
+    count = inputs.shape[0]
+    options = {
+        'learning_rate': learning_rate,
+        'optimizer': optimizer,
+        'batch_size': batch_size,
+        'epochs': epochs,
+        'patience': patience,
+    }
+    # Worker processes are spawned rather than forked, since forking a process
+    # that has already started torch thread pools is not safe.
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            max_tasks_per_child=1) as executor:
+        # Workers rendezvous through a shared file rather than a TCP store.
+        store_file = os.path.join(directory, 'store')
+        futures = [
+            executor.submit(_train_worker, rank, workers, store_file,
+                            timeout, threads, model, inputs[start:end],
+                            labels[start:end], validation, start, count,
+                            generator.get_state(), options)
+            for rank, (start, end) in enumerate(
+                get_shard_bounds(count, workers))
+        ]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        errors = [future.exception() for future in done
+                  if future.exception() is not None]
+        if errors:
+            _terminate_workers(executor)
+            raise errors[0]
+        results = [future.result() for future in futures]
+    history, parameters, trained_optimizer, generator_state = pickle.loads(
+        results[0])
+
+    with torch.no_grad():
+        for parameter, value in zip(model.parameters(), parameters):
+            parameter.copy_(value)
+    # Values that the model derives from its parameters, such as the folded
+    # tables of ContextMLP, are stale after the copy.
+    if hasattr(model, 'clear_cache'):
+        model.clear_cache()
+    if optimizer is not None:
+        optimizer.__dict__.update(trained_optimizer.__dict__)
+    generator.set_state(generator_state)
+    return history
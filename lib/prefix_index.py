@@ -0,0 +1,361 @@
+import heapq
+import math
+from typing import TYPE_CHECKING
+from .base_encoder import BaseEncoder
+from .encoded_corpus import EncodedCorpus
+from .word_list import WordList
+from .tensor_file import read_tensors, write_tensors
+from . import profiling
+
+if TYPE_CHECKING:
+    import numpy
+
+# Incremented whenever the layout of saved indices changes. Indices written
+# with a different version are rejected on load.
+_INDEX_VERSION = 1
+_INDEX_FORMAT = 'makemore-prefix-index'
+
+
+class PrefixIndex:
+    """ Autocomplete index over the distinct words of a corpus.
+
+    The index is an array backed trie. Distinct words are stored in a token
+    buffer, sorted by their vocabulary indices, so that the words that share
+    a prefix occupy a contiguous range of the buffer. Trie nodes are numbered
+    breadth first, so that the children of every node are contiguous and
+    sorted by character. Each node holds its character, the range of its
+    words, the number of corpus words in that range, and the largest count of
+    a single word in that range.
+
+    Listing the words with a prefix walks one node per character of the
+    prefix and then decodes a range of the buffer, and the most frequent
+    words with a prefix are found best first, so queries take time
+    proportional to the length of the prefix and the size of the output.
+    Arrays are NumPy arrays, so the index never imports torch, and they are
+    memory mapped when a saved index is loaded.
+    """
+
+    @profiling.profiled()
+    def __init__(self, words: WordList | EncodedCorpus | list):
+        """ Builds the index, with vectorized passes over the encoded words.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings. Words that occur more than once are counted.
+        """
+
+        import numpy
+
+        if isinstance(words, WordList):
+            words = words.get_corpus('numpy')
+        if not isinstance(words, EncodedCorpus):
+            texts = [word if isinstance(word, str) else word.text
+                     for word in words]
+            words = EncodedCorpus.from_lines(
+                texts, EncodedCorpus.build_vocabulary(''.join(texts)),
+                'numpy')
+
+        vocabulary = list(words.vocabulary)
+        stop_index = vocabulary.index('.')
+        tokens = numpy.asarray(words.tokens).astype(numpy.int64)
+        offsets = numpy.asarray(words.offsets).astype(numpy.int64)
+        lengths = offsets[1:] - offsets[:-1] - 1
+        count = lengths.shape[0]
+        max_len = int(lengths.max(initial=0))
+
+        # Words are padded with -1, which sorts before every character, so
+        # that every word sorts before the longer words that start with it.
+        padded = numpy.full((count, max_len), -1, dtype=numpy.int64)
+        rows = numpy.repeat(numpy.arange(count), lengths)
+        columns = numpy.arange(rows.shape[0]) - numpy.repeat(
+            numpy.cumsum(lengths) - lengths, lengths)
+        padded[rows, columns] = tokens[
+            numpy.repeat(offsets[:-1] + 1, lengths) + columns]
+        order = numpy.lexsort(padded.T[::-1]) if max_len > 0 else \
+            numpy.arange(count)
+        padded = padded[order]
+
+        first = numpy.ones(count, dtype=bool)
+        first[1:] = (padded[1:] != padded[:-1]).any(1)
+        firsts = numpy.flatnonzero(first)
+        word_counts = numpy.diff(numpy.append(firsts, count))
+        padded = padded[firsts]
+        lengths = lengths[order[firsts]]
+        distinct = firsts.shape[0]
+
+        word_offsets = numpy.zeros(distinct + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths + 1, out=word_offsets[1:])
+        word_tokens = numpy.full(
+            word_offsets[-1] + 1, stop_index,
+            EncodedCorpus.get_token_dtype(len(vocabulary), 'numpy'))
+        valid = padded >= 0
+        word_tokens[(word_offsets[:-1, None] + 1 +
+                     numpy.arange(max_len))[valid]] = padded[valid]
+
+        # Adjacent words share a prefix of the given length up to their first
+        # differing position. At each depth, the words with at least that
+        # many characters are split into one node per run of words that share
+        # a prefix of that length.
+        common = (padded[1:] != padded[:-1]).argmax(1) if max_len > 0 else \
+            numpy.zeros(0, dtype=numpy.int64)
+        starts = [numpy.zeros(1, dtype=numpy.int64)]
+        ends = [numpy.full(1, distinct, dtype=numpy.int64)]
+        chars = [numpy.full(1, stop_index, dtype=numpy.int64)]
+        parents = [numpy.full(1, -1, dtype=numpy.int64)]
+        depth_offsets = [0, 1]
+        for depth in range(1, max_len + 1):
+            boundaries = numpy.flatnonzero(numpy.append(True, common < depth))
+            run_ends = numpy.append(boundaries[1:], distinct)
+            keep = lengths[boundaries] >= depth
+            parents.append(depth_offsets[-2] + numpy.searchsorted(
+                starts[-1], boundaries[keep], 'right') - 1)
+            starts.append(boundaries[keep])
+            ends.append(run_ends[keep])
+            chars.append(padded[boundaries[keep], depth - 1])
+            depth_offsets.append(depth_offsets[-1] + starts[-1].shape[0])
+
+        starts = numpy.concatenate(starts)
+        ends = numpy.concatenate(ends)
+        parents = numpy.concatenate(parents)
+        node_count = starts.shape[0]
+        children = numpy.searchsorted(parents[1:],
+                                      numpy.arange(node_count + 1)) + 1
+        totals = numpy.append(0, numpy.cumsum(word_counts))
+        depths = numpy.repeat(numpy.arange(max_len + 1),
+                              numpy.diff(depth_offsets))
+        best = numpy.where(lengths[starts] == depths, word_counts[starts], 0) \
+            if distinct > 0 else numpy.zeros(node_count, dtype=numpy.int64)
+        for depth in range(max_len, 0, -1):
+            level = slice(depth_offsets[depth], depth_offsets[depth + 1])
+            numpy.maximum.at(best, parents[level], best[level])
+
+        self._set_arrays(
+            vocabulary, {
+                'tokens': word_tokens,
+                'offsets': word_offsets,
+                'counts': word_counts.astype(numpy.int64),
+                'node_chars': numpy.concatenate(chars).astype(
+                    word_tokens.dtype),
+                'node_starts': starts.astype(numpy.int32),
+                'node_ends': ends.astype(numpy.int32),
+                'node_children': children.astype(numpy.int32),
+                'node_counts': totals[ends] - totals[starts],
+                'node_best': best.astype(numpy.int64),
+            })
+        profiling.count('words_indexed', count)
+
+    def _set_arrays(self, vocabulary: list[str],
+                    arrays: dict[str, 'numpy.ndarray']):
+        self._vocabulary = vocabulary
+        self._encoder = BaseEncoder(vocabulary)
+        self._arrays = arrays
+        self._tokens = arrays['tokens']
+        self._offsets = arrays['offsets']
+        self._counts = arrays['counts']
+        self._node_chars = arrays['node_chars']
+        self._node_starts = arrays['node_starts']
+        self._node_ends = arrays['node_ends']
+        self._node_children = arrays['node_children']
+        self._node_counts = arrays['node_counts']
+        self._node_best = arrays['node_best']
+
+    def __repr__(self) -> str:
+        """ Representation of the index. """
+        return (f'PrefixIndex(words={len(self)}, '
+                f'nodes={self._node_starts.shape[0]})')
+
+    def __len__(self) -> int:
+        """ Number of distinct words in the index. """
+        return self._counts.shape[0]
+
+    @property
+    def vocabulary(self) -> list[str]:
+        """ List of characters used to encode the words. """
+        return self._vocabulary
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the arrays of the index, in bytes. """
+        return sum(array.nbytes for array in self._arrays.values())
+
+    def _find_node(self, prefix: str) -> int:
+        import numpy
+
+        assert isinstance(prefix, str), 'Invalid prefix (arg #1)'
+
+        node = 0
+        for index in self._encoder.encode(prefix, backend='numpy').tolist():
+            first = self._node_children[node]
+            last = self._node_children[node + 1]
+            position = first + numpy.searchsorted(
+                self._node_chars[first:last], index)
+            if position == last or self._node_chars[position] != index:
+                return -1
+            node = int(position)
+        return node
+
+    def _decode(self, start: int, end: int) -> list[str]:
+        if start >= end:
+            return []
+        return self._encoder.decode(
+            self._tokens[self._offsets[start] + 1:self._offsets[end]]).split(
+                '.')
+
+    def count(self, prefix: str = '') -> int:
+        """ Returns the number of corpus words that start with a prefix,
+        including repeated words.
+
+        :param prefix: The prefix. A KeyError is raised if it contains a
+        character that is not in the vocabulary.
+        """
+
+        node = self._find_node(prefix)
+        return 0 if node < 0 else int(self._node_counts[node])
+
+    @profiling.profiled()
+    def get_words(self, prefix: str = '', limit: int = None) -> list[str]:
+        """ Returns the distinct words that start with a prefix, in the order
+        of their vocabulary indices.
+
+        :param prefix: The prefix. A KeyError is raised if it contains a
+        character that is not in the vocabulary.
+        :param limit: The maximum number of words to return. All words are
+        returned if omitted.
+        :return: A list of words.
+        """
+
+        assert limit is None or limit >= 0, 'Invalid limit (arg #2)'
+
+        node = self._find_node(prefix)
+        if node < 0:
+            return []
+        start = int(self._node_starts[node])
+        end = int(self._node_ends[node])
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._decode(start, end)
+
+    @profiling.profiled()
+    def top_words(self, prefix: str = '',
+                  count: int = 10) -> list[tuple[str, int]]:
+        """ Returns the most frequent corpus words that start with a prefix.
+
+        Nodes are expanded best first, ordered by the largest word count
+        below them, so only the nodes on the paths to the returned words and
+        their siblings are visited.
+
+        :param prefix: The prefix. A KeyError is raised if it contains a
+        character that is not in the vocabulary.
+        :param count: The maximum number of words to return.
+        :return: A list of (word, count) tuples, from most to least frequent,
+        with ties in the order of vocabulary indices.
+        """
+
+        assert count > 0, 'Invalid count (arg #2)'
+
+        node = self._find_node(prefix)
+        if node < 0 or self._node_starts[node] == self._node_ends[node]:
+            return []
+
+        # Entries are ordered by count, then by the position of the first
+        # word that they cover, so every node precedes the words below it.
+        queue = [(-int(self._node_best[node]),
+                  int(self._node_starts[node]), False, node, len(prefix))]
+        results = []
+        while len(queue) > 0 and len(results) < count:
+            negative_count, start, is_word, node, depth = heapq.heappop(queue)
+            if is_word:
+                results.append((self._decode(start, start + 1)[0],
+                                -negative_count))
+                continue
+            if self._offsets[start + 1] - self._offsets[start] - 1 == depth:
+                heapq.heappush(queue, (-int(self._counts[start]), start,
+                                       True, node, depth))
+            first = int(self._node_children[node])
+            last = int(self._node_children[node + 1])
+            for child, best, child_start in zip(
+                    range(first, last),
+                    self._node_best[first:last].tolist(),
+                    self._node_starts[first:last].tolist()):
+                heapq.heappush(queue,
+                               (-best, child_start, False, child, depth + 1))
+        return results
+
+    @profiling.profiled()
+    def complete(self,
+                 prefix: str,
+                 count: int = 10,
+                 model=None,
+                 encoder=None) -> list[tuple[str, int, float | None]]:
+        """ Completes a prefix with corpus words, followed by words ranked by
+        a model when the corpus has fewer than count matches.
+
+        :param prefix: The prefix. A KeyError is raised if it contains a
+        character that is not in the vocabulary.
+        :param count: The maximum number of words to return.
+        :param model: An optional model that provides top_words() and
+        score_words(), such as SimpleBigram.
+        :param encoder: The encoder used by the model.
+        :return: A list of (word, count, log_prob) tuples. Corpus words come
+        first, from most to least frequent, followed by words that are not in
+        the corpus, from most to least likely. count is the number of times
+        that the word occurs in the corpus, and log_prob is the log
+        probability of the whole word under the model, or None without a
+        model. Words that are not in the corpus are only included if the
+        model can produce them.
+        """
+
+        assert model is None or encoder is not None, \
+            'Invalid encoder (arg #4)'
+
+        hits = self.top_words(prefix, count)
+        if model is None:
+            return [(word, word_count, None) for word, word_count in hits]
+
+        words = [word for word, _ in hits]
+        log_probs = (-model.score_words(words, encoder)).tolist() \
+            if len(words) > 0 else []
+        results = [(word, word_count, log_prob)
+                   for (word, word_count), log_prob in zip(hits, log_probs)]
+        # When the corpus has fewer than count matches, the hits hold all of
+        # them, so every other completion of the model is a new word.
+        known = set(words)
+        for word, log_prob in model.top_words(encoder, count, prefix=prefix):
+            if len(results) == count:
+                break
+            if word not in known and math.isfinite(log_prob):
+                results.append((word, 0, log_prob))
+        return results
+
+    def save(self, file_name: str):
+        """ Saves the index to a file, from which it can be memory mapped.
+
+        :param file_name: The name of the file.
+        """
+
+        write_tensors(
+            file_name, {
+                'format': _INDEX_FORMAT,
+                'version': _INDEX_VERSION,
+                'vocabulary': self._vocabulary,
+            }, self._arrays)
+
+    @classmethod
+    def load(cls, file_name: str) -> 'PrefixIndex':
+        """ Loads an index saved with save(). The arrays are memory mapped
+        from the file, so processes that load the same index share a single
+        copy of it in the page cache.
+
+        :param file_name: The name of the file.
+        :return: The index.
+        """
+
+        metadata, arrays = read_tensors(file_name, 'numpy')
+        if metadata.get('format') != _INDEX_FORMAT:
+            raise ValueError(f'Invalid prefix index file: {file_name}')
+        if metadata.get('version') != _INDEX_VERSION:
+            raise ValueError(
+                f'Unsupported prefix index version: {metadata.get("version")}')
+
+        index = cls.__new__(cls)
+        index._set_arrays(metadata['vocabulary'], arrays)
+        return index
@@ -0,0 +1,228 @@
+""" Opt-in instrumentation for timing spans and counters.
+
+Library code marks interesting regions with span() or the profiled()
+decorator, and counts events with count(). All of these are no-ops until
+profiling is enabled with enable(). Spans and counters cost a single global
+flag check when disabled, and functions decorated with profiled() while
+profiling is disabled are left unchanged, so that they cost nothing. Profiling
+must therefore be enabled before the instrumented modules are imported, which
+the lazy imports of the lib package allow:
+
+    from lib import profiling
+
+    profiling.enable()
+    with profiling.span('prepare_data'):
+        ...
+    profiling.count('words', 1000)
+    print(profiling.get_summary())
+    profiling.write_trace('trace.json')
+
+Spans can be nested, and are recorded with their start time and duration so
+that they can be exported in the Chrome trace event format, which can be
+viewed in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+_enabled = False
+_lock = threading.Lock()
+_events = []
+_counters = {}
+_origin = time.perf_counter_ns()
+
+
+def enable():
+    """ Enables profiling, discarding any previously recorded data. """
+
+    global _enabled, _origin
+    reset()
+    _origin = time.perf_counter_ns()
+    _enabled = True
+
+
+def disable():
+    """ Disables profiling. Recorded data is kept until reset() or enable()
+    is called. """
+
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    """ Returns True if profiling is enabled. """
+
+    return _enabled
+
+
+def reset():
+    """ Discards all recorded spans and counters. """
+
+    with _lock:
+        _events.clear()
+        _counters.clear()
+
+
+class _NullSpan:
+    """ Span used when profiling is disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@contextmanager
+def _record_span(name: str, args: dict) -> Iterator[None]:
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        with _lock:
+            _events.append((name, start - _origin, end - start,
+                            threading.get_ident(), args))
+
+
+def span(name: str, **args):
+    """ Returns a context manager that records the time spent in a block of
+    code under the given name.
+
+    :param name: The name of the span. Spans with the same name are
+    aggregated in the summary.
+    :param args: Optional values attached to the span in the trace.
+    """
+
+    if not _enabled:
+        return _NULL_SPAN
+    return _record_span(name, args)
+
+
+def profiled(name: str = None):
+    """ Decorator that records every call to a function as a span.
+
+    Functions decorated while profiling is disabled are returned unchanged.
+    Calls to functions decorated while profiling is enabled are recorded
+    until it is disabled.
+
+    :param name: The name of the span. Defaults to the qualified name of the
+    function.
+    """
+
+    def decorate(func):
+        if not _enabled:
+            return func
+        label = name if name is not None else func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _record_span(label, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count(name: str, value: int | float = 1):
+    """ Adds a value to a named counter.
+
+    :param name: The name of the counter.
+    :param value: The value to add.
+    """
+
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get_stats() -> tuple[dict[str, dict], dict[str, int | float]]:
+    """ Returns aggregated statistics for the recorded spans and counters.
+
+    :return: A tuple containing a dictionary of span statistics (calls, total,
+    mean and max time in seconds), keyed by span name, and a dictionary of
+    counter values.
+    """
+
+    spans = {}
+    with _lock:
+        for name, _, duration, _, _ in _events:
+            stats = spans.setdefault(name, {
+                'calls': 0,
+                'total': 0.0,
+                'max': 0.0
+            })
+            stats['calls'] += 1
+            stats['total'] += duration / 1e9
+            stats['max'] = max(stats['max'], duration / 1e9)
+        counters = dict(_counters)
+    for stats in spans.values():
+        stats['mean'] = stats['total'] / stats['calls']
+    return spans, counters
+
+
+def get_summary() -> str:
+    """ Returns a table of span and counter statistics, with spans sorted by
+    total time. """
+
+    spans, counters = get_stats()
+    lines = [f'{"span":<28} {"calls":>8} {"total (ms)":>12} '
+             f'{"mean (ms)":>11} {"max (ms)":>11}']
+    for name, stats in sorted(spans.items(),
+                              key=lambda item: -item[1]['total']):
+        lines.append(f'{name:<28} {stats["calls"]:>8} '
+                     f'{stats["total"] * 1000:>12.3f} '
+                     f'{stats["mean"] * 1000:>11.3f} '
+                     f'{stats["max"] * 1000:>11.3f}')
+    if len(counters) > 0:
+        lines.append(f'{"counter":<28} {"value":>8}')
+        for name, value in sorted(counters.items()):
+            lines.append(f'{name:<28} {value:>8}')
+    return '\n'.join(lines)
+
+
+def write_trace(file_name: str):
+    """ Writes the recorded spans and counters as a Chrome trace event JSON
+    file.
+
+    :param file_name: The name of the file to write.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+
+    pid = os.getpid()
+    with _lock:
+        events = [{
+            'name': name,
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': duration / 1000,
+            'pid': pid,
+            'tid': tid,
+            'args': args,
+        } for name, start, duration, tid, args in _events]
+        end = max([start + duration for _, start, duration, _, _ in _events],
+                  default=0)
+        events.extend([{
+            'name': name,
+            'ph': 'C',
+            'ts': end / 1000,
+            'pid': pid,
+            'args': {
+                name: value
+            },
+        } for name, value in _counters.items()])
+    with open(file_name, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
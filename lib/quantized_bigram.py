@@ -0,0 +1,364 @@
+import torch
+from .bigram_encoder import BigramEncoder
+from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+from .sequence_batch import batch_sequences, score_sequences
+from .utils import global_generator, generate_sequences, search_sequences
+from .utils import decode_sequences
+from .checkpoint import read_checkpoint, write_checkpoint
+from . import profiling
+
+PRECISIONS = ['float32', 'float16', 'bfloat16', 'int8']
+
+# Quantized int8 values range from -127 to 127, and -128 marks entries that
+# are -inf, such as the log probabilities of bigrams that were never observed.
+_INT8_LEVELS = 254
+_INT8_NEGATIVE_INFINITY = -128
+
+
+def quantize_rows(
+    table: torch.Tensor, precision: str
+) -> tuple[torch.Tensor, torch.Tensor | None, torch.Tensor | None]:
+    """ Converts a float matrix to a lower precision.
+
+    Floating point precisions are plain casts. With int8 precision, every row
+    is quantized separately, by mapping the range between its smallest and
+    largest finite values onto 255 levels, and -inf entries are preserved.
+
+    :param table: A two dimensional float tensor.
+    :param precision: One of PRECISIONS.
+    :return: A tuple containing the values, and for int8 precision the scale
+    and the minimum of every row, which are None otherwise.
+    """
+
+    assert isinstance(table, torch.Tensor) and table.dim() == 2, \
+        'Invalid table (arg #1)'
+    assert precision in PRECISIONS, 'Invalid precision (arg #2)'
+
+    if precision != 'int8':
+        return table.to(getattr(torch, precision), copy=True), None, None
+
+    table = table.float()
+    finite = torch.isfinite(table)
+    minimums = torch.where(finite, table, torch.inf).amin(1, keepdim=True)
+    maximums = torch.where(finite, table, -torch.inf).amax(1, keepdim=True)
+    # Rows without finite values, or with a single distinct value, are given
+    # a unit scale so that they round trip without dividing by zero.
+    minimums = torch.where(torch.isfinite(minimums), minimums, 0)
+    scales = (maximums - minimums) / _INT8_LEVELS
+    scales = torch.where(scales > 0, scales, 1)
+    levels = torch.round((table - minimums) / scales).clamp(0, _INT8_LEVELS)
+    values = torch.where(finite, levels - _INT8_LEVELS // 2,
+                         _INT8_NEGATIVE_INFINITY).to(torch.int8)
+    return values, scales[:, 0], minimums[:, 0]
+
+
+def dequantize_rows(values: torch.Tensor, scales: torch.Tensor | None,
+                    minimums: torch.Tensor | None) -> torch.Tensor:
+    """ Converts a matrix produced by quantize_rows() back to float32.
+
+    :param values: The quantized values.
+    :param scales: The scale of every row, for int8 values.
+    :param minimums: The minimum of every row, for int8 values.
+    :return: A float32 tensor with the shape of the values.
+    """
+
+    if scales is None:
+        return values.float()
+    table = (values.float() + _INT8_LEVELS // 2) * scales[:, None] + \
+        minimums[:, None]
+    return torch.where(values == _INT8_NEGATIVE_INFINITY, -torch.inf, table)
+
+
+class QuantizedBigram:
+    """ Inference-only bigram model with reduced precision tables.
+
+    The model is exported from a trained bigram model, such as SimpleBigram
+    or NeuronBigram, by quantizing its matrix of transition probabilities.
+    Scoring can optionally use a separately quantized matrix of precomputed
+    log probabilities, which preserves the small probabilities that are
+    rounded to zero in the probability matrix at low precision.
+
+    With int8 precision, which would round most small probabilities to zero,
+    the model only holds a table of log probabilities, quantized in the log
+    domain, from which probabilities are computed for generation.
+
+    Only the quantized tables are held by the model. Float32 matrices are
+    rebuilt for the duration of each generation or scoring call.
+    """
+
+    def __init__(self,
+                 transitions: torch.Tensor,
+                 precision: str = 'float16',
+                 log_probs: bool = True,
+                 log_transitions: torch.Tensor = None):
+        """ Initializes the model by quantizing a matrix of transition
+        probabilities.
+
+        :param transitions: A square matrix in which row i holds the
+        probability distribution of the index that follows index i. Arrays of
+        any backend are accepted.
+        :param precision: The precision of the tables, one of PRECISIONS.
+        :param log_probs: If True, a table of log probabilities is kept for
+        scoring. Otherwise, scores are computed from the probabilities. int8
+        models always keep a single table of log probabilities.
+        :param log_transitions: The log of the transitions, such as the
+        log-softmax of the logits of a NeuronBigram. Computed from the
+        transitions if omitted.
+        """
+
+        transitions = torch.as_tensor(transitions).float()
+        assert transitions.dim() == 2 and \
+            transitions.shape[0] == transitions.shape[1], \
+            'Invalid transitions (arg #1)'
+        assert precision in PRECISIONS, 'Invalid precision (arg #2)'
+        assert isinstance(log_probs, bool), 'Invalid log_probs (arg #3)'
+        if log_transitions is None:
+            log_transitions = transitions.log()
+        log_transitions = torch.as_tensor(log_transitions).float()
+        assert log_transitions.shape == transitions.shape, \
+            'Invalid log_transitions (arg #4)'
+
+        self._precision = precision
+        self._probs = None
+        self._log_probs = None
+        if precision == 'int8':
+            self._log_probs = quantize_rows(log_transitions, precision)
+            return
+        self._probs = quantize_rows(transitions, precision)
+        if log_probs:
+            self._log_probs = quantize_rows(log_transitions, precision)
+
+    @classmethod
+    @profiling.profiled()
+    def export(cls,
+               model,
+               precision: str = 'float16',
+               log_probs: bool = True) -> 'QuantizedBigram':
+        """ Creates an inference-only copy of a trained bigram model.
+
+        :param model: A model that provides get_transitions(), such as
+        SimpleBigram, NeuronBigram or QuantizedBigram. Its
+        get_log_transitions() is used for the log probabilities, if it has
+        one.
+        :param precision: The precision of the tables, one of PRECISIONS.
+        :param log_probs: If True, a table of log probabilities is kept for
+        scoring.
+        :return: The exported model.
+        """
+
+        log_transitions = None
+        if hasattr(model, 'get_log_transitions'):
+            log_transitions = model.get_log_transitions()
+        return cls(model.get_transitions(), precision, log_probs,
+                   log_transitions)
+
+    def __repr__(self) -> str:
+        """ Representation of the model. """
+        table = self._probs if self._probs is not None else self._log_probs
+        return (f'QuantizedBigram({self._precision}, '
+                f'{tuple(table[0].shape)}, '
+                f'log_probs={self._log_probs is not None})')
+
+    @property
+    def precision(self) -> str:
+        """ Precision of the tables. """
+        return self._precision
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the tables of the model, in bytes. """
+        return sum(tensor.element_size() * tensor.nelement()
+                   for tensor in self._get_tensors().values())
+
+    def get_transitions(self) -> torch.Tensor:
+        """ Returns the float32 matrix of transition probabilities, in which
+        row i holds the probability distribution of the character that follows
+        the character with index i.
+        """
+
+        if self._probs is None:
+            return self.get_log_transitions().exp()
+        return dequantize_rows(*self._probs)
+
+    def get_log_transitions(self) -> torch.Tensor:
+        """ Returns the float32 matrix of log transition probabilities, from
+        the precomputed table if the model has one.
+        """
+
+        if self._log_probs is None:
+            return self.get_transitions().log()
+        table = dequantize_rows(*self._log_probs)
+        if self._probs is None:
+            # Rounding shifts the log probabilities of every row, so the rows
+            # are normalized again. Rows without finite values are kept.
+            norms = torch.logsumexp(table, 1, keepdim=True)
+            table = table - torch.where(torch.isfinite(norms), norms, 0)
+        return table
+
+    @profiling.profiled()
+    def generate_word(self,
+                      encoder: BigramEncoder,
+                      generator: torch.Generator = None) -> str:
+        """ Generates a word using the model.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: The generated word as a string.
+        """
+
+        assert isinstance(encoder, BigramEncoder), 'Invalid encoder (arg #1)'
+
+        if generator is None:
+            generator = global_generator
+
+        transitions = self.get_transitions()
+        stop_index = encoder.get_index('.')
+        indices = []
+        index = stop_index
+        while True:
+            index = torch.multinomial(transitions[index],
+                                      1,
+                                      replacement=True,
+                                      generator=generator).item()
+            if index == stop_index:
+                break
+            indices.append(index)
+        return encoder.decode(torch.tensor(indices, dtype=torch.long))
+
+    @profiling.profiled()
+    def generate_words(self,
+                       encoder: BigramEncoder,
+                       count: int,
+                       max_len: int = 32,
+                       generator: torch.Generator = None) -> list[str]:
+        """ Generates a batch of words using the model. All words are advanced
+        together, with a single sampling call per character position.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param count: The number of words to generate.
+        :param max_len: The maximum number of characters sampled for each word,
+        including the termination character. Longer words are truncated.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: A list of generated words.
+        """
+
+        assert isinstance(encoder, BigramEncoder), 'Invalid encoder (arg #1)'
+
+        sequences = generate_sequences(self.get_transitions(),
+                                       encoder.get_index('.'), count, max_len,
+                                       generator)
+        return decode_sequences(sequences, encoder)
+
+    @profiling.profiled()
+    def score_words(self,
+                    words: WordList | EncodedCorpus | list,
+                    encoder: BigramEncoder,
+                    batch_size: int = None) -> torch.Tensor:
+        """ Computes the negative log-likelihood of whole words, including
+        their termination characters, with one vectorized pass per batch.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param encoder: The encoder used to convert characters to indices.
+        :param batch_size: The maximum number of words scored at a time. Words
+        are bucketed by length to minimize padding. If omitted, all words are
+        scored together.
+        :return: A tensor with the negative log-likelihood of each word, in the
+        order of the input words.
+        """
+
+        assert isinstance(encoder, BigramEncoder), 'Invalid encoder (arg #2)'
+
+        batches = batch_sequences(words, encoder.vocabulary, batch_size)
+        return score_sequences(self.get_log_transitions(), batches,
+                               len(words))
+
+    @profiling.profiled()
+    def top_words(self,
+                  encoder: BigramEncoder,
+                  count: int,
+                  prefix: str = '',
+                  min_len: int = 1,
+                  max_len: int = 32) -> list[tuple[str, float]]:
+        """ Finds the most likely words under the model, or the most likely
+        completions of a prefix, with a batched search over the transition
+        matrix rather than by sampling.
+
+        :param encoder: The encoder used to convert between characters and
+        indices.
+        :param count: The maximum number of words to return.
+        :param prefix: An optional prefix that every word starts with.
+        :param min_len: The minimum number of characters of each word,
+        including the prefix.
+        :param max_len: The maximum number of characters of each word,
+        including the prefix.
+        :return: A list of (word, log_prob) tuples, from most to least likely,
+        where log_prob is the log probability of the whole word, including its
+        prefix and termination character.
+        """
+
+        assert isinstance(encoder, BigramEncoder), 'Invalid encoder (arg #1)'
+        assert isinstance(prefix, str), 'Invalid prefix (arg #3)'
+
+        sequences, log_probs = search_sequences(self.get_log_transitions(),
+                                                encoder.get_index('.'), count,
+                                                encoder.encode(prefix),
+                                                min_len, max_len)
+        return list(zip(decode_sequences(sequences, encoder),
+                        log_probs.tolist()))
+
+    def _get_tensors(self) -> dict[str, torch.Tensor]:
+        tables = {}
+        if self._probs is not None:
+            tables['probs'] = self._probs
+        if self._log_probs is not None:
+            tables['log_probs'] = self._log_probs
+        tensors = {}
+        for name, (values, scales, minimums) in tables.items():
+            tensors[name] = values
+            if scales is not None:
+                tensors[f'{name}_scales'] = scales
+                tensors[f'{name}_minimums'] = minimums
+        return tensors
+
+    def save(self, file_name: str, encoder: BigramEncoder):
+        """ Saves the tables of the model and the vocabulary of its encoder to
+        a checkpoint file.
+
+        :param file_name: The name of the checkpoint file.
+        :param encoder: The encoder used by the model.
+        """
+
+        assert isinstance(encoder, BigramEncoder), 'Invalid encoder (arg #2)'
+        write_checkpoint(file_name, 'QuantizedBigram', encoder,
+                         {'precision': self._precision}, self._get_tensors())
+
+    @classmethod
+    def load(cls,
+             file_name: str) -> tuple['QuantizedBigram', BigramEncoder]:
+        """ Loads a model saved with save(). The tables are memory mapped from
+        the checkpoint.
+
+        :param file_name: The name of the checkpoint file.
+        :return: A tuple containing the model and its encoder.
+        """
+
+        metadata, encoder, tensors = read_checkpoint(file_name,
+                                                     'QuantizedBigram')
+
+        def read_table(name):
+            if name not in tensors:
+                return None
+            return (tensors[name], tensors.get(f'{name}_scales'),
+                    tensors.get(f'{name}_minimums'))
+
+        model = cls.__new__(cls)
+        model._precision = metadata['options']['precision']
+        model._probs = read_table('probs')
+        model._log_probs = read_table('log_probs')
+        return model, encoder
@@ -0,0 +1,198 @@
+from typing import Iterator, TYPE_CHECKING
+from .backends import Backend, get_array_backend
+from .word import Word
+from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+
+if TYPE_CHECKING:
+    import torch
+
+
+class SequenceBatch:
+    """ A batch of whole words, packed into a padded index tensor.
+
+    Every row holds one word, including its leading and trailing termination
+    characters, and is padded to the length of the longest word in the batch
+    by repeating the trailing termination character. Adjacent columns form the
+    bigrams of each word, and a mask marks the bigrams that belong to the word
+    rather than to its padding.
+
+    The tensors of a batch belong to the array backend of the corpus that the
+    batch was created from.
+    """
+
+    def __init__(self, indices: 'torch.Tensor', lengths: 'torch.Tensor',
+                 positions: 'torch.Tensor'):
+        """ Initializes the batch.
+
+        :param indices: A (B, L) tensor of vocabulary indices.
+        :param lengths: A (B, ) tensor with the number of tokens in each row,
+        including both termination characters.
+        :param positions: A (B, ) tensor with the position of each word in the
+        collection that the batch was created from.
+        """
+
+        backend = get_array_backend(indices)
+        assert len(indices.shape) == 2, 'Invalid indices (arg #1)'
+        assert backend.is_array(lengths) and \
+            lengths.shape == indices.shape[:1], 'Invalid lengths (arg #2)'
+        assert backend.is_array(positions) and \
+            positions.shape == indices.shape[:1], 'Invalid positions (arg #3)'
+
+        self._backend = backend
+        self._indices = indices
+        self._lengths = lengths
+        self._positions = positions
+
+    def __repr__(self) -> str:
+        """ Representation of the batch. """
+        return f'SequenceBatch({tuple(self._indices.shape)})'
+
+    def __len__(self) -> int:
+        """ Number of words in the batch. """
+        return self._indices.shape[0]
+
+    @property
+    def indices(self) -> 'torch.Tensor':
+        """ The (B, L) padded tensor of vocabulary indices. """
+        return self._indices
+
+    @property
+    def lengths(self) -> 'torch.Tensor':
+        """ The number of tokens in each row, including both termination
+        characters. """
+        return self._lengths
+
+    @property
+    def positions(self) -> 'torch.Tensor':
+        """ The position of each word in the source collection. """
+        return self._positions
+
+    @property
+    def inputs(self) -> 'torch.Tensor':
+        """ The (B, L - 1) tensor of the first character of every bigram. """
+        return self._indices[:, :-1]
+
+    @property
+    def labels(self) -> 'torch.Tensor':
+        """ The (B, L - 1) tensor of the second character of every bigram. """
+        return self._indices[:, 1:]
+
+    @property
+    def mask(self) -> 'torch.Tensor':
+        """ A (B, L - 1) boolean tensor that is True for the bigrams of each
+        word, and False for padding. """
+        steps = self._backend.arange(self._indices.shape[1] - 1)
+        return steps[None, :] < (self._lengths - 1)[:, None]
+
+    @property
+    def padding(self) -> float:
+        """ The fraction of the batch that is padding. """
+        total = self._indices.shape[0] * self._indices.shape[1]
+        return 1 - self._lengths.sum().item() / total if total > 0 else 0.0
+
+
+def _iter_corpus_batches(corpus: EncodedCorpus, batch_size: int | None,
+                         bucket: bool, base: int) -> Iterator[SequenceBatch]:
+    backend = corpus.backend
+    starts = corpus.offsets[:-1]
+    lengths = corpus.offsets[1:] - starts + 1
+    count = lengths.shape[0]
+    if count == 0:
+        return
+
+    order = backend.argsort(lengths) if bucket else backend.arange(count)
+    if batch_size is None:
+        batch_size = count
+
+    tokens = backend.to(corpus.tokens, backend.long)
+    for first in range(0, count, batch_size):
+        rows = order[first:first + batch_size]
+        row_lengths = lengths[rows]
+        steps = backend.arange(row_lengths.max().item())
+        # Positions past the end of a word repeat its trailing termination
+        # character.
+        steps = backend.minimum(steps[None, :], (row_lengths - 1)[:, None])
+        indices = tokens[starts[rows][:, None] + steps]
+        yield SequenceBatch(indices, row_lengths, rows + base)
+
+
+def batch_sequences(words: WordList | EncodedCorpus | list,
+                    vocabulary: list[str],
+                    batch_size: int = None,
+                    bucket: bool = True,
+                    backend: str | Backend = None) -> Iterator[SequenceBatch]:
+    """ Packs words into padded batches of whole word sequences.
+
+    Words are bucketed by length before batching, so that words in the same
+    batch have similar lengths and need little padding. Streaming word lists
+    are batched one chunk at a time.
+
+    :param words: A WordList, an EncodedCorpus, or a list of Word objects or
+    strings.
+    :param vocabulary: The list of characters used to encode the words.
+    :param batch_size: The maximum number of words in each batch. If omitted,
+    each corpus (or chunk of a streaming word list) forms a single batch.
+    :param bucket: If True, words are sorted by length before batching.
+    Otherwise, batches follow the order of the words.
+    :param backend: The array backend used to encode word lists and lists of
+    words. Defaults to torch. Encoded corpora keep their own backend.
+    :return: An iterator of SequenceBatch objects. The positions of each batch
+    refer to the order of the input words.
+    """
+
+    assert isinstance(vocabulary, list), 'Invalid vocabulary (arg #2)'
+    assert batch_size is None or batch_size > 0, \
+        'Invalid batch_size (arg #3)'
+
+    if isinstance(words, WordList):
+        assert words.vocabulary == vocabulary, \
+            'Word list vocabulary does not match (arg #1)'
+        corpora = words.iter_corpus(backend=backend)
+    elif isinstance(words, EncodedCorpus):
+        assert words.vocabulary == vocabulary, \
+            'Corpus vocabulary does not match (arg #1)'
+        corpora = [words]
+    else:
+        assert isinstance(words, list), 'Invalid words (arg #1)'
+        corpora = [
+            EncodedCorpus.from_lines([
+                word.text if isinstance(word, Word) else word
+                for word in words
+            ], vocabulary, backend)
+        ]
+
+    base = 0
+    for corpus in corpora:
+        yield from _iter_corpus_batches(corpus, batch_size, bucket, base)
+        base += len(corpus)
+
+
+def score_sequences(log_transitions: 'torch.Tensor',
+                    batches: Iterator[SequenceBatch],
+                    count: int) -> 'torch.Tensor':
+    """ Computes the negative log-likelihood of whole words under a bigram
+    model, one batch at a time.
+
+    :param log_transitions: A (V, V) matrix of log transition probabilities.
+    :param batches: The batches of words to score.
+    :param count: The total number of words in the batches.
+    :return: A (count, ) tensor with the negative log-likelihood of each word,
+    in the order of the words that the batches were created from.
+    """
+
+    backend = get_array_backend(log_transitions)
+    scores = backend.zeros(count, log_transitions.dtype)
+    for batch in batches:
+        log_probs = log_transitions[batch.inputs, batch.labels]
+        # Padding bigrams may have zero probability, so they are excluded
+        # before summing rather than multiplied by the mask.
+        log_probs = backend.where(batch.mask, log_probs, 0)
+        # Columns are accumulated one at a time, rather than with a reduction
+        # whose order depends on the backend, so that every backend produces
+        # identical scores.
+        totals = backend.zeros(len(batch), log_probs.dtype)
+        for column in range(log_probs.shape[1]):
+            totals += log_probs[:, column]
+        scores[batch.positions] = -totals
+    return scores
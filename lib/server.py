@@ -0,0 +1,378 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+_logger = logging.getLogger(__name__)
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    500: 'Internal Server Error',
+}
+
+
+def _to_json_number(value: float) -> float | None:
+    # Infinite log probabilities, of words that a model cannot produce, are
+    # not valid JSON, so they are reported as null.
+    return value if math.isfinite(value) else None
+
+
+class RequestBatcher:
+    """ Coalesces concurrent requests into batched calls.
+
+    Each request submits a list of items. A single worker task waits for the
+    first pending request, then keeps collecting requests until either
+    max_batch_size items are pending or max_wait seconds have passed since the
+    first one arrived. All collected items are processed with one call to the
+    batch function, which runs in a thread so that the event loop keeps
+    accepting requests, and its results are split back between the requests.
+
+    Larger batch sizes and longer waits improve throughput under load, at the
+    cost of latency for requests that arrive when the server is idle.
+    """
+
+    def __init__(self,
+                 process: Callable[[list], list],
+                 max_batch_size: int = 64,
+                 max_wait: float = 0.005):
+        """ Initializes the batcher.
+
+        :param process: A function that maps a list of items to a list of
+        results of the same length.
+        :param max_batch_size: The number of pending items that triggers a
+        batch immediately. A single request larger than this is processed in
+        one batch on its own.
+        :param max_wait: The maximum time, in seconds, that a request waits
+        for other requests to join its batch.
+        """
+
+        assert callable(process), 'Invalid process (arg #1)'
+        assert max_batch_size > 0, 'Invalid max_batch_size (arg #2)'
+        assert max_wait >= 0, 'Invalid max_wait (arg #3)'
+
+        self._process = process
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._queue = None
+        self._worker = None
+        self._batch_count = 0
+        self._item_count = 0
+
+    def __repr__(self) -> str:
+        """ Representation of the batcher. """
+        return (f'RequestBatcher(max_batch_size={self._max_batch_size}, '
+                f'max_wait={self._max_wait})')
+
+    @property
+    def batch_count(self) -> int:
+        """ Number of batches processed so far. """
+        return self._batch_count
+
+    @property
+    def item_count(self) -> int:
+        """ Number of items processed so far. """
+        return self._item_count
+
+    def start(self):
+        """ Starts the worker task. Must be called from a running event loop.
+        """
+
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """ Stops the worker task. """
+
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, items: list) -> list:
+        """ Submits a request, and waits for its results.
+
+        :param items: The items of the request.
+        :return: The results for the items, in order.
+        """
+
+        assert self._queue is not None, 'Batcher has not been started'
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((items, future))
+        return await future
+
+    async def _collect(self) -> list[tuple[list, asyncio.Future]]:
+        requests = [await self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self._max_wait
+        while size < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = await self._collect()
+            items = [item for request_items, _ in requests
+                     for item in request_items]
+            try:
+                results = await loop.run_in_executor(None, self._process,
+                                                     items)
+            except Exception as error:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self._batch_count += 1
+            self._item_count += len(items)
+            start = 0
+            for request_items, future in requests:
+                end = start + len(request_items)
+                if not future.done():
+                    future.set_result(results[start:end])
+                start = end
+
+
+class NameServer:
+    """ Minimal HTTP server that generates and scores names with a trained
+    model, loaded once when the server starts.
+
+    Supported requests:
+
+        GET /generate?count=N   -> {"words": [...]}
+        POST /score             <- {"words": [...]}
+                                -> {"scores": [...]} (null if impossible)
+        GET /complete?prefix=P&count=N
+                                -> {"words": [...], "log_probs": [...]}
+                                   ("counts": [...] with a prefix index)
+        GET /stats              -> {"batches": N, "items": N}
+
+    Concurrent requests of the same kind are coalesced into batched model
+    calls by a RequestBatcher. Completions are searched per request, for
+    models that provide top_words(), and start with the most frequent corpus
+    words when the server has a PrefixIndex. Connections are kept alive
+    between requests unless the client asks to close them.
+    """
+
+    def __init__(self,
+                 model,
+                 encoder,
+                 max_batch_size: int = 64,
+                 max_wait: float = 0.005,
+                 max_count: int = 1000,
+                 index=None):
+        """ Initializes the server.
+
+        :param model: A model that provides generate_words() and
+        score_words(), such as SimpleBigram or NeuronBigram.
+        :param encoder: The encoder used by the model.
+        :param max_batch_size: The number of pending words that triggers a
+        generate or score batch immediately. Concurrent requests are combined
+        into batches of up to this size, but a single larger request, of up
+        to max_count words, is processed in one batch on its own.
+        :param max_wait: The maximum time, in seconds, that a request waits
+        for other requests to join its batch.
+        :param max_count: The maximum number of words per generate or complete
+        request.
+        :param index: An optional PrefixIndex of the corpus, with the
+        vocabulary of the encoder, that completions are looked up in before
+        the model.
+        """
+
+        assert max_count > 0, 'Invalid max_count (arg #5)'
+        assert index is None or index.vocabulary == list(
+            encoder.vocabulary), 'Invalid index (arg #6)'
+
+        self._model = model
+        self._encoder = encoder
+        self._max_count = max_count
+        self._index = index
+        self._generate = RequestBatcher(self._generate_batch, max_batch_size,
+                                        max_wait)
+        self._score = RequestBatcher(self._score_batch, max_batch_size,
+                                     max_wait)
+
+    def __repr__(self) -> str:
+        """ Representation of the server. """
+        return f'NameServer({self._model}, {self._generate})'
+
+    def _generate_batch(self, items: list) -> list[str]:
+        return self._model.generate_words(self._encoder, len(items))
+
+    def _score_batch(self, items: list[str]) -> list[float | None]:
+        scores = self._model.score_words(items, self._encoder).tolist()
+        return [_to_json_number(score) for score in scores]
+
+    async def _handle_request(self, method: str, target: str,
+                              body: bytes) -> tuple[int, dict]:
+        url = urlsplit(target)
+        if method == 'GET' and url.path == '/generate':
+            query = parse_qs(url.query)
+            try:
+                count = int(query.get('count', ['1'])[0])
+            except ValueError:
+                return 400, {'error': 'Invalid count'}
+            if count < 1 or count > self._max_count:
+                return 400, {'error': 'Invalid count'}
+            words = await self._generate.submit([None] * count)
+            return 200, {'words': words}
+
+        if method == 'POST' and url.path == '/score':
+            try:
+                words = json.loads(body)['words']
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'Invalid request body'}
+            if not isinstance(words, list) or not all(
+                    isinstance(word, str) for word in words):
+                return 400, {'error': 'Invalid words'}
+            vocabulary = set(self._encoder.vocabulary) - {'.'}
+            if any(not set(word) <= vocabulary for word in words):
+                return 400, {'error': 'Unknown characters'}
+            scores = await self._score.submit(words)
+            return 200, {'scores': scores}
+
+        if method == 'GET' and url.path == '/complete' and hasattr(
+                self._model, 'top_words'):
+            query = parse_qs(url.query)
+            prefix = query.get('prefix', [''])[0]
+            try:
+                count = int(query.get('count', ['10'])[0])
+            except ValueError:
+                return 400, {'error': 'Invalid count'}
+            if count < 1 or count > self._max_count:
+                return 400, {'error': 'Invalid count'}
+            vocabulary = set(self._encoder.vocabulary) - {'.'}
+            if not set(prefix) <= vocabulary:
+                return 400, {'error': 'Unknown characters'}
+            # Completions use the default max_len of top_words().
+            if len(prefix) > 32:
+                return 400, {'error': 'Invalid prefix'}
+            # The search runs in a thread, like batched calls, so that the
+            # event loop keeps accepting requests.
+            loop = asyncio.get_running_loop()
+            if self._index is not None:
+                results = await loop.run_in_executor(None,
+                                                     self._index.complete,
+                                                     prefix, count,
+                                                     self._model,
+                                                     self._encoder)
+                return 200, {
+                    'words': [word for word, _, _ in results],
+                    'counts': [word_count for _, word_count, _ in results],
+                    'log_probs': [
+                        _to_json_number(log_prob) for _, _, log_prob in results
+                    ],
+                }
+            results = await loop.run_in_executor(None, self._model.top_words,
+                                                 self._encoder, count, prefix)
+            return 200, {
+                'words': [word for word, _ in results],
+                'log_probs': [
+                    _to_json_number(log_prob) for _, log_prob in results
+                ],
+            }
+
+        if method == 'GET' and url.path == '/stats':
+            return 200, {
+                'batches': self._generate.batch_count +
+                self._score.batch_count,
+                'items': self._generate.item_count + self._score.item_count,
+            }
+
+        return 404, {'error': 'Not found'}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode(
+                        'latin-1').split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if length < 0:
+                    # The end of the body is unknown, so the connection is
+                    # closed after the response.
+                    status, response = 400, {'error': 'Invalid Content-Length'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length > 0 \
+                        else b''
+                    try:
+                        status, response = await self._handle_request(
+                            method, target, body)
+                    except Exception:
+                        _logger.exception('Failed to handle %s %s', method,
+                                          target)
+                        status, response = 500, {'error': 'Internal error'}
+
+                payload = json.dumps(response).encode('utf-8')
+                writer.write(
+                    (f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+                     'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}'
+                     '\r\n\r\n').encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000,
+                    ready: Callable[[], None] = None):
+        """ Runs the server until it is cancelled.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on.
+        :param ready: An optional function called once the server is
+        listening.
+        """
+
+        self._generate.start()
+        self._score.start()
+        server = await asyncio.start_server(self._handle_connection, host,
+                                            port)
+        _logger.info('Listening on %s:%d', host, port)
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self._generate.stop()
+            await self._score.stop()
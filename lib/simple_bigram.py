@@ -1,42 +1,120 @@
-import torch
+from typing import Iterator, TYPE_CHECKING
+from .backends import Backend, get_backend
 from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+from .bigram_counts import BigramCounts
 from .bigram_encoder import BigramEncoder
-from .utils import global_generator, prepare_data
+from .checkpoint import read_checkpoint, write_checkpoint
+from .parallel_count import count_bigrams_parallel
+from .sequence_batch import batch_sequences, score_sequences
+from .utils import prepare_data
+from .utils import generate_sequences, search_sequences
+from .utils import decode_sequences
+from . import profiling
+
+if TYPE_CHECKING:
+    import torch
 
 type BigramPair = tuple[tuple[str], str]
 
 class SimpleBigram:
     """ Very basic bigram model based generated by counting bigrams in the
     specified input set.
+
+    The model only counts, normalizes and samples, so it can run on any array
+    backend (see lib.backends). With the NumPy backend, counting, scoring,
+    sampling and checkpoint loading never import torch.
     """
 
-    def __init__(self, word_list: WordList, encoder: BigramEncoder):
+    @profiling.profiled()
+    def __init__(self,
+                 word_list: WordList | EncodedCorpus | BigramCounts,
+                 encoder: BigramEncoder,
+                 workers: int = 1,
+                 backend: str | Backend = None):
         """ Initializes the model with a matrix of probabilities generated by
         counting bigrams in the input set.
 
-        :param word_list: A WordList object containing the words to be used to
-        compute bigram probabilities.
+        :param word_list: A WordList or EncodedCorpus object containing the
+        words to be used to compute bigram probabilities, or a BigramCounts
+        object containing precomputed counts.
         :param encoder: A BigramEncoder object used to index-encode the
         characters in the word list.
+        :param workers: The number of processes used to count the bigrams in a
+        WordList. If greater than 1, the file is split into shards that are
+        counted in parallel, producing the same counts as a single process.
+        :param backend: The array backend that holds the counts and
+        probabilities of the model. Defaults to torch. Encoded corpora are
+        counted with their own backend, and the counts are then converted.
         """
 
-        assert isinstance(word_list, WordList), "Invalid word_list (arg #1)"
+        assert isinstance(word_list,
+                          (WordList, EncodedCorpus, BigramCounts)), \
+            "Invalid word_list (arg #1)"
         assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #2)"
+        assert workers > 0, "Invalid workers (arg #3)"
+
+        backend = get_backend(backend)
+        self._backend = backend
+        self._vocabulary = list(encoder.vocabulary)
+        if isinstance(word_list, BigramCounts):
+            assert word_list.vocabulary == self._vocabulary, \
+                "Vocabulary of counts does not match encoder (arg #1)"
+            counts = word_list.counts
+        elif workers > 1 and isinstance(word_list, WordList):
+            counts = count_bigrams_parallel(word_list.file_name,
+                                            word_list.vocabulary, workers,
+                                            backend)
+        else:
+            # Word lists are counted one chunk at a time, so that streaming
+            # word lists never need to be held in memory in full.
+            corpora = word_list.iter_corpus(backend=backend) if isinstance(
+                word_list, WordList) else [word_list]
+            counts = backend.zeros(
+                (word_list.vocabulary_size, word_list.vocabulary_size),
+                backend.long)
+            for corpus in corpora:
+                counts += backend.asarray(SimpleBigram._count_bigrams(corpus))
+        self._bigram_counts = backend.to(backend.asarray(counts),
+                                         backend.float)
+        self._bigram_probs = backend.normalize_rows(self._bigram_counts)
+
+    @profiling.profiled()
+    def _count_bigrams(corpus: EncodedCorpus) -> 'torch.Tensor':
+        """ Counts every bigram in the corpus in a single batched pass.
+
+        Words in the corpus token buffer are separated by a single termination
+        character, so every adjacent pair of tokens is exactly one of the
+        bigrams produced by Word.get_pairs(1). The pairs are counted using a
+        single bincount over flattened (row, col) indices, with the backend of
+        the corpus.
+        """
 
-        self._bigram_counts = torch.zeros(
-            (word_list.vocabulary_size, word_list.vocabulary_size),
-            dtype=torch.float)
-        self._bigram_probs = torch.zeros(
+        backend = corpus.backend
+        vocabulary_size = corpus.vocabulary_size
+        indices = backend.to(corpus.tokens, backend.long)
+        flat_indices = indices[:-1] * vocabulary_size + indices[1:]
+        counts = backend.bincount(flat_indices,
+                                  vocabulary_size * vocabulary_size)
+        return counts.reshape(vocabulary_size, vocabulary_size)
+
+    def _count_bigrams_loop(word_list: WordList,
+                            encoder: BigramEncoder) -> 'torch.Tensor':
+        """ Reference implementation of bigram counting that visits one pair
+        at a time. Retained for benchmarking and verification only.
+        """
+
+        import torch
+
+        counts = torch.zeros(
             (word_list.vocabulary_size, word_list.vocabulary_size),
             dtype=torch.float)
-
         for word in word_list:
             for pair in word.get_pairs(1):
-                row, col = self._get_pair_indices(pair, encoder)
-                self._bigram_counts[row, col] += 1
-
-        sums = self._bigram_counts.sum(1, keepdim=True)
-        self._bigram_probs = self._bigram_counts / sums
+                row = encoder.get_index(pair[0][0])
+                col = encoder.get_index(pair[1][0])
+                counts[row, col] += 1
+        return counts
 
     def _get_pair_indices(self, pair, encoder):
         row = encoder.get_index(pair[0][0])
@@ -63,10 +141,10 @@ class SimpleBigram:
 
     def __call__(
         self,
-        inputs: int | float | torch.Tensor,
-        labels: torch.Tensor = None,
-        generator: torch.Generator = None
-    ) -> tuple[torch.Tensor, torch.Tensor | None]:
+        inputs: 'int | float | torch.Tensor',
+        labels: 'torch.Tensor' = None,
+        generator: 'torch.Generator' = None
+    ) -> tuple['torch.Tensor', 'torch.Tensor | None']:
         """ Evaluates the model on the given inputs and provides a probability
         of the expected outcome.
 
@@ -78,51 +156,223 @@ class SimpleBigram:
         :param labels: Labels to use for loss calculation. If None, no loss is
         returned
         :param generator: A generator object used to make a selection based on a
-        bigram's probabilities.
+        bigram's probabilities. It must belong to the backend of the model.
         """
 
-        if generator is None:
-            generator = global_generator
-
+        backend = self._backend
         if isinstance(inputs, (int, float)):
-            inputs = torch.tensor([inputs], dtype=torch.float)
-        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
-
-        indices = inputs.int()
-        predictions = torch.multinomial(self._bigram_probs[indices],
-                                        1,
-                                        replacement=True,
-                                        generator=generator)
+            inputs = backend.asarray([inputs], backend.float)
+        assert backend.is_array(inputs), 'Invalid inputs (arg #1)'
+
+        indices = backend.to(inputs, backend.long)
+        predictions = backend.sample(self._bigram_probs[indices],
+                                     generator)[:, None]
         loss = None
         if labels is not None:
-            loss = -torch.log(self._bigram_probs[indices, labels]).mean()
+            loss = -backend.mean(
+                backend.log(self._bigram_probs[indices, labels]))
 
         return predictions, loss
 
+    @profiling.profiled()
     def generate_word(self,
                       encoder: BigramEncoder,
-                      generator: torch.Generator = None):
+                      generator: 'torch.Generator' = None):
         """ Generates a word using the model.
 
         :param encoder: The encoder used to convert indices to characters.
-        :param generator: A torch generator object used to randomly select the
-        next character based on model outputs.
+        :param generator: A generator object of the backend of the model, used
+        to randomly select the next character based on model outputs.
 
         :return: The generated word as a string.
         """
 
-        if generator is None:
-            generator = global_generator
-
-        chars = []
-        index = encoder.get_index('.')
+        stop_index = encoder.get_index('.')
+        indices = []
+        index = stop_index
         while True:
             index, _ = self(index, None, generator)
             index = index.item()
-            if index == encoder.get_index('.'):
+            if index == stop_index:
                 break
-            chars.append(encoder.get_char(index))
-        return ''.join(chars)
+            indices.append(index)
+        return encoder.decode(indices)
+
+    def _get_delta(
+        self, words: WordList | EncodedCorpus | BigramCounts | list
+    ) -> tuple['torch.Tensor', 'torch.Tensor', 'torch.Tensor']:
+        backend = self._backend
+        if isinstance(words, BigramCounts):
+            assert words.vocabulary == self._vocabulary, \
+                "Vocabulary of counts does not match the model (arg #1)"
+            counts = backend.asarray(words.counts)
+            rows, cols = backend.nonzero(counts)
+            return rows, cols, counts[rows, cols]
+        rows, cols, counts = BigramCounts.get_pair_counts(
+            BigramCounts.get_corpus(words, self._vocabulary, backend))
+        return (backend.asarray(rows), backend.asarray(cols),
+                backend.asarray(counts))
+
+    def _apply_delta(self, rows: 'torch.Tensor', cols: 'torch.Tensor',
+                     counts: 'torch.Tensor'):
+        # Only rows that received new counts need to be renormalized.
+        backend = self._backend
+        backend.index_add(self._bigram_counts, (rows, cols), counts)
+        touched = backend.unique(rows)
+        self._bigram_probs[touched] = backend.normalize_rows(
+            self._bigram_counts[touched])
+
+    def update(self, words: WordList | EncodedCorpus | BigramCounts | list):
+        """ Adds the bigrams in a collection of words to the model. Only the
+        probability rows of characters that start a new bigram are
+        recomputed, so the cost is proportional to the size of the update.
+
+        :param words: A WordList, an EncodedCorpus, a list of Word objects or
+        strings, or a BigramCounts object. All characters must be in the
+        vocabulary of the model.
+        """
+
+        self._apply_delta(*self._get_delta(words))
+
+    def remove(self, words: WordList | EncodedCorpus | BigramCounts | list):
+        """ Removes the bigrams in a collection of words from the model. Only
+        the probability rows of characters that start a removed bigram are
+        recomputed.
+
+        A ValueError is raised, and the model is left unchanged, if any bigram
+        would be removed more times than it was counted.
+
+        :param words: A WordList, an EncodedCorpus, a list of Word objects or
+        strings, or a BigramCounts object. All characters must be in the
+        vocabulary of the model.
+        """
+
+        rows, cols, counts = self._get_delta(words)
+        if (self._bigram_counts[rows, cols] < counts).any():
+            raise ValueError('Cannot remove bigrams that were not counted')
+        self._apply_delta(rows, cols, -counts)
+
+    def get_counts(self) -> BigramCounts:
+        """ Returns a copy of the bigram counts of the model, which can be
+        merged with counts from other sources.
+        """
+
+        return BigramCounts(
+            self._vocabulary,
+            self._backend.to(self._bigram_counts, self._backend.long))
+
+    def save(self, file_name: str, encoder: BigramEncoder):
+        """ Saves the model and the vocabulary of its encoder to a checkpoint
+        file.
+
+        :param file_name: The name of the checkpoint file.
+        :param encoder: The encoder used by the model.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #2)"
+        write_checkpoint(file_name, 'SimpleBigram', encoder, {}, {
+            'counts': self._bigram_counts,
+            'probs': self._bigram_probs,
+        })
+
+    @classmethod
+    def load(
+        cls,
+        file_name: str,
+        backend: str | Backend = None
+    ) -> tuple['SimpleBigram', BigramEncoder]:
+        """ Loads a model saved with save(). The count and probability tensors
+        are memory mapped from the checkpoint instead of being recomputed.
+
+        :param file_name: The name of the checkpoint file.
+        :param backend: The array backend of the loaded model. Defaults to
+        torch. Checkpoints can be loaded with any backend, regardless of the
+        backend that saved them.
+        :return: A tuple containing the model and its encoder.
+        """
+
+        backend = get_backend(backend)
+        _, encoder, tensors = read_checkpoint(file_name, 'SimpleBigram',
+                                              backend)
+        model = cls.__new__(cls)
+        model._backend = backend
+        model._vocabulary = list(encoder.vocabulary)
+        model._bigram_counts = tensors['counts']
+        model._bigram_probs = tensors['probs']
+        return model, encoder
+
+    @property
+    def backend(self) -> Backend:
+        """ Array backend of the model. """
+        return self._backend
+
+    def get_transitions(self) -> 'torch.Tensor':
+        """ Returns the matrix of transition probabilities, in which row i holds
+        the probability distribution of the character that follows the
+        character with index i.
+        """
+
+        return self._bigram_probs
+
+    @profiling.profiled()
+    def generate_words(self,
+                       encoder: BigramEncoder,
+                       count: int,
+                       max_len: int = 32,
+                       generator: 'torch.Generator' = None) -> list[str]:
+        """ Generates a batch of words using the model. All words are advanced
+        together, with a single sampling call per character position.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param count: The number of words to generate.
+        :param max_len: The maximum number of characters sampled for each word,
+        including the termination character. Longer words are truncated.
+        :param generator: A generator object of the backend of the model, used
+        to randomly select the next character based on model outputs.
+
+        :return: A list of generated words.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #1)"
+
+        sequences = generate_sequences(self.get_transitions(),
+                                       encoder.get_index('.'), count, max_len,
+                                       generator)
+        return decode_sequences(sequences, encoder)
+
+    @profiling.profiled()
+    def top_words(self,
+                  encoder: BigramEncoder,
+                  count: int,
+                  prefix: str = '',
+                  min_len: int = 1,
+                  max_len: int = 32) -> list[tuple[str, float]]:
+        """ Finds the most likely words under the model, or the most likely
+        completions of a prefix, with a batched search over the transition
+        matrix rather than by sampling.
+
+        :param encoder: The encoder used to convert between characters and
+        indices.
+        :param count: The maximum number of words to return.
+        :param prefix: An optional prefix that every word starts with.
+        :param min_len: The minimum number of characters of each word,
+        including the prefix.
+        :param max_len: The maximum number of characters of each word,
+        including the prefix.
+        :return: A list of (word, log_prob) tuples, from most to least likely,
+        where log_prob is the log probability of the whole word, including its
+        prefix and termination character.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #1)"
+        assert isinstance(prefix, str), "Invalid prefix (arg #3)"
+
+        sequences, log_probs = search_sequences(
+            self._backend.log(self._bigram_probs), encoder.get_index('.'),
+            count, encoder.encode(prefix, backend=self._backend), min_len,
+            max_len)
+        return list(zip(decode_sequences(sequences, encoder),
+                        log_probs.tolist()))
 
     def get_count(self, pair: BigramPair, encoder: BigramEncoder) -> int:
         """ Returns the count of a specific bigram pair.
@@ -158,7 +408,7 @@ class SimpleBigram:
         """
 
         row, col = self._get_pair_indices(pair, encoder)
-        return -torch.log(self._bigram_probs[row, col])
+        return -self._backend.log(self._bigram_probs[row, col])
 
     def show_counts(self, encoder: BigramEncoder):
         """ Displays the bigram counts in a formatted matrix.
@@ -176,15 +426,83 @@ class SimpleBigram:
 
         SimpleBigram._show_data(self._bigram_probs, encoder)
 
-    def prepare_data(self, words: WordList, encoder) -> tuple[torch.Tensor, torch.Tensor]:
+    @profiling.profiled()
+    def score_words(self,
+                    words: WordList | EncodedCorpus | list,
+                    encoder: BigramEncoder,
+                    batch_size: int = None) -> 'torch.Tensor':
+        """ Computes the negative log-likelihood of whole words, including
+        their termination characters, with one vectorized pass per batch.
+
+        :param words: A WordList, an EncodedCorpus, or a list of Word objects
+        or strings.
+        :param encoder: The encoder used to convert characters to indices.
+        :param batch_size: The maximum number of words scored at a time. Words
+        are bucketed by length to minimize padding. If omitted, all words are
+        scored together.
+        :return: A tensor with the negative log-likelihood of each word, in the
+        order of the input words, of the backend of the model.
+        """
+
+        assert isinstance(encoder, BigramEncoder), "Invalid encoder (arg #2)"
+
+        log_transitions = self._backend.log(self._bigram_probs)
+        batches = batch_sequences(words,
+                                  encoder.vocabulary,
+                                  batch_size,
+                                  backend=self._backend)
+        return score_sequences(log_transitions, batches, len(words))
+
+    def prepare_data(self, words: WordList | EncodedCorpus | list,
+                     encoder) -> tuple['torch.Tensor', 'torch.Tensor']:
         """ Prepares data that can be used to train this model.
 
+        :param words: A WordList, EncodedCorpus or list of Word objects
+        containing the words to be used to generate the dataset.
+        :param encoder: The encoder used to convert characters to indices.
+        :return: A tuple containing the input and label tensors. Word lists
+        and lists of words are encoded with the backend of the model, while
+        encoded corpora keep their own backend.
+        """
+
+        if isinstance(words, WordList):
+            words = words.get_corpus(self._backend)
+        if not isinstance(words, EncodedCorpus):
+            words = EncodedCorpus.from_lines([word.text for word in words],
+                                             encoder.vocabulary,
+                                             self._backend)
+        transform = lambda indices: self.prepare_indices(indices, encoder)
+        return prepare_data(words, transform)
+
+    def prepare_indices(self, indices: 'torch.Tensor',
+                        encoder) -> 'torch.Tensor':
+        """ Converts index tensors produced by EncodedCorpus.get_pairs() into
+        the format expected by this model.
+
+        :param indices: An index tensor of shape (N, input_count).
+        :param encoder: The encoder used to convert characters to indices.
+        :return: The transformed tensor.
+        """
+
+        return indices[:, 0]
+
+    def iter_data(
+            self,
+            words: WordList,
+            encoder,
+            chunk_size: int = None
+    ) -> Iterator[tuple['torch.Tensor', 'torch.Tensor']]:
+        """ Prepares data that can be used to train this model, one chunk of
+        words at a time.
+
         :param words: A WordList object containing the words to be used to
         generate the dataset.
         :param encoder: The encoder used to convert characters to indices.
-        :return: A tuple containing the input and label tensors.
+        :param chunk_size: The number of words in each chunk. Defaults to the
+        chunking behavior of WordList.iter_corpus().
+        :return: An iterator of tuples containing the input and label tensors
+        for each chunk.
         """
 
-        transform = lambda chars: torch.tensor(
-            [encoder.get_index(char[0]) for char in chars])
-        return prepare_data(words[:], transform)
+        for corpus in words.iter_corpus(chunk_size, self._backend):
+            yield self.prepare_data(corpus, encoder)
@@ -0,0 +1,515 @@
+import math
+import torch
+from typing import Iterator
+from .word_list import WordList
+from .encoded_corpus import EncodedCorpus
+from .base_encoder import BaseEncoder
+from .context_encoder import ContextEncoder
+from .utils import global_generator, decode_sequences
+from . import profiling
+
+type NgramPair = tuple[tuple[str, ...], tuple[str]]
+
+
+class _NgramTable:
+    """ Sparse table of counts for a single context length.
+
+    Every observed (context, label) pair is identified by a key computed as
+    context_id * V + label, where context_id is the base V number formed by
+    the indices of the context characters. Keys are stored in sorted order
+    along with their counts, so the counts of a context occupy a contiguous
+    range of the table, similar to a row in a CSR matrix. Observed contexts and
+    their total counts are stored separately for fast lookup.
+    """
+
+    def __init__(self, keys: torch.Tensor, counts: torch.Tensor,
+                 vocabulary_size: int):
+        self.keys = keys
+        self.counts = counts
+        self.contexts, inverse = torch.unique_consecutive(
+            keys // vocabulary_size, return_inverse=True)
+        self.totals = torch.zeros(self.contexts.shape[0], dtype=torch.long)
+        self.totals.index_add_(0, inverse, counts)
+        # Number of distinct labels observed after each context.
+        self.types = torch.bincount(inverse,
+                                    minlength=self.contexts.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(tensor.element_size() * tensor.nelement() for tensor in [
+            self.keys, self.counts, self.contexts, self.totals, self.types
+        ])
+
+    def find_contexts(
+            self,
+            context_ids: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """ Returns the positions of the given context ids in the table, and a
+        mask of the contexts that were observed. """
+
+        positions = torch.searchsorted(self.contexts, context_ids)
+        if self.contexts.shape[0] == 0:
+            return positions, torch.zeros_like(context_ids, dtype=torch.bool)
+        positions = positions.clamp(max=self.contexts.shape[0] - 1)
+        return positions, self.contexts[positions] == context_ids
+
+    def get_counts(self, keys: torch.Tensor) -> torch.Tensor:
+        """ Returns the counts of the given keys, with 0 for unobserved keys.
+        """
+
+        if self.keys.shape[0] == 0:
+            return torch.zeros_like(keys)
+        positions = torch.searchsorted(self.keys, keys)
+        positions = positions.clamp(max=self.keys.shape[0] - 1)
+        found = self.keys[positions] == keys
+        return torch.where(found, self.counts[positions],
+                           torch.zeros_like(keys))
+
+
+class SimpleNgram:
+    """ N-gram model generated by counting n-grams in the specified input set,
+    generalizing SimpleBigram to contexts of n - 1 characters.
+
+    Counts are stored sparsely, so build time and memory scale with the number
+    of distinct n-grams that are observed, and not with V^n. Contexts that
+    extend past the start of a word are padded with the termination
+    character, like the windows of ContextEncoder, so that models of any n
+    count and predict every character of every word.
+
+    With backoff enabled, probabilities use interpolated absolute discounting.
+    A fixed discount is subtracted from the count of every observed n-gram,
+    and the probability mass that is freed is spread according to the
+    distribution of the next shorter context, down to unigram counts smoothed
+    by adding k. Labels that were never observed after a context, and
+    contexts that were never observed, therefore get the probability of
+    shorter contexts rather than zero. Without backoff, probabilities are
+    smoothed by adding k to the counts of the longest context, and contexts
+    that were never observed are given a uniform distribution.
+    """
+
+    @profiling.profiled()
+    def __init__(self,
+                 word_list: WordList | EncodedCorpus,
+                 encoder: BaseEncoder,
+                 n: int = 3,
+                 k: float = 0.0,
+                 backoff: bool = True,
+                 discount: float = 0.75):
+        """ Initializes the model by counting n-grams in the input set.
+
+        :param word_list: A WordList or EncodedCorpus object containing the
+        words to be used to compute n-gram probabilities.
+        :param encoder: An encoder used to index-encode the characters in the
+        word list.
+        :param n: The length of the n-grams, including the label. A value of
+        2 yields a bigram model.
+        :param k: The value added to every count for smoothing. With backoff,
+        it only applies to the unigram counts.
+        :param backoff: If True, probabilities back off to shorter contexts.
+        :param discount: The value subtracted from the count of every observed
+        n-gram with backoff, between 0 and 1. A discount of 0 disables
+        backoff for observed contexts.
+        """
+
+        assert isinstance(word_list, (WordList, EncodedCorpus)), \
+            "Invalid word_list (arg #1)"
+        assert isinstance(encoder, BaseEncoder), "Invalid encoder (arg #2)"
+        assert isinstance(n, int) and n >= 1, "Invalid n (arg #3)"
+        assert k >= 0, "Invalid k (arg #4)"
+        assert isinstance(backoff, bool), "Invalid backoff (arg #5)"
+        assert 0 <= discount <= 1, "Invalid discount (arg #6)"
+
+        vocabulary_size = word_list.vocabulary_size
+        assert n * math.log2(max(vocabulary_size, 2)) < 63, \
+            "n-gram keys do not fit into 64 bits (arg #3)"
+
+        self._vocabulary_size = vocabulary_size
+        self._n = n
+        self._k = float(k)
+        self._backoff = backoff
+        self._discount = float(discount)
+
+        corpora = word_list.iter_corpus() if isinstance(
+            word_list, WordList) else [word_list]
+        chunk_tables = [[] for _ in range(n)]
+        for corpus in corpora:
+            contexts, labels = self._get_windows(corpus)
+            for context_length in range(n):
+                chunk_tables[context_length].append(
+                    self._count_ngrams(
+                        contexts[:, contexts.shape[1] - context_length:],
+                        labels))
+        self._tables = [
+            _NgramTable(*self._merge_counts(chunks), vocabulary_size)
+            for chunks in chunk_tables
+        ]
+
+    def _get_context_ids(self, contexts: torch.Tensor) -> torch.Tensor:
+        weights = self._vocabulary_size**torch.arange(
+            contexts.shape[1] - 1, -1, -1, dtype=torch.long)
+        return (contexts.long() * weights).sum(1)
+
+    def _get_windows(
+            self,
+            corpus: EncodedCorpus) -> tuple[torch.Tensor, torch.Tensor]:
+        # Windows of n - 1 characters, padded with the termination character.
+        # Shorter contexts are the suffixes of these windows.
+        context_length = self._n - 1
+        encoder = ContextEncoder(corpus.vocabulary, max(context_length, 1))
+        contexts, labels = encoder.get_contexts(corpus)
+        return contexts[:, contexts.shape[1] - context_length:], labels
+
+    def _count_ngrams(
+            self, contexts: torch.Tensor,
+            labels: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        keys = self._get_context_ids(contexts) * self._vocabulary_size + \
+            labels.long()
+        return torch.unique(keys, return_counts=True)
+
+    def _merge_counts(
+        self, chunks: list[tuple[torch.Tensor, torch.Tensor]]
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        if len(chunks) == 1:
+            return chunks[0]
+        if len(chunks) == 0:
+            empty = torch.zeros(0, dtype=torch.long)
+            return empty, empty
+        keys, inverse = torch.unique(torch.cat([keys for keys, _ in chunks]),
+                                     return_inverse=True)
+        counts = torch.zeros(keys.shape[0], dtype=torch.long)
+        counts.index_add_(0, inverse, torch.cat([c for _, c in chunks]))
+        return keys, counts
+
+    def _find_contexts(
+        self, contexts: torch.Tensor, context_length: int
+    ) -> tuple[torch.Tensor, _NgramTable, torch.Tensor]:
+        """ Looks up the last context_length characters of every row of
+        contexts. Returns the rows whose context was observed, the table of
+        that context length, and the positions of the contexts in the table.
+        """
+
+        table = self._tables[context_length]
+        suffix = contexts[:, contexts.shape[1] - context_length:]
+        positions, found = table.find_contexts(self._get_context_ids(suffix))
+        return found.nonzero()[:, 0], table, positions[found]
+
+    def _get_dense_counts(self, table: _NgramTable,
+                          positions: torch.Tensor) -> torch.Tensor:
+        """ Returns the label counts of the contexts at the given positions of
+        a table, as a dense (N, V) tensor. """
+
+        size = self._vocabulary_size
+        counts = torch.zeros((positions.shape[0], size))
+        starts = torch.searchsorted(table.keys,
+                                    table.contexts[positions] * size)
+        lengths = torch.searchsorted(
+            table.keys, (table.contexts[positions] + 1) * size) - starts
+        group_starts = torch.cumsum(lengths, 0) - lengths
+        entries = torch.arange(lengths.sum().item(), dtype=torch.long)
+        entries += torch.repeat_interleave(starts - group_starts, lengths)
+        row_indices = torch.repeat_interleave(
+            torch.arange(positions.shape[0]), lengths)
+        counts[row_indices, table.keys[entries] % size] = \
+            table.counts[entries].to(counts.dtype)
+        return counts
+
+    def _get_unigram_probabilities(self) -> torch.Tensor:
+        """ Returns the add-k smoothed distribution of labels regardless of
+        context, which ends the backoff chain. """
+
+        size = self._vocabulary_size
+        table = self._tables[0]
+        counts = self._get_dense_counts(
+            table, torch.zeros(table.contexts.shape[0], dtype=torch.long))
+        counts = counts.sum(0) + self._k
+        total = counts.sum()
+        if total == 0:
+            return torch.full((size, ), 1.0 / size)
+        return counts / total
+
+    def _get_backoff_weights(
+        self, table: _NgramTable, positions: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """ Returns the totals of the contexts at the given positions, and the
+        fraction of their probability mass given to shorter contexts. """
+
+        totals = table.totals[positions].to(torch.float)
+        return totals, self._discount * table.types[positions] / totals
+
+    def _get_rows(self, contexts: torch.Tensor) -> torch.Tensor:
+        """ Returns the probability distribution of the next character for
+        every row of contexts, as a dense (N, V) tensor. """
+
+        size = self._vocabulary_size
+        if not self._backoff:
+            rows = torch.full((contexts.shape[0], size), 1.0 / size)
+            indices, table, positions = self._find_contexts(
+                contexts, contexts.shape[1])
+            counts = self._get_dense_counts(table, positions) + self._k
+            rows[indices] = counts / counts.sum(1, keepdim=True)
+            return rows
+
+        rows = self._get_unigram_probabilities().repeat(contexts.shape[0], 1)
+        for context_length in range(1, contexts.shape[1] + 1):
+            indices, table, positions = self._find_contexts(
+                contexts, context_length)
+            totals, weights = self._get_backoff_weights(table, positions)
+            counts = self._get_dense_counts(table, positions)
+            rows[indices] = (counts - self._discount).clamp(min=0) / \
+                totals[:, None] + weights[:, None] * rows[indices]
+        return rows
+
+    def _get_probabilities(self, contexts: torch.Tensor,
+                           labels: torch.Tensor) -> torch.Tensor:
+        """ Returns the probability of each label given the corresponding row
+        of contexts. """
+
+        size = self._vocabulary_size
+        if not self._backoff:
+            probs = torch.full((contexts.shape[0], ), 1.0 / size)
+            indices, table, positions = self._find_contexts(
+                contexts, contexts.shape[1])
+            keys = table.contexts[positions] * size + labels[indices]
+            counts = table.get_counts(keys).to(probs.dtype)
+            totals = table.totals[positions].to(probs.dtype)
+            probs[indices] = (counts + self._k) / (totals + self._k * size)
+            return probs
+
+        probs = self._get_unigram_probabilities()[labels]
+        for context_length in range(1, contexts.shape[1] + 1):
+            indices, table, positions = self._find_contexts(
+                contexts, context_length)
+            totals, weights = self._get_backoff_weights(table, positions)
+            keys = table.contexts[positions] * size + labels[indices]
+            counts = table.get_counts(keys).to(probs.dtype)
+            probs[indices] = (counts - self._discount).clamp(min=0) / \
+                totals + weights * probs[indices]
+        return probs
+
+    def _encode_pair(self, pair: NgramPair,
+                     encoder: BaseEncoder) -> tuple[torch.Tensor, torch.Tensor]:
+        contexts = encoder.encode(''.join(pair[0])).reshape(1, len(pair[0]))
+        labels = encoder.encode(pair[1][0])
+        return contexts, labels
+
+    def __repr__(self) -> str:
+        """ Representation of the model. """
+        entries = self._tables[-1].keys.shape[0]
+        return f'SimpleNgram(n={self._n}, entries={entries})'
+
+    @property
+    def n(self) -> int:
+        """ Length of the n-grams, including the label. """
+        return self._n
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the count tables, in bytes. """
+        return sum(table.nbytes for table in self._tables)
+
+    def __call__(
+        self,
+        inputs: torch.Tensor,
+        labels: torch.Tensor = None,
+        generator: torch.Generator = None
+    ) -> tuple[torch.Tensor, torch.Tensor | None]:
+        """ Evaluates the model on the given inputs and provides a probability
+        of the expected outcome.
+
+        If labels are provided, loss is calculated using average negative log
+        loss.
+
+        :param inputs: Inputs to the model, specified as an integer tensor of
+        shape (N, context_length), where context_length is at most n - 1.
+        :param labels: Labels to use for loss calculation, as a tensor of N
+        indices. If None, no loss is returned
+        :param generator: A generator object used to make a selection based on
+        the n-gram probabilities.
+        """
+
+        if generator is None:
+            generator = global_generator
+
+        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
+        if inputs.dim() == 1:
+            inputs = inputs.unsqueeze(1)
+        assert inputs.shape[1] < self._n, 'Input has an invalid shape (arg #1)'
+        inputs = inputs.long()
+
+        predictions = torch.multinomial(self._get_rows(inputs),
+                                        1,
+                                        replacement=True,
+                                        generator=generator)
+        loss = None
+        if labels is not None:
+            assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #2)'
+            labels = labels.reshape(-1).long()
+            loss = -torch.log(self._get_probabilities(inputs, labels)).mean()
+
+        return predictions, loss
+
+    @profiling.profiled()
+    def generate_words(self,
+                       encoder: BaseEncoder,
+                       count: int,
+                       max_len: int = 32,
+                       generator: torch.Generator = None) -> list[str]:
+        """ Generates a batch of words using the model. Every character is
+        sampled with the n - 1 preceding characters as context, padded with
+        the termination character at the start of the word.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param count: The number of words to generate.
+        :param max_len: The maximum number of characters sampled for each word,
+        including the termination character. Longer words are truncated.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: A list of generated words.
+        """
+
+        assert isinstance(encoder, BaseEncoder), "Invalid encoder (arg #1)"
+        assert count >= 0, 'Invalid count (arg #2)'
+        assert max_len > 0, 'Invalid max_len (arg #3)'
+
+        if generator is None:
+            generator = global_generator
+
+        stop_index = encoder.get_index('.')
+        padding = max(self._n - 1, 1)
+        history = torch.full((count, padding + max_len), stop_index,
+                             dtype=torch.long)
+        active = torch.arange(count)
+        for position in range(padding, padding + max_len):
+            if active.shape[0] == 0:
+                break
+            contexts = history[active, position - (self._n - 1):position]
+            current = torch.multinomial(self._get_rows(contexts),
+                                        1,
+                                        replacement=True,
+                                        generator=generator).squeeze(1)
+            history[active, position] = current
+            active = active[current != stop_index]
+        return decode_sequences(history[:, padding:], encoder)
+
+    @profiling.profiled()
+    def generate_word(self,
+                      encoder: BaseEncoder,
+                      generator: torch.Generator = None) -> str:
+        """ Generates a word using the model.
+
+        :param encoder: The encoder used to convert indices to characters.
+        :param generator: A torch generator object used to randomly select the
+        next character based on model outputs.
+
+        :return: The generated word as a string.
+        """
+
+        if generator is None:
+            generator = global_generator
+
+        stop_index = encoder.get_index('.')
+        padding = max(self._n - 1, 1)
+        history = [stop_index] * padding
+        while True:
+            contexts = torch.tensor([history[len(history) - (self._n - 1):]],
+                                    dtype=torch.long)
+            predictions, _ = self(contexts, None, generator)
+            index = predictions.item()
+            if index == stop_index:
+                break
+            history.append(index)
+        return encoder.decode(
+            torch.tensor(history[padding:], dtype=torch.long))
+
+    def get_count(self, pair: NgramPair, encoder: BaseEncoder) -> int:
+        """ Returns the count of a specific n-gram.
+
+        :param pair: A tuple of the context characters and a tuple containing
+        the label, as returned by Word.get_pairs().
+        :param encoder: The encoder used to convert characters to indices.
+        :return: The number of times that the n-gram appeared in the data set.
+        """
+
+        contexts, labels = self._encode_pair(pair, encoder)
+        size = self._vocabulary_size
+        keys = self._get_context_ids(contexts) * size + labels
+        return self._tables[contexts.shape[1]].get_counts(keys).item()
+
+    def get_probability(self, pair: NgramPair, encoder: BaseEncoder) -> float:
+        """ Returns the smoothed probability of a specific n-gram.
+
+        :param pair: A tuple of the context characters and a tuple containing
+        the label, as returned by Word.get_pairs().
+        :param encoder: The encoder used to convert characters to indices.
+        :return: The probability of the label following the context.
+        """
+
+        contexts, labels = self._encode_pair(pair, encoder)
+        return self._get_probabilities(contexts, labels).item()
+
+    def get_log_likelihood(self, pair: NgramPair,
+                           encoder: BaseEncoder) -> float:
+        """ Returns the negative log likelihood of a specific n-gram.
+
+        :param pair: A tuple of the context characters and a tuple containing
+        the label, as returned by Word.get_pairs().
+        :param encoder: The encoder used to convert characters to indices.
+        :return: The negative log likelihood of the label following the
+        context.
+        """
+
+        contexts, labels = self._encode_pair(pair, encoder)
+        return -torch.log(self._get_probabilities(contexts, labels))[0]
+
+    def prepare_data(self, words: WordList | EncodedCorpus,
+                     encoder) -> tuple[torch.Tensor, torch.Tensor]:
+        """ Prepares data that can be used to evaluate this model. Every
+        character of every word, including its termination character, is
+        paired with the n - 1 preceding characters, padded with the
+        termination character, so that losses are computed over the same
+        examples for any n.
+
+        :param words: A WordList or EncodedCorpus object containing the words
+        to be used to generate the dataset.
+        :param encoder: The encoder used to convert characters to indices.
+        :return: A tuple containing the input tensor of shape (N, n - 1) and
+        the label tensor of shape (N, ).
+        """
+
+        if isinstance(words, WordList):
+            words = words.corpus
+        contexts, labels = self._get_windows(words)
+        return self.prepare_indices(contexts, encoder), labels.long()
+
+    def prepare_indices(self, indices: torch.Tensor,
+                        encoder) -> torch.Tensor:
+        """ Converts index tensors produced by ContextEncoder.get_contexts()
+        into the format expected by this model.
+
+        :param indices: An index tensor of shape (N, input_count).
+        :param encoder: The encoder used to convert characters to indices.
+        :return: The transformed tensor.
+        """
+
+        return indices.long()
+
+    def iter_data(
+            self,
+            words: WordList,
+            encoder,
+            chunk_size: int = None
+    ) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        """ Prepares data that can be used to evaluate this model, one chunk
+        of words at a time.
+
+        :param words: A WordList object containing the words to be used to
+        generate the dataset.
+        :param encoder: The encoder used to convert characters to indices.
+        :param chunk_size: The number of words in each chunk. Defaults to the
+        chunking behavior of WordList.iter_corpus().
+        :return: An iterator of tuples containing the input and label tensors
+        for each chunk.
+        """
+
+        for corpus in words.iter_corpus(chunk_size):
+            yield self.prepare_data(corpus, encoder)
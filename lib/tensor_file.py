@@ -0,0 +1,126 @@
+import json
+import mmap
+import os
+import struct
+from typing import TYPE_CHECKING
+from .backends import Backend, get_backend, get_array_backend
+
+if TYPE_CHECKING:
+    import torch
+
+_MAGIC = b'MKMRTNSR'
+_VERSION = 1
+_PREFIX = struct.Struct('<8sIQ')
+_ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def write_tensors(file_name: str, metadata: dict,
+                  tensors: dict[str, 'torch.Tensor']):
+    """ Writes a set of named tensors and JSON serializable metadata to a
+    binary file.
+
+    The file starts with a fixed prefix (magic bytes, format version and header
+    length), followed by a JSON header that describes the metadata and the
+    dtype, shape and offset of every tensor. Raw tensor data follows the
+    header, with every tensor aligned to a 64 byte boundary so that it can be
+    memory mapped directly. The file is written to a temporary location and
+    then moved into place, so readers never observe a partial file.
+
+    :param file_name: The name of the file to write.
+    :param metadata: A JSON serializable dictionary stored with the tensors.
+    :param tensors: A dictionary of tensors to store, keyed by name. Arrays
+    of any backend may be stored, and read back with either backend.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+    assert isinstance(metadata, dict), 'Invalid metadata (arg #2)'
+    assert isinstance(tensors, dict), 'Invalid tensors (arg #3)'
+
+    entries = {}
+    buffers = []
+    offset = 0
+    for name, tensor in tensors.items():
+        backend = get_array_backend(tensor)
+        data = backend.to_bytes(tensor)
+        entries[name] = {
+            'dtype': backend.get_dtype_name(tensor),
+            'shape': list(tensor.shape),
+            'offset': offset,
+        }
+        buffers.append((offset, data))
+        offset = _align(offset + len(data))
+
+    header = json.dumps({
+        'metadata': metadata,
+        'tensors': entries
+    }).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header))
+
+    temp_file_name = f'{file_name}.{os.getpid()}.tmp'
+    with open(temp_file_name, 'wb') as file:
+        file.write(_PREFIX.pack(_MAGIC, _VERSION, len(header)))
+        file.write(header)
+        for data_offset, data in buffers:
+            file.seek(data_start + data_offset)
+            file.write(data)
+        file.truncate(data_start + offset)
+    os.replace(temp_file_name, file_name)
+
+
+def read_tensors(
+    file_name: str,
+    backend: str | Backend = None
+) -> tuple[dict, dict[str, 'torch.Tensor']]:
+    """ Reads a set of named tensors and metadata written by write_tensors().
+
+    Tensors are memory mapped from the file without copying. The mapping is
+    copy on write, so tensors may be modified without changing the file, and
+    processes that map the same file share its pages until they are modified.
+
+    :param file_name: The name of the file to read.
+    :param backend: The array backend of the returned tensors. Defaults to
+    torch.
+    :return: A tuple containing the metadata and a dictionary of tensors keyed
+    by name.
+    """
+
+    assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+
+    backend = get_backend(backend)
+    with open(file_name, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < _PREFIX.size:
+            raise ValueError(f'Invalid tensor file: {file_name}')
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic, version, header_size = _PREFIX.unpack_from(mapped, 0)
+    if magic != _MAGIC:
+        raise ValueError(f'Invalid tensor file: {file_name}')
+    if version != _VERSION:
+        raise ValueError(f'Unsupported tensor file version: {version}')
+    if _PREFIX.size + header_size > size:
+        raise ValueError(f'Truncated tensor file: {file_name}')
+
+    header = json.loads(mapped[_PREFIX.size:_PREFIX.size + header_size])
+    data_start = _align(_PREFIX.size + header_size)
+
+    tensors = {}
+    for name, entry in header['tensors'].items():
+        dtype = backend.get_dtype(entry['dtype'])
+        shape = entry['shape']
+        count = 1
+        for dim in shape:
+            count *= dim
+        offset = data_start + entry['offset']
+        if offset + count * dtype.itemsize > size:
+            raise ValueError(f'Truncated tensor file: {file_name}')
+        if count == 0:
+            tensors[name] = backend.zeros(shape, dtype)
+        else:
+            tensors[name] = backend.from_buffer(mapped, dtype, count,
+                                                offset).reshape(shape)
+    return header['metadata'], tensors
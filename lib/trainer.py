@@ -0,0 +1,200 @@
+import logging
+import math
+import time
+import torch
+from typing import Callable
+from .optimizers import Optimizer, ConstantSchedule
+from .utils import global_generator
+from . import profiling
+
+_logger = logging.getLogger(__name__)
+
+
+class Trainer:
+    """ Trains a model using shuffled mini-batches over multiple epochs.
+
+    The trainer works with any model that follows the training protocol used
+    by NeuronBigram: calling the model with inputs and labels returns a tuple
+    of (outputs, loss), reset_grad() clears gradients, and update(delta) takes
+    a gradient step. If an optimizer is provided, it is passed to the model as
+    update(delta, optimizer). Models that provide get_loss(inputs, labels)
+    are trained with it instead, so that they can compute the loss without
+    computing their outputs.
+
+    Training can optionally be stopped early when the loss on a held out
+    validation set stops improving.
+    """
+
+    def __init__(self,
+                 model,
+                 learning_rate: float | Callable[[int], float],
+                 optimizer: Optimizer = None,
+                 batch_size: int = None,
+                 epochs: int = 1,
+                 patience: int = None,
+                 generator: torch.Generator = None):
+        """ Initializes the trainer.
+
+        :param model: The model to train.
+        :param learning_rate: A fixed learning rate, or a schedule that maps
+        the step number (starting at 0) to a learning rate.
+        :param optimizer: The optimizer used to update the model. If omitted,
+        the model's own update rule is used.
+        :param batch_size: The number of examples in each mini-batch. If
+        omitted, every step uses the full dataset, without shuffling.
+        :param epochs: The maximum number of passes over the dataset.
+        :param patience: The number of epochs without an improvement in
+        validation loss after which training stops. Early stopping is disabled
+        if omitted, or if no validation set is provided.
+        :param generator: A torch generator object used to shuffle the data.
+        The global generator is used if omitted.
+        """
+
+        assert callable(model), 'Invalid model (arg #1)'
+        assert callable(learning_rate) or learning_rate > 0, \
+            'Invalid learning_rate (arg #2)'
+        assert optimizer is None or isinstance(
+            optimizer, Optimizer), 'Invalid optimizer (arg #3)'
+        assert batch_size is None or batch_size > 0, \
+            'Invalid batch_size (arg #4)'
+        assert epochs > 0, 'Invalid epochs (arg #5)'
+        assert patience is None or patience > 0, 'Invalid patience (arg #6)'
+
+        if not callable(learning_rate):
+            learning_rate = ConstantSchedule(learning_rate)
+        if generator is None:
+            generator = global_generator
+
+        self._model = model
+        self._schedule = learning_rate
+        self._optimizer = optimizer
+        self._batch_size = batch_size
+        self._epochs = epochs
+        self._patience = patience
+        self._generator = generator
+        self._step = 0
+
+    def __repr__(self) -> str:
+        """ Representation of the trainer. """
+        return (f'Trainer(batch_size={self._batch_size}, '
+                f'epochs={self._epochs}, optimizer={self._optimizer})')
+
+    def _iter_batches(self, count: int):
+        if self._batch_size is None or self._batch_size >= count:
+            yield None
+            return
+        order = torch.randperm(count, generator=self._generator)
+        for start in range(0, count, self._batch_size):
+            yield order[start:start + self._batch_size]
+
+    def _get_loss(self, inputs: torch.Tensor,
+                  labels: torch.Tensor) -> torch.Tensor:
+        get_loss = getattr(self._model, 'get_loss', None)
+        if get_loss is not None:
+            return get_loss(inputs, labels)
+        _, loss = self._model(inputs, labels)
+        return loss
+
+    @profiling.profiled()
+    def _train_step(self, inputs: torch.Tensor,
+                    labels: torch.Tensor) -> torch.Tensor:
+        profiling.count('train_examples', inputs.shape[0])
+        loss = self._get_loss(inputs, labels)
+        self._model.reset_grad()
+        loss.backward()
+
+        learning_rate = self._schedule(self._step)
+        if self._optimizer is None:
+            self._model.update(learning_rate)
+        else:
+            self._model.update(learning_rate, self._optimizer)
+        self._step += 1
+        return loss.detach()
+
+    def _run_epoch(self, inputs: torch.Tensor,
+                   labels: torch.Tensor) -> tuple[float, int]:
+        """ Makes one pass over the dataset.
+
+        :return: A tuple containing the sum of the losses of every example and
+        the number of examples.
+        """
+
+        count = inputs.shape[0]
+        total_loss = 0.0
+        for batch in self._iter_batches(count):
+            if batch is None:
+                loss = self._train_step(inputs, labels)
+                total_loss += loss.item() * count
+            else:
+                loss = self._train_step(inputs[batch], labels[batch])
+                total_loss += loss.item() * batch.shape[0]
+        return total_loss, count
+
+    def evaluate(self, inputs: torch.Tensor, labels: torch.Tensor) -> float:
+        """ Computes the loss of the model on a dataset, without tracking
+        gradients.
+
+        :param inputs: The input tensor.
+        :param labels: The label tensor.
+        :return: The loss.
+        """
+
+        with torch.no_grad():
+            loss = self._get_loss(inputs, labels)
+        return loss.item()
+
+    def fit(self,
+            inputs: torch.Tensor,
+            labels: torch.Tensor,
+            validation: tuple[torch.Tensor, torch.Tensor] = None) -> list[dict]:
+        """ Trains the model on a dataset.
+
+        :param inputs: The input tensor.
+        :param labels: The label tensor.
+        :param validation: An optional tuple of validation inputs and labels,
+        used to report validation loss and for early stopping.
+        :return: A list with one entry per epoch, containing the mean training
+        loss, validation loss, learning rate and throughput in tokens (examples)
+        per second.
+        """
+
+        assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
+        assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #2)'
+        assert inputs.shape[0] == labels.shape[0], \
+            'Input and label shapes do not match (arg #1, #2)'
+        assert validation is None or len(validation) == 2, \
+            'Invalid validation (arg #3)'
+
+        history = []
+        best_loss = math.inf
+        stale_epochs = 0
+        for epoch in range(self._epochs):
+            start = time.perf_counter()
+            total_loss, count = self._run_epoch(inputs, labels)
+            elapsed = time.perf_counter() - start
+
+            stats = {
+                'epoch': epoch,
+                'loss': total_loss / count,
+                'validation_loss': None,
+                'learning_rate': self._schedule(self._step - 1),
+                'tokens_per_second': count / elapsed,
+            }
+            if validation is not None:
+                stats['validation_loss'] = self.evaluate(*validation)
+            history.append(stats)
+            _logger.debug('epoch=%d loss=%.6f validation_loss=%s '
+                          'tokens/sec=%.0f', epoch, stats['loss'],
+                          stats['validation_loss'],
+                          stats['tokens_per_second'])
+
+            if validation is not None and self._patience is not None:
+                if stats['validation_loss'] < best_loss:
+                    best_loss = stats['validation_loss']
+                    stale_epochs = 0
+                else:
+                    stale_epochs += 1
+                    if stale_epochs >= self._patience:
+                        _logger.info('Stopping early after epoch %d', epoch)
+                        break
+        return history
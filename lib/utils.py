@@ -1,29 +1,42 @@
-from typing import Callable
-import torch
+from typing import Callable, TYPE_CHECKING
 import random
+from .backends import get_backend, get_array_backend, seed_backends
+from .encoded_corpus import EncodedCorpus
+from . import profiling
 
-global global_generator
-global_generator = torch.Generator()
+if TYPE_CHECKING:
+    import torch
+
+
+def __getattr__(name: str):
+    # The global torch generator is created on first access, so that code that
+    # only uses the NumPy backend never imports torch.
+    if name == 'global_generator':
+        return get_backend('torch').generator
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def init_random(seed: int = 1337):
     """ Initializes a global random number generator with a seed.
 
     This method can be used to set random seed values to ensure reproducibility
-    in experiments. It sets both the PyTorch global generator and the Python
-    random module's seed.
+    in experiments. It sets the global generator of every array backend,
+    including the PyTorch global generator, and the Python random module's
+    seed.
 
     :param seed: The seed value to initialize the random number generator.
     """
 
-    global global_generator
-    global_generator = global_generator.manual_seed(seed)
+    seed_backends(seed)
     random.seed(seed)
 
 
-def prepare_data(words,
-                 transform: Callable[[list, list], tuple[torch.Tensor]],
-                 input_count: int = 1) -> tuple[torch.Tensor, torch.Tensor]:
+@profiling.profiled()
+def prepare_data(
+    words,
+    transform: Callable[[list, list], tuple['torch.Tensor']],
+    input_count: int = 1
+) -> tuple['torch.Tensor', 'torch.Tensor']:
     """ Prepares a dataset of words for training.
 
     This function takes a list of words and transforms them into a set of pairs
@@ -33,14 +46,23 @@ def prepare_data(words,
     Outputs can be transformed using a provided transform function, which is
     applied to both the input and label characters.
 
-    :param words: A list of Word objects representing the words to be used to
-    generate the dataset.
+    If an EncodedCorpus is provided instead of a list of words, pairs are
+    generated directly from its token buffer, and the transform receives index
+    tensors of shape (N, input_count) and (N, 1) instead of lists of character
+    tuples. The index tensors belong to the array backend of the corpus.
+
+    :param words: A list of Word objects or an EncodedCorpus representing the
+    words to be used to generate the dataset.
     :param transform: A function that transforms the input and label characters
     into a format suitable for training.
     :param input_count: The number of characters to be used to generate the
     input set.
     """
 
+    if isinstance(words, EncodedCorpus):
+        inputs, labels = words.get_pairs(input_count)
+        return transform(inputs), transform(labels)
+
     input_chars = []
     label_chars = []
     for word in words:
@@ -49,3 +71,205 @@ def prepare_data(words,
             label_chars.append(pair[1])
 
     return transform(input_chars), transform(label_chars)
+
+
+def split_data(
+    inputs: 'torch.Tensor',
+    labels: 'torch.Tensor',
+    fraction: float,
+    generator: 'torch.Generator' = None
+) -> tuple[tuple['torch.Tensor', 'torch.Tensor'], tuple['torch.Tensor',
+                                                       'torch.Tensor']]:
+    """ Randomly splits a dataset into two parts, typically a training set and
+    a held out validation set.
+
+    :param inputs: The input tensor.
+    :param labels: The label tensor.
+    :param fraction: The fraction of the examples placed in the second part.
+    :param generator: A torch generator object used to shuffle the examples.
+    The global generator is used if omitted.
+    :return: A tuple of two (inputs, labels) tuples.
+    """
+
+    import torch
+
+    assert isinstance(inputs, torch.Tensor), 'Invalid inputs (arg #1)'
+    assert isinstance(labels, torch.Tensor), 'Invalid labels (arg #2)'
+    assert 0 <= fraction <= 1, 'Invalid fraction (arg #3)'
+
+    if generator is None:
+        generator = get_backend('torch').generator
+
+    order = torch.randperm(inputs.shape[0], generator=generator)
+    split = inputs.shape[0] - int(inputs.shape[0] * fraction)
+    first, second = order[:split], order[split:]
+    return (inputs[first], labels[first]), (inputs[second], labels[second])
+
+
+@profiling.profiled()
+def generate_sequences(transitions: 'torch.Tensor',
+                       start_index: int,
+                       count: int,
+                       max_len: int,
+                       generator: 'torch.Generator' = None) -> 'torch.Tensor':
+    """ Samples a batch of sequences from a matrix of transition
+    probabilities, advancing every unfinished sequence by one step at a time.
+
+    Every sequence starts from start_index, and finishes when start_index is
+    sampled again, or when max_len indices have been sampled. Positions after
+    the end of a sequence are filled with start_index.
+
+    :param transitions: A square matrix in which row i holds the probability
+    distribution of the index that follows index i. Sampling uses the array
+    backend of the matrix.
+    :param start_index: The index used to start and terminate sequences.
+    :param count: The number of sequences to generate.
+    :param max_len: The maximum number of indices sampled for each sequence.
+    :param generator: A generator object of the backend of the matrix, used
+    to sample indices. The global generator of the backend is used if omitted.
+    :return: A tensor of shape (count, max_len) containing the sequences.
+    """
+
+    backend = get_array_backend(transitions)
+    assert count >= 0, 'Invalid count (arg #3)'
+    assert max_len > 0, 'Invalid max_len (arg #4)'
+
+    profiling.count('words_generated', count)
+    sequences = backend.full((count, max_len), start_index, backend.long)
+    active = backend.arange(count)
+    current = backend.full((count, ), start_index, backend.long)
+    for step in range(max_len):
+        if active.shape[0] == 0:
+            break
+        current = backend.sample(transitions[current], generator)
+        sequences[active, step] = current
+        running = current != start_index
+        active = active[running]
+        current = current[running]
+    return sequences
+
+
+@profiling.profiled()
+def search_sequences(
+    log_transitions: 'torch.Tensor',
+    start_index: int,
+    count: int,
+    prefix: 'torch.Tensor' = None,
+    min_len: int = 1,
+    max_len: int = 32
+) -> tuple['torch.Tensor', 'torch.Tensor']:
+    """ Finds the most likely sequences under a matrix of log transition
+    probabilities, without sampling.
+
+    Sequences are extended one index at a time, in batches of up to count
+    partial sequences. Each partial sequence is ranked by its log probability
+    plus the best log probability of any ending that respects the length
+    bounds, which is computed for every index and length ahead of the search.
+    Since this bound is exact, keeping the count best partial sequences of
+    each length finds the count best sequences, and partial sequences that
+    cannot beat the count best sequences found so far are pruned.
+
+    :param log_transitions: A square matrix in which row i holds the log
+    probability of each index following index i. The search uses the array
+    backend of the matrix.
+    :param start_index: The index used to start and terminate sequences.
+    :param count: The maximum number of sequences to return.
+    :param prefix: An optional one dimensional array of indices that every
+    sequence starts with, excluding start_index.
+    :param min_len: The minimum number of indices of each sequence, including
+    the prefix and excluding the termination index.
+    :param max_len: The maximum number of indices of each sequence, including
+    the prefix and excluding the termination index.
+    :return: A tuple containing a tensor of shape (N, max_len) with the
+    sequences, from most to least likely, and a tensor of shape (N, ) with
+    the log probability of each whole sequence, including its prefix and
+    termination index. Positions after the end of a sequence are filled with
+    start_index. N is smaller than count if fewer sequences are possible, and
+    is 0 if the model cannot produce the prefix.
+    """
+
+    backend = get_array_backend(log_transitions)
+    if prefix is None:
+        prefix = backend.zeros(0, backend.long)
+    prefix = backend.to(backend.asarray(prefix), backend.long)
+    assert count > 0, 'Invalid count (arg #3)'
+    assert prefix.ndim == 1 and prefix.shape[0] <= max_len and \
+        not (prefix == start_index).any(), 'Invalid prefix (arg #4)'
+    assert min_len >= 0, 'Invalid min_len (arg #5)'
+    assert max_len >= min_len, 'Invalid max_len (arg #6)'
+
+    vocabulary_size = log_transitions.shape[0]
+    negative_infinity = backend.full((), float('-inf'), log_transitions.dtype)
+    endings = log_transitions[:, start_index]
+    continuations = backend.where(
+        backend.arange(vocabulary_size)[None, :] == start_index,
+        negative_infinity, log_transitions)
+
+    # bounds[length][i] is the best log probability of ending a sequence of
+    # the given length whose last index is i.
+    bounds = [None] * (max_len + 1)
+    for length in range(max_len, prefix.shape[0] - 1, -1):
+        bound = endings if length >= min_len else \
+            backend.full((vocabulary_size, ), float('-inf'),
+                         log_transitions.dtype)
+        if length < max_len:
+            bound = backend.maximum(
+                bound,
+                backend.max_rows(continuations + bounds[length + 1][None, :]))
+        bounds[length] = bound
+
+    previous = backend.concatenate(
+        [backend.full((1, ), start_index, backend.long), prefix[:-1]])
+    sequences = backend.full((1, max_len), start_index, backend.long)
+    sequences[0, :prefix.shape[0]] = prefix
+    log_probs = log_transitions[previous, prefix].sum().reshape(1)
+    last = backend.full((1, ), start_index, backend.long) \
+        if prefix.shape[0] == 0 else prefix[-1:]
+
+    found = backend.zeros((0, max_len), backend.long)
+    found_log_probs = backend.zeros(0, log_transitions.dtype)
+    threshold = negative_infinity
+    for length in range(prefix.shape[0], max_len + 1):
+        if length >= min_len:
+            # Sequences that the model cannot produce are never returned.
+            candidates = log_probs + endings[last]
+            possible = candidates > negative_infinity
+            found = backend.concatenate([found, sequences[possible]])
+            found_log_probs = backend.concatenate(
+                [found_log_probs, candidates[possible]])
+            best = backend.top_k(found_log_probs,
+                                 min(count, found_log_probs.shape[0]))
+            found, found_log_probs = found[best], found_log_probs[best]
+            if found.shape[0] == count:
+                threshold = found_log_probs[-1]
+        if length == max_len:
+            break
+
+        # Every partial sequence is extended by every index, and the count
+        # best extensions that can still beat the threshold are kept.
+        extended = log_probs[:, None] + continuations[last]
+        ranks = (extended + bounds[length + 1][None, :]).reshape(-1)
+        extended = extended.reshape(-1)
+        best = backend.top_k(ranks, min(count, ranks.shape[0]))
+        best = best[ranks[best] > threshold]
+        if best.shape[0] == 0:
+            break
+        sequences = sequences[best // vocabulary_size]
+        last = best % vocabulary_size
+        sequences[:, length] = last
+        log_probs = extended[best]
+
+    profiling.count('words_searched', found.shape[0])
+    return found, found_log_probs
+
+
+def decode_sequences(sequences: 'torch.Tensor', encoder) -> list[str]:
+    """ Decodes a batch of index sequences into strings, stopping each
+    sequence at the first termination character.
+
+    :param sequences: A tensor of shape (N, L) containing vocabulary indices.
+    :param encoder: The encoder used to convert indices to characters.
+    :return: A list of N strings.
+    """
+
+    return encoder.decode(sequences)
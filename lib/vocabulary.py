@@ -0,0 +1,17 @@
+# Characters treated as line boundaries by str.splitlines(). These are never
+# part of the vocabulary.
+LINE_BREAKS = set('\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029')
+
+
+def build_vocabulary(text: str | set[str]) -> list[str]:
+    """ Builds a sorted vocabulary from the characters in the given text,
+    with the termination character at index 0.
+
+    :param text: The text, or set of characters, to build the vocabulary
+    from. Line breaks are excluded from the vocabulary.
+    """
+
+    vocabulary = list(set(text) - LINE_BREAKS)
+    vocabulary.sort()
+    vocabulary.insert(0, '.')
+    return vocabulary
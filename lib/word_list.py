@@ -1,35 +1,184 @@
+import codecs
+import mmap
+import os
+from typing import Iterator, TYPE_CHECKING
 from .word import Word
+from .backends import Backend, get_backend, get_default_backend_name
+from .vocabulary import LINE_BREAKS, build_vocabulary
+from . import profiling
+
+if TYPE_CHECKING:
+    from .encoded_corpus import EncodedCorpus
+
+# Number of bytes scanned at a time when indexing a file in streaming mode.
+_INDEX_BLOCK_SIZE = 1 << 24
+
+# UTF-8 encodings of the line breaks of str.splitlines(), other than '\r',
+# which is only a line break on its own when it is not followed by '\n'.
+_MULTI_BYTE_BREAKS = sorted(
+    char.encode('utf-8') for char in LINE_BREAKS if ord(char) >= 0x80)
+_SINGLE_BYTE_BREAKS = [
+    ord(char) for char in LINE_BREAKS if ord(char) < 0x80 and char != '\r'
+]
 
 
 class WordList:
     """ Represents a list of words.
     This class is used to manage a list of words, relying on lazy loading to
     load data from a file only when needed.
+
+    In streaming mode, the file is memory mapped instead of being read into
+    memory. A single pass over the file builds the vocabulary and an index of
+    line offsets, and words are only decoded when they are accessed. Streaming
+    mode splits lines like str.splitlines(), as the file is when it is read
+    into memory. The mapping can be released with close(), or by using the
+    word list as a context manager, and is created again if words are
+    accessed afterwards.
     """
 
-    def __init__(self, file_name: str):
+    def __init__(self,
+                 file_name: str,
+                 streaming: bool = False,
+                 chunk_size: int = 65536):
         """ Initializes the WordList object with a given file name.
 
         :param file_name: The name of the file containing the words to be
         loaded.
+        :param streaming: If True, the file is memory mapped and words are
+        decoded on demand.
+        :param chunk_size: The default number of words in each chunk returned
+        by iter_corpus() in streaming mode.
         """
         assert isinstance(file_name, str), 'Invalid file_name (arg #1)'
+        assert isinstance(streaming, bool), 'Invalid streaming (arg #2)'
+        assert chunk_size > 0, 'Invalid chunk_size (arg #3)'
         self._file_name = file_name
+        self._streaming = streaming
+        self._chunk_size = chunk_size
         self.__word_list = None
+        self.__corpus = None
+        self.__backend_corpora = {}
+        self.__mmap = None
+        self.__line_starts = None
         self.__vocab_list = None
+        self.__line_count = None
 
+    @profiling.profiled()
     def _ensure_data(self):
         if self.__word_list is None:
-            vocab = set()
             self.__word_list = []
             with open(self._file_name) as file:
                 for word_text in file.read().splitlines():
                     self.__word_list.append(Word(word_text))
-                    for char in word_text:
-                        vocab.add(char)
-            self.__vocab_list = list(vocab)
-            self.__vocab_list.sort()
-            self.__vocab_list.insert(0, '.')
+            profiling.count('words_loaded', len(self.__word_list))
+
+    @profiling.profiled()
+    def _ensure_corpus(self):
+        from .encoded_corpus import EncodedCorpus
+
+        if self.__corpus is None:
+            if self._streaming:
+                self.__corpus = EncodedCorpus.concatenate(
+                    list(self.iter_corpus()), self._vocabulary)
+            else:
+                self.__corpus = EncodedCorpus.from_file(self._file_name)
+
+    def __enter__(self) -> 'WordList':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Releases the memory mapping of the file in streaming mode. The
+        line index is kept, so the file must not be modified while the word
+        list is in use. """
+
+        if isinstance(self.__mmap, mmap.mmap):
+            self.__mmap.close()
+        self.__mmap = None
+
+    def _ensure_mmap(self) -> int:
+        if self.__mmap is None:
+            with open(self._file_name, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size > 0:
+                    # Copy on write mappings are writable, which allows
+                    # arrays to be created over them without copying.
+                    self.__mmap = mmap.mmap(file.fileno(),
+                                            0,
+                                            access=mmap.ACCESS_COPY)
+                else:
+                    self.__mmap = b''
+        return len(self.__mmap)
+
+    @staticmethod
+    def _find_line_ends(data, start: int, end: int):
+        # Returns the positions just after the line breaks that end within
+        # data[start:end]. Up to two preceding bytes are included to match
+        # multi-byte line breaks, and one following byte to match '\r\n'.
+        # The window is padded so that every byte has a following byte.
+        import numpy
+
+        before = min(start, 2)
+        window = numpy.append(data[start - before:end + 1], 0)
+        is_break = numpy.zeros(256, dtype=bool)
+        is_break[_SINGLE_BYTE_BREAKS] = True
+        breaks = is_break[window]
+        returns = numpy.flatnonzero(window[:-1] == ord('\r'))
+        breaks[returns] = window[returns + 1] != ord('\n')
+        # Blocks of ASCII text cannot contain multi-byte line breaks.
+        if window.max() >= 0x80:
+            for sequence in _MULTI_BYTE_BREAKS:
+                matches = window == sequence[-1]
+                for offset in range(1, len(sequence)):
+                    matches[:offset] = False
+                    matches[offset:] &= \
+                        window[:-offset] == sequence[-1 - offset]
+                breaks |= matches
+        return numpy.flatnonzero(
+            breaks[before:before + end - start]) + start + 1
+
+    @profiling.profiled()
+    def _ensure_index(self):
+        # The line index is built with NumPy, which is much lighter than
+        # torch, so that streaming word lists can be used with either array
+        # backend.
+        import numpy
+
+        if self.__line_starts is None:
+            size = self._ensure_mmap()
+            chars = set()
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            starts = [numpy.zeros(1, dtype=numpy.int64)]
+            data = numpy.frombuffer(self.__mmap, dtype=numpy.uint8) \
+                if size > 0 else numpy.zeros(0, dtype=numpy.uint8)
+            for start in range(0, size, _INDEX_BLOCK_SIZE):
+                end = min(start + _INDEX_BLOCK_SIZE, size)
+                starts.append(self._find_line_ends(data, start, end))
+                chars.update(decoder.decode(self.__mmap[start:end]))
+            chars.update(decoder.decode(b'', final=True))
+            # Arrays over the mapping would prevent close() from releasing it.
+            del data
+
+            # Words are read up to the next line start, so a final line
+            # without a trailing line break ends at the end of the file.
+            starts = numpy.concatenate(starts)
+            if starts[-1] != size:
+                starts = numpy.append(starts, size)
+            self.__line_starts = starts
+            self.__vocab_list = build_vocabulary(chars)
+
+    def _read_lines(self, start: int, stop: int) -> list[str]:
+        self._ensure_index()
+        if stop <= start:
+            return []
+        self._ensure_mmap()
+        first = self.__line_starts[start].item()
+        last = self.__line_starts[stop].item()
+        # Every line but the last one of the file ends with a line break, so
+        # that splitting the text gives one line per index entry.
+        return self.__mmap[first:last].decode('utf-8').splitlines()
 
     @property
     def _words(self):
@@ -38,16 +187,36 @@ class WordList:
 
     @property
     def _vocabulary(self):
-        self._ensure_data()
+        if self._streaming:
+            self._ensure_index()
+            return self.__vocab_list
+        if self.__corpus is not None:
+            return self.__corpus.vocabulary
+        self._ensure_text_stats()
         return self.__vocab_list
 
+    def _ensure_text_stats(self):
+        # The vocabulary and word count are read directly from the text, so
+        # that they are available without encoding the corpus.
+        if self.__vocab_list is None:
+            with open(self._file_name) as file:
+                text = file.read()
+            self.__vocab_list = build_vocabulary(set(text))
+            self.__line_count = len(text.splitlines())
+
     def __repr__(self) -> str:
         """ Representation of the WordList object."""
         return f'WordList(count={self.count}, vocab={self.vocabulary_size})'
 
     def __len__(self) -> int:
         """ Length of the word list."""
-        return len(self._words)
+        if self._streaming:
+            self._ensure_index()
+            return self.__line_starts.shape[0] - 1
+        if self.__corpus is not None:
+            return len(self.__corpus)
+        self._ensure_text_stats()
+        return self.__line_count
 
     def __getitem__(self, index: int) -> Word:
         """ Retrieves a word from the word list.
@@ -58,10 +227,19 @@ class WordList:
         """
         if isinstance(index, slice):
             start, stop, step = index.start, index.stop, index.step
-            return self._words[start:stop:step]
+            if not self._streaming:
+                return self._words[start:stop:step]
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return [Word(text) for text in self._read_lines(start, stop)]
+            return [self[position] for position in range(start, stop, step)]
         else:
             assert index >= 0, 'Invalid index (arg #1)'
-            return self._words[index]
+            if not self._streaming:
+                return self._words[index]
+            if index >= len(self):
+                raise IndexError('WordList index out of range')
+            return Word(self._read_lines(index, index + 1)[0])
 
     @property
     def vocabulary(self) -> int:
@@ -72,3 +250,77 @@ class WordList:
     def vocabulary_size(self) -> int:
         """ Returns the size of the vocabulary."""
         return len(self._vocabulary)
+
+    @property
+    def file_name(self) -> str:
+        """ Returns the name of the file containing the words."""
+        return self._file_name
+
+    @property
+    def streaming(self) -> bool:
+        """ Returns True if the word list is memory mapped."""
+        return self._streaming
+
+    @property
+    def corpus(self) -> 'EncodedCorpus':
+        """ Returns the words as an encoded corpus. The corpus is built directly
+        from the file, without creating Word objects. In streaming mode, this
+        encodes the whole file into memory; use iter_corpus() instead for
+        files that do not fit into memory."""
+        self._ensure_corpus()
+        return self.__corpus
+
+    def get_corpus(self, backend: str | Backend = None) -> 'EncodedCorpus':
+        """ Returns the words as an encoded corpus that uses the given array
+        backend. Corpora are cached per backend, and the corpus of the default
+        backend is the same object as the corpus property.
+
+        :param backend: The array backend of the corpus. Defaults to torch.
+        """
+        from .encoded_corpus import EncodedCorpus
+
+        backend = get_backend(backend)
+        if backend.name == get_default_backend_name():
+            return self.corpus
+        if backend.name not in self.__backend_corpora:
+            if self._streaming:
+                corpus = EncodedCorpus.concatenate(
+                    list(self.iter_corpus(backend=backend)), self._vocabulary,
+                    backend)
+            else:
+                corpus = EncodedCorpus.from_file(self._file_name, backend)
+            self.__backend_corpora[backend.name] = corpus
+        return self.__backend_corpora[backend.name]
+
+    def iter_corpus(
+            self,
+            chunk_size: int = None,
+            backend: str | Backend = None) -> Iterator['EncodedCorpus']:
+        """ Iterates over the words as a sequence of encoded corpora, each
+        containing up to chunk_size words.
+
+        :param chunk_size: The number of words in each chunk. If omitted, the
+        chunk size of the word list is used in streaming mode, and the whole
+        word list is returned as a single chunk otherwise.
+        :param backend: The array backend of the corpora. Defaults to torch.
+        """
+        from .encoded_corpus import EncodedCorpus
+
+        assert chunk_size is None or chunk_size > 0, \
+            'Invalid chunk_size (arg #1)'
+
+        if not self._streaming:
+            corpus = self.get_corpus(backend)
+            if chunk_size is None:
+                yield corpus
+                return
+            for start in range(0, len(corpus), chunk_size):
+                yield corpus[start:start + chunk_size]
+            return
+
+        if chunk_size is None:
+            chunk_size = self._chunk_size
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            lines = self._read_lines(start, stop)
+            yield EncodedCorpus.from_lines(lines, self._vocabulary, backend)
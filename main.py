@@ -1,64 +1,421 @@
-def run_simple_bigram(args, words=None, encoder=None):
+def get_option(args, name, default=None, convert=str):
+    prefix = f'--{name}='
+    for arg in args:
+        if arg.startswith(prefix):
+            return convert(arg[len(prefix):])
+    return default
+
+
+def load_dataset(args):
+    import time
+    from lib import WordList, BigramEncoder, DatasetCache
+
+    if '--stream' in args:
+        return WordList('data/names.txt', streaming=True), None
+
+    start = time.perf_counter()
+    cache = DatasetCache('data/names.txt', BigramEncoder)
+    corpus, inputs, labels = cache.get()
+    elapsed = (time.perf_counter() - start) * 1000
+    start_type = 'warm' if cache.hit else 'cold'
+    print(f'Loaded dataset in {elapsed:.2f} ms ({start_type} start)')
+    return corpus, (inputs, labels)
+
+
+def create_optimizer(name):
+    from lib import SGD, Adam
+
+    optimizers = {
+        'sgd': lambda: None,
+        'momentum': lambda: SGD(momentum=0.9),
+        'adam': lambda: Adam(),
+    }
+    return optimizers[name]()
+
+
+def load_model(load_file, backend=None):
+    from lib import SimpleBigram
+    from lib.checkpoint import read_checkpoint
+
+    metadata, _, _ = read_checkpoint(load_file, backend=backend)
+    if metadata['model'] == 'SimpleBigram':
+        return SimpleBigram.load(load_file, backend)
+    if backend not in (None, 'torch'):
+        raise ValueError(f'{metadata["model"]} requires the torch backend')
+
+    if metadata['model'] == 'QuantizedBigram':
+        from lib import QuantizedBigram
+        return QuantizedBigram.load(load_file)
+    if metadata['model'] == 'ContextMLP':
+        from lib import ContextMLP
+        return ContextMLP.load(load_file)
+
+    from lib import NeuronBigram
+    return NeuronBigram.load(load_file)
+
+
+def run_simple_bigram(args, dataset=None, encoder=None):
     from lib import WordList, BigramEncoder, SimpleBigram
     from lib import init_random
-    import torch
 
     init_random(2147483647)
 
-    if words is None:
-        words = WordList('data/names.txt')
+    backend = get_option(args, 'backend')
+    if dataset is None and backend not in (None, 'torch'):
+        # The dataset cache holds torch tensors, so other backends read the
+        # word list directly.
+        dataset = WordList('data/names.txt', streaming='--stream'
+                           in args), None
+    elif dataset is None:
+        dataset = load_dataset(args)
+    words, pairs = dataset
 
     if encoder is None:
         encoder = BigramEncoder(words.vocabulary)
 
-    simple_model = SimpleBigram(words, encoder)
+    workers = get_option(args, 'workers', 1, int)
+    if workers > 1:
+        # Sharded counting reads the file directly, in separate processes.
+        simple_model = SimpleBigram(WordList('data/names.txt', streaming=True),
+                                    encoder, workers, backend)
+    else:
+        simple_model = SimpleBigram(words, encoder, backend=backend)
 
-    inputs, labels = simple_model.prepare_data(words[:], encoder)
-    predictions, loss = simple_model(inputs, labels)
+    if pairs is None:
+        # Average the loss over chunks, weighted by the size of each chunk.
+        loss, total = 0, 0
+        for inputs, labels in simple_model.iter_data(words, encoder):
+            _, chunk_loss = simple_model(inputs, labels)
+            loss += chunk_loss * labels.shape[0]
+            total += labels.shape[0]
+        loss = loss / total
+    else:
+        inputs, labels = [
+            simple_model.prepare_indices(indices, encoder)
+            for indices in pairs
+        ]
+        predictions, loss = simple_model(inputs, labels)
 
     print('=== Simple model ===')
     print(f'loss={loss.item() if loss is not None else "None"}')
 
+    save_file = get_option(args, 'save')
+    if save_file is not None:
+        simple_model.save(save_file, encoder)
+
     return simple_model
 
 
-def run_neuron_bigram(args, words=None, encoder=None):
-    from lib import WordList, BigramEncoder, NeuronBigram, SimpleBigram
+def run_neuron_bigram(args, dataset=None, encoder=None):
+    from lib import BigramEncoder, NeuronBigram, Trainer
+    from lib import fit_parallel
+    from lib import profiling
+    from lib import split_data
     from lib import init_random
     import torch
 
     init_random(2147483647)
 
-    if words is None:
-        words = WordList('data/names.txt')
+    if dataset is None:
+        dataset = load_dataset(args)
+    words, pairs = dataset
 
     if encoder is None:
         encoder = BigramEncoder(words.vocabulary)
 
-    neuron_model = NeuronBigram(words.vocabulary_size)
+    neuron_model = NeuronBigram(words.vocabulary_size, use_indices=True)
 
-    inputs, labels = neuron_model.prepare_data(words[:], encoder)
-    loss = None
-    for iteration in range(500):
-        predictions, loss = neuron_model(inputs, labels=labels)
-        # print(f'[{iteration:>4}] {loss=:.8f}')
+    if pairs is None:
+        # Accumulate gradients over chunks, weighting each chunk by its size,
+        # so that every update matches a full batch update.
+        total = sum(len(corpus.tokens) - 1 for corpus in words.iter_corpus())
+        learning_rate = get_option(args, 'lr', 50.0, float)
+        optimizer = create_optimizer(get_option(args, 'optimizer', 'sgd'))
+        loss = None
+        for iteration in range(get_option(args, 'epochs', 500, int)):
+            with profiling.span('train_iteration'):
+                neuron_model.reset_grad()
+                loss = 0
+                for inputs, labels in neuron_model.iter_data(words, encoder):
+                    chunk_loss = neuron_model.get_loss(inputs, labels)
+                    chunk_loss = chunk_loss * (labels.shape[0] / total)
+                    chunk_loss.backward()
+                    loss += chunk_loss.detach()
+                neuron_model.update(learning_rate, optimizer)
+    else:
+        inputs, labels = [
+            neuron_model.prepare_indices(indices, encoder)
+            for indices in pairs
+        ]
+        validation = None
+        validation_fraction = get_option(args, 'validation', 0.0, float)
+        if validation_fraction > 0:
+            (inputs, labels), validation = split_data(inputs, labels,
+                                                      validation_fraction)
 
-        neuron_model.reset_grad()
-        loss.backward()
-        neuron_model.update(50)
+        options = {
+            'learning_rate': get_option(args, 'lr', 50.0, float),
+            'optimizer': create_optimizer(get_option(args, 'optimizer',
+                                                     'sgd')),
+            'batch_size': get_option(args, 'batch-size', None, int),
+            'epochs': get_option(args, 'epochs', 500, int),
+            'patience': get_option(args, 'patience', None, int),
+        }
+        threads = get_option(args, 'threads', None, int)
+        workers = get_option(args, 'workers', 1, int)
+        if workers > 1:
+            history = fit_parallel(neuron_model,
+                                   inputs,
+                                   labels,
+                                   workers=workers,
+                                   threads=threads,
+                                   validation=validation,
+                                   **options)
+        else:
+            if threads is not None:
+                torch.set_num_threads(threads)
+            trainer = Trainer(neuron_model, **options)
+            history = trainer.fit(inputs, labels, validation)
+        loss = torch.tensor(history[-1]['loss'])
+        print(f'tokens/sec={history[-1]["tokens_per_second"]:.0f}')
+        if validation is not None:
+            print(f'validation_loss={history[-1]["validation_loss"]}')
 
     print('=== Neuron model ===')
     print(f'loss={loss.item() if loss is not None else "None"}')
+
+    save_file = get_option(args, 'save')
+    if save_file is not None:
+        neuron_model.save(save_file, encoder)
     return neuron_model
 
 
-def run_all_bigrams(args):
-    from lib import init_random, WordList, BigramEncoder
+def run_context_mlp(args):
+    from lib import ContextEncoder, ContextMLP, Trainer
+    from lib import split_data
+    from lib import init_random
 
-    words = WordList('data/names.txt')
+    init_random(2147483647)
+
+    words, _ = load_dataset(args)
+    encoder = ContextEncoder(words.vocabulary,
+                             get_option(args, 'context', 3, int))
+    mlp_model = ContextMLP(words.vocabulary_size,
+                           context_length=encoder.context_length,
+                           embedding_size=get_option(args, 'embedding', 10,
+                                                     int),
+                           hidden_size=get_option(args, 'hidden', 200, int))
+
+    inputs, labels = mlp_model.prepare_data(words, encoder)
+    validation = None
+    validation_fraction = get_option(args, 'validation', 0.0, float)
+    if validation_fraction > 0:
+        (inputs, labels), validation = split_data(inputs, labels,
+                                                  validation_fraction)
+
+    trainer = Trainer(
+        mlp_model,
+        learning_rate=get_option(args, 'lr', 0.1, float),
+        optimizer=create_optimizer(get_option(args, 'optimizer', 'sgd')),
+        batch_size=get_option(args, 'batch-size', 256, int),
+        epochs=get_option(args, 'epochs', 10, int),
+        patience=get_option(args, 'patience', None, int))
+    history = trainer.fit(inputs, labels, validation)
+
+    print(f'=== {mlp_model} ===')
+    print(f'tokens/sec={history[-1]["tokens_per_second"]:.0f}')
+    print(f'loss={history[-1]["loss"]}')
+    if validation is not None:
+        print(f'validation_loss={history[-1]["validation_loss"]}')
+
+    init_random(2147483647)
+    for word in mlp_model.generate_words(encoder, 5):
+        print(word)
+
+    save_file = get_option(args, 'save')
+    if save_file is not None:
+        mlp_model.save(save_file, encoder)
+    return mlp_model
+
+
+def run_simple_ngram(args):
+    from lib import BigramEncoder, SimpleNgram
+    from lib import init_random
+
+    init_random(2147483647)
+
+    words, _ = load_dataset(args)
     encoder = BigramEncoder(words.vocabulary)
-    neuron_model = run_neuron_bigram(args, words, encoder)
-    simple_model = run_simple_bigram(args, words, encoder)
+    ngram_model = SimpleNgram(words,
+                              encoder,
+                              n=get_option(args, 'n', 3, int),
+                              k=get_option(args, 'k', 0.0, float),
+                              discount=get_option(args, 'discount', 0.75,
+                                                  float))
+
+    inputs, labels = ngram_model.prepare_data(words, encoder)
+    predictions, loss = ngram_model(inputs, labels)
+
+    print(f'=== Simple {ngram_model.n}-gram model ===')
+    print(f'loss={loss.item() if loss is not None else "None"}')
+
+    init_random(2147483647)
+    for word in ngram_model.generate_words(encoder, 5):
+        print(word)
+    return ngram_model
+
+
+def run_generate(args):
+    import time
+    from lib import init_random
+
+    load_file = get_option(args, 'load')
+    if load_file is None:
+        print('A checkpoint must be specified using --load=FILE')
+        return
+
+    start = time.perf_counter()
+    model, encoder = load_model(load_file, get_option(args, 'backend'))
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f'Loaded {model} in {elapsed:.2f} ms')
+
+    init_random(2147483647)
+    for word in model.generate_words(encoder, get_option(args, 'count', 5,
+                                                         int)):
+        print(word)
+    return model
+
+
+def run_top(args):
+    from lib import BigramEncoder, SimpleBigram
+
+    load_file = get_option(args, 'load')
+    if load_file is not None:
+        model, encoder = load_model(load_file, get_option(args, 'backend'))
+    else:
+        words, _ = load_dataset(args)
+        encoder = BigramEncoder(words.vocabulary)
+        model = SimpleBigram(words, encoder)
+    if not hasattr(model, 'top_words'):
+        print(f'{model} does not support searching for the top words')
+        return
+
+    count = get_option(args, 'count', 10, int)
+    prefix = get_option(args, 'prefix', '')
+    index_file = get_option(args, 'index')
+    if index_file is not None:
+        from lib import PrefixIndex
+
+        index = PrefixIndex.load(index_file)
+        # Words are scored by the model, so the index must use the same
+        # vocabulary, like the index of a NameServer.
+        if index.vocabulary != list(encoder.vocabulary):
+            print(f'The vocabulary of {index} does not match the model')
+            return
+        results = index.complete(prefix, count, model, encoder)
+        print(f'=== Completions {index} {model} ===')
+        for rank, (word, word_count, log_prob) in enumerate(results):
+            print(f'{rank + 1:>5} {word:<20} count={word_count:<6} '
+                  f'log_prob={log_prob:.4f}')
+        return results
+
+    results = model.top_words(encoder,
+                              count,
+                              prefix=prefix,
+                              min_len=get_option(args, 'min-len', 1, int),
+                              max_len=get_option(args, 'max-len', 32, int))
+    print(f'=== Top words {model} ===')
+    for rank, (word, log_prob) in enumerate(results):
+        print(f'{rank + 1:>5} {word:<20} log_prob={log_prob:.4f}')
+    return results
+
+
+def run_index(args):
+    import time
+    from lib import WordList, PrefixIndex
+
+    save_file = get_option(args, 'save')
+    if save_file is None:
+        print('An output file must be specified using --save=FILE')
+        return
+
+    file_name = get_option(args, 'file', 'data/names.txt')
+    start = time.perf_counter()
+    index = PrefixIndex(WordList(file_name))
+    elapsed = (time.perf_counter() - start) * 1000
+    index.save(save_file)
+    print(f'Built {index} from {file_name} in {elapsed:.2f} ms '
+          f'({index.nbytes} bytes)')
+    return index
+
+
+def run_export(args):
+    from lib import QuantizedBigram
+
+    load_file = get_option(args, 'load')
+    save_file = get_option(args, 'save')
+    if load_file is None or save_file is None:
+        print('A checkpoint must be specified using --load=FILE, and an '
+              'output file using --save=FILE')
+        return
+
+    model, encoder = load_model(load_file)
+    quantized_model = QuantizedBigram.export(
+        model,
+        precision=get_option(args, 'precision', 'float16'),
+        log_probs='--no-log-probs' not in args)
+    quantized_model.save(save_file, encoder)
+    print(f'Exported {model} as {quantized_model} '
+          f'({quantized_model.nbytes} bytes)')
+    return quantized_model
+
+
+def run_serve(args):
+    import asyncio
+    from lib import BigramEncoder, SimpleBigram, init_random
+    from lib.server import NameServer
+
+    init_random(2147483647)
+
+    load_file = get_option(args, 'load')
+    if load_file is not None:
+        model, encoder = load_model(load_file, get_option(args, 'backend'))
+    else:
+        words, _ = load_dataset(args)
+        encoder = BigramEncoder(words.vocabulary)
+        model = SimpleBigram(words, encoder)
+
+    index_file = get_option(args, 'index')
+    if index_file is not None:
+        from lib import PrefixIndex
+
+        index = PrefixIndex.load(index_file)
+    else:
+        index = None
+
+    server = NameServer(model,
+                        encoder,
+                        max_batch_size=get_option(args, 'max-batch-size', 64,
+                                                  int),
+                        max_wait=get_option(args, 'max-wait-ms', 5.0, float) /
+                        1000,
+                        index=index)
+    host = get_option(args, 'host', '127.0.0.1')
+    port = get_option(args, 'port', 8000, int)
+    print(f'Serving {model} on http://{host}:{port}')
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_all_bigrams(args):
+    from lib import init_random, BigramEncoder
+
+    dataset = load_dataset(args)
+    encoder = BigramEncoder(dataset[0].vocabulary)
+    neuron_model = run_neuron_bigram(args, dataset, encoder)
+    simple_model = run_simple_bigram(args, dataset, encoder)
 
     print('')
     for model in [simple_model, neuron_model]:
@@ -68,6 +425,33 @@ def run_all_bigrams(args):
             print(model.generate_word(encoder))
 
 
+def run_vocabulary(args):
+    from lib import WordList
+
+    file_name = get_option(args, 'file', 'data/names.txt')
+    word_list = WordList(file_name)
+    vocabulary = word_list.vocabulary
+    print(f'Vocabulary ({len(vocabulary)}): {"".join(vocabulary)}')
+
+
+def run_benchmarks(args):
+    import sys
+    from benchmarks import BENCHMARKS
+
+    benchmark_name = args[1] if len(args) > 1 else ''
+    benchmark = BENCHMARKS.get(benchmark_name, None)
+    if benchmark is not None:
+        benchmark[0](args[2:])
+    else:
+        print(f'Invalid benchmark: {benchmark_name}\n')
+        print('Supported benchmarks:')
+        for key in BENCHMARKS:
+            _, desc = BENCHMARKS[key]
+            print(f' {key:<10}: {desc}')
+        print('')
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     import sys
     import logging
@@ -82,18 +466,67 @@ if __name__ == '__main__':
         'all-bigrams':
         (run_all_bigrams, 'Runs both bigram models side by side'),
         'simple-bigram':
-        (run_simple_bigram, 'Evaluates the simple bigram model'),
+        (run_simple_bigram,
+         'Evaluates the simple bigram model (--workers=N)'),
         'neuron-bigram':
         (run_neuron_bigram, 'Evaluates the neuron bigram model'),
+        'context-mlp':
+        (run_context_mlp, 'Trains the MLP context model (--context=N)'),
+        'simple-ngram':
+        (run_simple_ngram, 'Evaluates the sparse n-gram model '
+         '(--n=N --k=X --discount=X)'),
+        'generate':
+        (run_generate, 'Generates words from a checkpoint (--load=FILE)'),
+        'top':
+        (run_top, 'Lists the most likely words (--prefix=P --count=N)'),
+        'index':
+        (run_index, 'Builds a prefix index of a word list (--save=FILE)'),
+        'export':
+        (run_export, 'Exports an inference-only bigram checkpoint'),
+        'serve':
+        (run_serve, 'Serves generation and scoring requests over HTTP'),
+        'vocabulary':
+        (run_vocabulary, 'Prints the vocabulary of a word list (--file=FILE)'),
+        'benchmarks':
+        (run_benchmarks, 'Runs a named performance benchmark'),
     }
     args = sys.argv
     command_name = args[1] if len(args) > 1 else ''
     command = command_map.get(command_name, None)
     if command is not None:
+        profile = '--profile' in args or get_option(args, 'profile-trace')
+        if profile:
+            from lib import profiling
+            profiling.enable()
         command[0](args[1:])
+        if profile:
+            print('=== Profile ===')
+            print(profiling.get_summary())
+            trace_file = get_option(args, 'profile-trace')
+            if trace_file is not None:
+                profiling.write_trace(trace_file)
+                print(f'Trace written to {trace_file}')
     else:
         print(f'Invalid args: {sys.argv[1:]}\n')
-        print(f'Usage: {args[0]} <command_name> [command_args]')
+        print(f'Usage: {args[0]} <command_name> [command_args] [--stream] '
+              '[--profile] [--profile-trace=FILE]')
+        print('Training options for neuron-bigram: --epochs=N --lr=X '
+              '--batch-size=N --optimizer=sgd|momentum|adam '
+              '--validation=FRACTION --patience=N --workers=N --threads=N')
+        print('Model options for context-mlp: --context=N --embedding=N '
+              '--hidden=N, with the training options of neuron-bigram')
+        print('Checkpoint options: --save=FILE for simple-bigram, '
+              'neuron-bigram and context-mlp, --load=FILE --count=N for '
+              'generate')
+        print('Search options for top: --load=FILE --count=N --prefix=P '
+              '--min-len=N --max-len=N --index=FILE')
+        print('Index options for index: --file=FILE --save=FILE')
+        print('Export options: --load=FILE --save=FILE '
+              '--precision=float32|float16|bfloat16|int8 --no-log-probs')
+        print('Server options for serve: --load=FILE --host=HOST --port=N '
+              '--max-batch-size=N --max-wait-ms=X --index=FILE')
+        print('Array backend for simple-bigram, generate, top and serve: '
+              '--backend=torch|numpy')
         print('Supported commands:')
         for key in command_map:
             command, desc = command_map[key]